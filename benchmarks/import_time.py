@@ -0,0 +1,72 @@
+#!/usr/bin/env python2
+#
+# -*- coding: utf-8 -*-
+#
+#   Import time benchmark for utils package
+#
+#   Copyright (C) 2026 by sK1 Project contributors
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#   Every case runs in a fresh interpreter:
+#       python2 benchmarks/import_time.py [repeats]
+#   'legacy probes' is the cost SystemFacts used to pay at import
+#   (platform.dist() and platform.architecture()).
+
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+CASES = [
+    ('import utils.dist',
+     'import utils.dist'),
+    ('import utils.bbox, utils.dependencies',
+     'import utils.bbox, utils.dependencies'),
+    ('SYSFACTS resolution',
+     'from utils.dist import SYSFACTS; SYSFACTS.sid; SYSFACTS.is_64bit; '
+     'SYSFACTS.is_src; SYSFACTS.marker'),
+    ('legacy probes',
+     'import platform; platform.dist(); platform.architecture()'),
+]
+
+TIMER = 'import time; t = time.time(); %s; ' \
+        'import sys; sys.stdout.write(repr(time.time() - t))'
+
+
+def measure(code, repeats):
+    samples = []
+    for _i in range(repeats):
+        output = subprocess.check_output(
+            [sys.executable, '-S', '-c', TIMER % code], cwd=SRC_DIR)
+        samples.append(float(output))
+    samples.sort()
+    return samples[len(samples) // 2], samples[0]
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print '%-40s %12s %12s' % ('case', 'median, ms', 'best, ms')
+    for name, code in CASES:
+        try:
+            median, best = measure(code, repeats)
+        except subprocess.CalledProcessError:
+            print '%-40s %12s %12s' % (name, 'n/a', 'n/a')
+            continue
+        print '%-40s %12.2f %12.2f' % (name, median * 1000, best * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python2
+#
+# -*- coding: utf-8 -*-
+#
+#   Packaging hot paths benchmark
+#
+#   Copyright (C) 2026 by sK1 Project contributors
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#   Generates synthetic project tree and times packaging routines
+#   on it. Works offline, cases requiring missing tools
+#   (genisoimage) are skipped:
+#       python2 benchmarks/packaging.py --files 5000 --catalogs 20
+#       python2 benchmarks/packaging.py --save-baseline
+#       python2 benchmarks/packaging.py --only 'po:*'
+#   Every run is appended to JSON history, medians are compared
+#   with stored baseline and regressions above threshold make
+#   exit code non-zero.
+
+import datetime
+import fnmatch
+import json
+import optparse
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from cStringIO import StringIO
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils import build, fsutils, po  # noqa: E402
+from utils.xmlutils import XmlElement  # noqa: E402
+
+CACHE_DIR = os.path.expanduser('~/.cache/build-utils')
+HISTORY_FILE = os.path.join(CACHE_DIR, 'bench-history.json')
+BASELINE_FILE = os.path.join(CACHE_DIR, 'bench-baseline.json')
+
+WORDS = ('file', 'open', 'save', 'close', 'page', 'layer', 'color', 'fill',
+         'stroke', 'text', 'image', 'export', 'import', 'print', 'zoom')
+
+
+# --- Synthetic project
+
+def random_size(rnd, options):
+    # log-normal distribution, most files are small
+    size = int(rnd.lognormvariate(0, 1.2) * options.mean_size)
+    return max(options.min_size, min(options.max_size, size))
+
+
+def make_po(path, lang, count, rnd):
+    lines = ['msgid ""', 'msgstr ""',
+             '"Content-Type: text/plain; charset=UTF-8\\n"',
+             '"Plural-Forms: nplurals=2; plural=(n != 1);\\n"', '']
+    for index in range(count):
+        words = ' '.join(rnd.choice(WORDS) for _i in range(4))
+        msgid = '%s %d' % (words.capitalize(), index)
+        if index % 10 == 0:
+            lines += ['msgid "%s file"' % msgid,
+                      'msgid_plural "%s files"' % msgid,
+                      'msgstr[0] "%s: %s file"' % (lang, msgid),
+                      'msgstr[1] "%s: %s files"' % (lang, msgid), '']
+        else:
+            lines += ['msgid "%s"' % msgid,
+                      'msgstr "%s: %s"' % (lang, msgid), '']
+    with open(path, 'wb') as fileptr:
+        fileptr.write('\n'.join(lines))
+
+
+def make_tree(root, options):
+    """
+    Creates root/src/<app> package tree, root/share resources
+    and root/po catalogs. Returns dict of paths.
+    """
+    rnd = random.Random(options.seed)
+    src = os.path.join(root, 'src')
+    app = os.path.join(src, 'benchapp')
+    share = os.path.join(root, 'share')
+    dirs = [app]
+    for level in range(options.depth):
+        for parent in list(dirs):
+            if parent.count(os.sep) - app.count(os.sep) != level:
+                continue
+            for index in range(options.fanout):
+                dirs.append(os.path.join(parent, 'pkg%d_%d' % (level, index)))
+    for path in dirs:
+        os.makedirs(path)
+        with open(os.path.join(path, '__init__.py'), 'wb') as fileptr:
+            fileptr.write('# package\n')
+    os.makedirs(share)
+    for index in range(options.files):
+        size = random_size(rnd, options)
+        if index % 3:
+            path = os.path.join(rnd.choice(dirs), 'mod%d.py' % index)
+            data = ('x%d = %d\n' % (index, index)) * (size // 12 + 1)
+        else:
+            path = os.path.join(share, 'res%d.dat' % index)
+            data = os.urandom(size)
+        with open(path, 'wb') as fileptr:
+            fileptr.write(data[:size])
+
+    po_dir = os.path.join(root, 'po')
+    os.makedirs(po_dir)
+    for index in range(options.catalogs):
+        lang = 'l%02d' % index
+        make_po(os.path.join(po_dir, lang + '.po'), lang,
+                options.messages, rnd)
+    return {'root': root, 'src': src, 'app': app, 'share': share,
+            'po': po_dir}
+
+
+def make_xml(count):
+    root = XmlElement('installer-gui-script', {'minSpecVersion': '1'})
+    for index in range(count):
+        item = XmlElement('pkg-ref', {'id': 'pkg%d' % index,
+                                      'version': '1.0', 'auth': 'Root',
+                                      'installKBytes': str(index)},
+                          content='#base%d.pkg' % index)
+        root.add(item)
+    return root
+
+
+# --- Helpers
+
+def which(name):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(path, name), os.X_OK):
+            return True
+    return False
+
+
+class Quiet(object):
+    """
+    Suppresses stdout/stderr of measured code and its subprocesses.
+    """
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = [os.dup(1), os.dup(2)]
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        os.close(devnull)
+
+    def __exit__(self, *args):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        for fd in self.saved:
+            os.close(fd)
+
+
+# --- Cases
+
+def case_deb(paths, workdir):
+    from utils.deb import DebBuilder
+
+    project = os.path.join(workdir, 'deb')
+    if os.path.isdir(project):
+        shutil.rmtree(project)
+    version = '.'.join(sys.version.split()[0].split('.')[:2])
+    lib = os.path.join(project, 'build',
+                       'lib.linux-%s-%s' % (platform.machine(), version))
+    shutil.copytree(paths['app'], os.path.join(lib, 'benchapp'))
+    share = fsutils.get_filepaths(paths['share'])
+
+    def run():
+        builder = DebBuilder(
+            name='benchapp', version='1.0', arch='all',
+            maintainer='Bench <bench@localhost>',
+            description='benchmark package',
+            package_dirs={'benchapp': 'src/benchapp'},
+            data_files=[('/usr/share/benchapp', share)])
+        if builder.status:
+            raise RuntimeError('DebBuilder failed')
+
+    return run, project
+
+
+def get_cases(paths, workdir, options):
+    """
+    Returns list of (name, required tools, prepare) items.
+    prepare() returns measured callable and optional directory
+    to run it in.
+    """
+    xml = make_xml(options.files)
+    locales = os.path.join(workdir, 'locales')
+
+    def payload():
+        from utils.pkg import PkgBuilder
+
+        class Payload(PkgBuilder):
+            # payload stage only, without full package build
+            def __init__(self):
+                self.kwargs = {'src_dir': paths['share']}
+                self.pkg_dir = os.path.join(workdir, 'pkg')
+
+        builder = Payload()
+        os.makedirs(builder.pkg_dir)
+        run = builder.create_payload
+
+        return run, None
+
+    def dmg():
+        from utils.dmg import dmg_build
+
+        def run():
+            dmg_build(targets=[paths['share']], dmg_filename='bench.dmg',
+                      dist_dir=os.path.join(workdir, 'dmg'))
+
+        return run, workdir
+
+    def write_xml():
+        return (lambda: xml.write_xml(StringIO())), None
+
+    def build_locales():
+        def run():
+            shutil.rmtree(locales, True)
+            po.build_locales(paths['po'], locales, 'bench')
+
+        return run, None
+
+    def simple(func, *args):
+        return lambda: ((lambda: func(*args)), None)
+
+    return [
+        ('fsutils:get_files_tree', [],
+         simple(fsutils.get_files_tree, paths['root'])),
+        ('fsutils:getsize', [], simple(fsutils.getsize, paths['root'], True)),
+        ('build:get_packages', [], simple(build.get_packages, paths['src'])),
+        ('build:get_source_structure', [],
+         simple(build.get_source_structure, paths['src'])),
+        ('xml:write_xml', [], write_xml),
+        ('po:build_locales', [], build_locales),
+        ('pkg:create_payload', [], payload),
+        ('dmg:dmg_build', ['genisoimage'], dmg),
+        ('deb:DebBuilder', [],
+         lambda: case_deb(paths, workdir)),
+    ]
+
+
+def measure(prepare, repeats):
+    func, cwd = prepare()
+    saved = os.getcwd()
+    samples = []
+    try:
+        if cwd:
+            os.chdir(cwd)
+        for _i in range(repeats):
+            with Quiet():
+                start = time.time()
+                func()
+                samples.append(time.time() - start)
+    finally:
+        os.chdir(saved)
+    samples.sort()
+    return {'median': samples[len(samples) // 2], 'min': samples[0]}
+
+
+# --- History and baseline
+
+def load_json(path, default):
+    if not os.path.isfile(path):
+        return default
+    with open(path) as fileptr:
+        return json.load(fileptr)
+
+
+def save_json(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fileptr:
+        json.dump(data, fileptr, indent=1, sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns {case: change ratio} and list of regressed cases.
+    """
+    changes = {}
+    regressions = []
+    for name, item in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base['median']:
+            continue
+        changes[name] = item['median'] / base['median'] - 1.0
+        if changes[name] > threshold:
+            regressions.append(name)
+    return changes, regressions
+
+
+def parse_args():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    add = parser.add_option
+    add('--files', type='int', default=2000, help='number of files')
+    add('--depth', type='int', default=3, help='package tree depth')
+    add('--fanout', type='int', default=3, help='subpackages per package')
+    add('--mean-size', type='int', default=4096, help='mean file size')
+    add('--min-size', type='int', default=16, help='minimal file size')
+    add('--max-size', type='int', default=1 << 20, help='maximal file size')
+    add('--catalogs', type='int', default=10, help='number of .po catalogs')
+    add('--messages', type='int', default=500, help='messages per catalog')
+    add('--seed', type='int', default=1, help='tree generator seed')
+    add('--repeats', type='int', default=5, help='runs per case')
+    add('--only', default='', help='comma separated case patterns')
+    add('--history', default=HISTORY_FILE, help='history file')
+    add('--baseline', default=BASELINE_FILE, help='baseline file')
+    add('--save-baseline', action='store_true',
+        help='store results as new baseline')
+    add('--threshold', type='float', default=0.10,
+        help='allowed slowdown against baseline (0.10 = 10%)')
+    return parser.parse_args()[0]
+
+
+def main():
+    options = parse_args()
+    config = dict((key, getattr(options, key)) for key in (
+        'files', 'depth', 'fanout', 'mean_size', 'min_size', 'max_size',
+        'catalogs', 'messages', 'seed'))
+    patterns = [item for item in options.only.split(',') if item]
+    workdir = tempfile.mkdtemp(prefix='build-utils-bench-')
+    results = {}
+    try:
+        paths = make_tree(os.path.join(workdir, 'project'), options)
+        print 'Synthetic tree: %d files, %d bytes in %s' % (
+            fsutils.getsize(paths['root'], True)[::-1] + (workdir,))
+        baseline = load_json(options.baseline, {})
+        if baseline and baseline.get('config') != config:
+            print 'WARNING: baseline was recorded with other tree config'
+        print '%-28s %12s %12s %12s %8s' % (
+            'case', 'median, ms', 'best, ms', 'baseline', 'change')
+        for name, tools, prepare in get_cases(paths, workdir, options):
+            if patterns and not any(fnmatch.fnmatch(name, pattern)
+                                    for pattern in patterns):
+                continue
+            missing = [tool for tool in tools if not which(tool)]
+            if missing:
+                print '%-28s skipped (no %s)' % (name, ', '.join(missing))
+                continue
+            try:
+                results[name] = measure(prepare, options.repeats)
+            except Exception as e:
+                print '%-28s failed: %s' % (name, e)
+                continue
+            base = baseline.get('results', {}).get(name)
+            change = ''
+            if base and base['median']:
+                change = '%+.1f%%' % (
+                    (results[name]['median'] / base['median'] - 1) * 100)
+            print '%-28s %12.2f %12.2f %12s %8s' % (
+                name, results[name]['median'] * 1000,
+                results[name]['min'] * 1000,
+                '%.2f' % (base['median'] * 1000) if base else '-', change)
+    finally:
+        shutil.rmtree(workdir, True)
+
+    record = {
+        'time': datetime.datetime.now().isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'config': config,
+        'results': results,
+    }
+    history = load_json(options.history, [])
+    history.append(record)
+    save_json(options.history, history)
+    if options.save_baseline:
+        save_json(options.baseline, record)
+        print 'Baseline saved to %s' % options.baseline
+        return 0
+
+    _changes, regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        print 'REGRESSIONS (> %d%%): %s' % (options.threshold * 100,
+                                          ', '.join(sorted(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -33,18 +33,42 @@
 #       ftp_user - upload server user
 #       ftp_pass - ftp user pass
 #       timestamp - optional build marker (like 20170624)
+#       ref - optional git ref to build (HEAD by default)
+#       sparse - optional comma separated sparse checkout patterns
+#       profile - optional directory for stage profiles (.pstats)
+#       profile_memory - optional flag to add allocation reports
+#       trace - optional path to write Chrome trace of build stages
+#
+#   With mode=daemon agent stays resident and accepts build jobs over
+#   socket (port=, host=, token= args), see serve(). Agent listens on
+#   127.0.0.1 by default, other addresses require token.
+#   With mode=worker agent pulls jobs from farm work queue
+#   (controller=host:port, agent=, targets=, token= args), see pull_jobs().
+#   Queue jobs carry no credentials, ftp_user and ftp_pass are taken
+#   from agent args.
 #
 #   To execute sudo you need adding in /etc/sudoers following line:
 #   username ALL = NOPASSWD: ALL
 
+import Queue
+import cProfile
+import calendar
+import contextlib
 import datetime
 import ftplib
+import hashlib
+import json
 import ntpath
 import os
 import platform
 import shutil
+import socket
+import subprocess
 import sys
+import tempfile
+import threading
 import time
+import urllib2
 
 from zipfile import ZIP_DEFLATED
 from zipfile import ZipFile
@@ -63,6 +87,8 @@ DATASET = {
     # release - to prepare release build
     # build - to build package only
     # test - to run in test mode
+    # daemon - to stay resident and run jobs received on port=
+    # worker - to pull jobs from farm work queue on controller=
     'app_name': 'sk1',
     'app_ver': '2.0rc3',
     'project': 'sk1-wx',
@@ -79,6 +105,27 @@ DATASET = {
     'script': 'setup-sk1.py',
     'script2': 'setup-sk1-msw.py',
 }
+DEFAULTS = dict(DATASET)
+
+AGENT_PORT = 8890
+
+# Number of cached project builds kept on host
+BUILD_CACHE_SIZE = 5
+
+# Markers of started uploads which can be resumed
+UPLOADS_DIR = os.path.expanduser(os.path.join('~', 'buildfarm', 'uploads'))
+
+# Published artifacts and stage timings of current build
+ARTIFACTS = []
+# (path, artifact) of files identical to already published ones
+ALIASES = []
+TIMINGS = {}
+# project name -> checked out commit
+COMMITS = {}
+# Chrome trace events of current build
+TRACE = []
+# Set in daemon and worker modes: updated agent restarts between jobs
+RESIDENT = False
 
 WINDOWS = 'Windows'
 LINUX = 'Linux'
@@ -115,6 +162,15 @@ MARKERS = {
     OPENSUSE: 'opensuse',
 }
 
+# Distro names used in farm VM (target) names
+TARGET_NAMES = {
+    MINT: 'LinuxMint',
+    UBUNTU: 'Ubuntu',
+    DEBIAN: 'Debian',
+    FEDORA: 'Fedora',
+    OPENSUSE: 'OpenSuse',
+}
+
 
 def is_deb():
     return platform.dist()[0] in [MINT, UBUNTU, DEBIAN]
@@ -173,6 +229,22 @@ def get_marker():
     return MARKERS[platform.dist()[0]]
 
 
+def get_targets():
+    """
+    Returns farm target names matching current platform,
+    like ['Ubuntu 16.04 64bit', 'Ubuntu 16.04'].
+    """
+    bits = platform.architecture()[0]
+    if is_msw():
+        name = 'Win%s' % platform.release()
+    elif is_linux():
+        dist, ver = platform.dist()[:2]
+        name = '%s %s' % (TARGET_NAMES.get(dist, dist), ver)
+    else:
+        name = '%s %s' % (platform.system(), platform.release())
+    return ['%s %s' % (name, bits), name]
+
+
 def get_package_name(pth):
     files = []
     file_items = os.listdir(pth)
@@ -195,8 +267,239 @@ def get_package_name(pth):
     raise Error('Build failed! There is no build result.')
 
 
-def command(exec_cmd):
-    os.system(exec_cmd)
+PROFILING = threading.local()
+
+
+@contextlib.contextmanager
+def stage(name, **args):
+    """
+    Records build stage as Chrome trace event and accumulates
+    its duration in TIMINGS. With profile= arg outer stages are
+    profiled into <profile>/agent-<stage>-<pid>.pstats files.
+    """
+    profile = None
+    if DATASET.get('profile') and not getattr(PROFILING, 'active', False):
+        PROFILING.active = True
+        profile = cProfile.Profile()
+        profile.enable()
+    start = time.time()
+    try:
+        yield args
+    finally:
+        end = time.time()
+        if profile is not None:
+            profile.disable()
+            PROFILING.active = False
+            profile_dir = os.path.expanduser(DATASET['profile'])
+            if not os.path.isdir(profile_dir):
+                os.makedirs(profile_dir)
+            profile.dump_stats(os.path.join(profile_dir, 'agent-%s-%d.pstats'
+                                            % (name, os.getpid())))
+        TIMINGS[name] = TIMINGS.get(name, 0.0) + end - start
+        TRACE.append({'name': name, 'ph': 'X', 'ts': int(start * 1e6),
+                      'dur': int((end - start) * 1e6), 'pid': os.getpid(),
+                      'tid': threading.current_thread().ident % 100000,
+                      'args': args})
+
+
+def staged(name):
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    return decorator
+
+
+def link_file(src, dst):
+    """
+    Makes hardlink of the file falling back to copying.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copy2(src, dst)
+
+
+def file_hash(pth):
+    digest = hashlib.sha256()
+    with open(pth, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def git(args, cwd=None):
+    """
+    Runs git command and returns its stripped output.
+    """
+    return subprocess.check_output(['git'] + args, cwd=cwd).strip()
+
+
+def get_mirror(url, update=True):
+    """
+    Creates or updates bare mirror of repository in per-host
+    mirror cache. Returns mirror path.
+    """
+    mirror_dir = os.path.expanduser(os.path.join('~', 'buildfarm', 'mirrors'))
+    if not os.path.isdir(mirror_dir):
+        os.makedirs(mirror_dir)
+    name = url.rstrip('/').split('/')[-1]
+    if not name.endswith('.git'):
+        name += '.git'
+    name = hashlib.sha1(url).hexdigest()[:8] + '-' + name
+    mirror = os.path.join(mirror_dir, name)
+    if not os.path.isdir(mirror):
+        echo_msg('Mirroring %s' % url)
+        git(['clone', '--mirror', '--quiet', url, mirror])
+    elif update:
+        echo_msg('Updating mirror %s' % url)
+        git(['fetch', '--prune', '--quiet', 'origin'], mirror)
+    return mirror
+
+
+def checkout(url, path, ref='HEAD', sparse=None, update=True):
+    """
+    Makes shallow checkout of ref which borrows objects from
+    repository mirror. Existing checkout is updated by fetching and
+    resetting to resolved commit. Sparse checkout is used if list of
+    patterns is provided. Returns checked out commit.
+    """
+    mirror = get_mirror(url, update)
+    commit = git(['rev-parse', ref + '^{commit}'], mirror)
+    if not os.path.isdir(os.path.join(path, '.git')):
+        echo_msg('Checking out %s' % url)
+        git(['init', '--quiet', path])
+        git(['remote', 'add', 'origin', url], path)
+        alternates = os.path.join(path, '.git', 'objects', 'info',
+                                  'alternates')
+        with open(alternates, 'wb') as fp:
+            fp.write(os.path.join(mirror, 'objects') + '\n')
+    else:
+        echo_msg('Updating checkout %s' % url)
+    sparse_file = os.path.join(path, '.git', 'info', 'sparse-checkout')
+    was_sparse = os.path.exists(sparse_file)
+    if sparse or was_sparse:
+        # '/*' pattern restores full tree before sparse mode is disabled
+        git(['config', 'core.sparseCheckout', 'true'], path)
+        if not os.path.isdir(os.path.dirname(sparse_file)):
+            os.makedirs(os.path.dirname(sparse_file))
+        with open(sparse_file, 'wb') as fp:
+            fp.write('\n'.join(sparse or ['/*']) + '\n')
+    try:
+        git(['fetch', '--quiet', '--depth', '1', mirror, commit], path)
+    except subprocess.CalledProcessError:
+        # old git (protocol v0) cannot fetch unadvertised commit,
+        # objects are borrowed from mirror so fetching its refs is cheap
+        echo_msg('Fetching all refs of %s' % url)
+        git(['fetch', '--quiet', mirror, '+refs/*:refs/remotes/mirror/*'],
+            path)
+    git(['reset', '--quiet', '--hard', commit], path)
+    if sparse or was_sparse:
+        # applies changed patterns to unchanged tree
+        git(['read-tree', '-mu', 'HEAD'], path)
+    if was_sparse and not sparse:
+        git(['config', 'core.sparseCheckout', 'false'], path)
+        os.remove(sparse_file)
+    return commit
+
+
+@staged('checkout')
+def checkout_project(name, url, path):
+    sparse = [item.strip() for item in DATASET.get('sparse', '').split(',')
+              if item.strip()]
+    COMMITS[name] = checkout(url, path, DATASET.get('ref', 'HEAD'), sparse)
+    echo_msg('%s at %s' % (name, COMMITS[name]))
+    return COMMITS[name]
+
+
+def get_build_key(project, script, cmd):
+    """
+    Returns build cache key for checked out project commit,
+    platform, script and setup command or None if commit is unknown.
+    """
+    commit = COMMITS.get(project)
+    if not commit:
+        return None
+    parts = [commit, ' '.join(platform.dist()), platform.machine(),
+             platform.architecture()[0], script, cmd]
+    return hashlib.sha1('\n'.join(parts)).hexdigest()
+
+
+def prune_build_cache(cache_dir, size=BUILD_CACHE_SIZE):
+    entries = [os.path.join(cache_dir, item) for item in os.listdir(cache_dir)
+               if not item.endswith('.tmp')]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for item in entries[size:]:
+        shutil.rmtree(item, True)
+
+
+def run_setup(project_dir, script, cmd):
+    """
+    Runs setup script command, raises Error if it fails. dist/ and
+    build/ trees of successful build are cached under (commit, platform,
+    arch, script, command) key, rerun with the same key restores them
+    instead of building.
+    """
+    dist_dir = os.path.join(project_dir, 'dist')
+    build_dir = os.path.join(project_dir, 'build')
+    cache_dir = os.path.expanduser(os.path.join('~', 'buildfarm', 'cache'))
+    key = get_build_key(DATASET['project'], script, cmd)
+    cached = os.path.join(cache_dir, key) if key else None
+
+    if cached and os.path.isdir(cached):
+        echo_msg('Using cached %s build %s' % (cmd, key[:12]))
+        if os.path.isdir(dist_dir):
+            shutil.rmtree(dist_dir, True)
+        os.makedirs(dist_dir)
+        for item in os.listdir(os.path.join(cached, 'dist')):
+            link_file(os.path.join(cached, 'dist', item),
+                      os.path.join(dist_dir, item))
+        cached_build = os.path.join(cached, 'build')
+        if not os.path.isdir(build_dir) and os.path.isdir(cached_build):
+            shutil.copytree(cached_build, build_dir, symlinks=True)
+        os.utime(cached, None)
+        return
+
+    # setup script writes its own stage trace (utils.trace)
+    trace_file = os.path.join(project_dir, 'build-trace-%s.json' % cmd)
+    env = dict(os.environ, BUILD_TRACE=trace_file)
+    if DATASET.get('profile'):
+        # setup script profiles its stages (utils.profiling)
+        env['BUILD_PROFILE'] = os.path.expanduser(DATASET['profile'])
+        if DATASET.get('profile_memory'):
+            env['BUILD_PROFILE_MEMORY'] = '1'
+    with stage(cmd), open(os.devnull, 'wb') as devnull:
+        ret = subprocess.call(['python2', script, cmd], cwd=project_dir,
+                              env=env, stdout=devnull)
+    if os.path.isfile(trace_file):
+        try:
+            with open(trace_file, 'rb') as fp:
+                TRACE.extend(json.load(fp).get('traceEvents', []))
+        except ValueError:
+            pass
+        os.remove(trace_file)
+    if ret:
+        raise Error('%s %s failed with exit status %d' % (script, cmd, ret))
+    if not cached or not os.path.isdir(dist_dir) or not os.listdir(dist_dir):
+        return
+    tmp = cached + '.tmp'
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp, True)
+    os.makedirs(os.path.join(tmp, 'dist'))
+    for item in os.listdir(dist_dir):
+        link_file(os.path.join(dist_dir, item),
+                  os.path.join(tmp, 'dist', item))
+    if os.path.isdir(build_dir):
+        shutil.copytree(build_dir, os.path.join(tmp, 'build'), symlinks=True)
+    os.rename(tmp, cached)
+    prune_build_cache(cache_dir)
 
 
 def fetch_cli_args():
@@ -213,6 +516,11 @@ def fetch_cli_args():
 
 
 def check_update():
+    """
+    Replaces agent file by version from project checkout. Command line
+    agent reruns the build with new version. Resident agent finishes
+    current job and restarts before the next one.
+    """
     if DATASET['agent_ver'] == VERSION:
         return
     echo_msg('Agent update...', False)
@@ -226,23 +534,23 @@ def check_update():
         echo_msg('...Aborted')
         return
 
+    content = open(source, 'rb').read()
+    if content == open(__file__, 'rb').read():
+        echo_msg('...Agent is up to date')
+        return
     with open(__file__, 'wb') as fp:
-        fp.write(open(source, 'rb').read())
+        fp.write(content)
     echo_msg('...OK')
+    if RESIDENT:
+        echo_msg('Current job continues with agent %s, '
+                 'updated agent starts after it' % VERSION)
+        return
 
-    keys = DATASET.keys()
-    args = []
-    for key in keys:
-        value = DATASET[key]
-        if not value:
-            continue
-        if ' ' in value:
-            value = '"%s"' % value
-        args.append('%s=%s' % (key, value))
-    args = ' '.join(args)
-
-    os.system('python2 %s %s' % (__file__, args))
-    sys.exit(0)
+    args = ['%s=%s' % (key, value) for key, value in DATASET.items()
+            if value]
+    # trace file is written by updated agent
+    DATASET['trace'] = ''
+    sys.exit(subprocess.call([sys.executable, __file__] + args))
 
 
 def check_mode():
@@ -274,6 +582,218 @@ def restart_network():
         os.system('systemctl restart network.service 1> /dev/null')
 
 
+class Uploader(object):
+    """
+    Uploads artifacts to FTP server using small pool of worker threads.
+    Each worker keeps single authenticated session. Partially uploaded
+    files are resumed (REST) only if local upload marker shows that
+    remote file is started copy of the same content, otherwise remote
+    file is overwritten. Files with matching remote size and
+    modification time are skipped.
+    """
+
+    def __init__(self, host, user, passwd, path, jobs=2, retries=3):
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.path = path
+        self.jobs = max(1, jobs)
+        self.retries = retries
+        self.tasks = Queue.Queue()
+        self.sessions = Queue.Queue()
+        self.workers = []
+        self.errors = []
+        self.no_copy = False
+        if not os.path.isdir(UPLOADS_DIR):
+            os.makedirs(UPLOADS_DIR)
+
+    def connect(self):
+        session = ftplib.FTP(self.host, self.user, self.passwd)
+        session.cwd(self.path)
+        session.voidcmd('TYPE I')
+        return session
+
+    def check(self):
+        # Login probe, session is kept for the first worker
+        self.sessions.put(self.connect())
+
+    def remote_stat(self, session, name):
+        try:
+            size = session.size(name)
+        except ftplib.error_perm:
+            return None, None
+        try:
+            stamp = session.sendcmd('MDTM %s' % name).split()[-1]
+            mtime = calendar.timegm(time.strptime(stamp[:14], '%Y%m%d%H%M%S'))
+        except (ftplib.error_perm, ValueError):
+            mtime = None
+        return size, mtime
+
+    def get_marker(self, name):
+        key = '\n'.join((self.host, self.path, name))
+        return os.path.join(UPLOADS_DIR, hashlib.sha1(key).hexdigest())
+
+    def store(self, session, pth, artifact):
+        name = ntpath.basename(pth)
+        size = os.path.getsize(pth)
+        remote_size, remote_mtime = self.remote_stat(session, name)
+        if remote_size == size and remote_mtime is not None \
+                and remote_mtime >= int(os.path.getmtime(pth)):
+            echo_msg('SKIPPED (already published) ===> %s' % name)
+            artifact['published'] = True
+            return
+        digest = artifact.get('sha256') or file_hash(pth)
+        marker = self.get_marker(name)
+        started = None
+        if os.path.isfile(marker):
+            with open(marker, 'rb') as fp:
+                started = fp.read()
+        offset = 0
+        if remote_size and remote_size < size and started == digest:
+            offset = remote_size
+            echo_msg('RESUMING ===> %s from %d bytes' % (name, offset))
+        elif started != digest:
+            with open(marker, 'wb') as fp:
+                fp.write(digest)
+        with open(pth, 'rb') as fp:
+            fp.seek(offset)
+            try:
+                session.storbinary('STOR %s' % name, fp, rest=offset or None)
+            except ftplib.error_perm:
+                if not offset:
+                    raise
+                # server does not support resuming
+                fp.seek(0)
+                session.storbinary('STOR %s' % name, fp)
+        os.remove(marker)
+        echo_msg('PUBLISHED ===> %s' % name)
+        artifact['published'] = True
+
+    def worker(self):
+        session = None
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                self.tasks.task_done()
+                break
+            pth, artifact = task
+            for attempt in range(self.retries):
+                try:
+                    if session is None:
+                        try:
+                            session = self.sessions.get_nowait()
+                        except Queue.Empty:
+                            session = self.connect()
+                    self.store(session, pth, artifact)
+                    break
+                except ftplib.all_errors as e:
+                    echo_msg('Upload of %s failed: %s' %
+                             (ntpath.basename(pth), e))
+                    if session is not None:
+                        session.close()
+                    session = None
+            else:
+                self.errors.append(pth)
+            self.tasks.task_done()
+        if session is not None:
+            try:
+                session.quit()
+            except ftplib.all_errors:
+                session.close()
+
+    def copy(self, src, dst):
+        """
+        Copies remote file using SITE CPFR/CPTO (proftpd mod_copy).
+        Returns False if server does not support it.
+        """
+        if self.no_copy:
+            return False
+        try:
+            session = self.sessions.get_nowait()
+        except Queue.Empty:
+            session = self.connect()
+        try:
+            session.sendcmd('SITE CPFR %s' % src)
+            session.sendcmd('SITE CPTO %s' % dst)
+            return True
+        except ftplib.error_perm:
+            self.no_copy = True
+            return False
+        finally:
+            self.sessions.put(session)
+
+    def upload(self, pth, artifact):
+        if len(self.workers) < self.jobs:
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+            self.workers.append(thread)
+        self.tasks.put((pth, artifact))
+
+    def wait(self):
+        """
+        Waits for queued uploads. Returns list of failed files.
+        """
+        self.tasks.join()
+        errors, self.errors = self.errors, []
+        return errors
+
+    def close(self):
+        self.wait()
+        for _thread in self.workers:
+            self.tasks.put(None)
+        for thread in self.workers:
+            thread.join()
+        self.workers = []
+        while not self.sessions.empty():
+            self.sessions.get().close()
+
+
+UPLOADER = []
+
+
+def get_uploader():
+    if not UPLOADER:
+        UPLOADER.append(Uploader(
+            DATASET['ftp_url'], DATASET['ftp_user'], DATASET['ftp_pass'],
+            DATASET['ftp_path'], int(DATASET.get('ftp_jobs', 2))))
+    return UPLOADER[0]
+
+
+@staged('publish')
+def close_uploader():
+    """
+    Waits for pending uploads and closes FTP sessions.
+    """
+    if not UPLOADER:
+        return
+    uploader = UPLOADER.pop()
+    errors = uploader.wait()
+    for pth, artifact in ALIASES:
+        name = artifact['name']
+        if uploader.copy(artifact['alias_of'], name):
+            echo_msg('PUBLISHED ===> %s (copy of %s)' %
+                     (name, artifact['alias_of']))
+            artifact['published'] = True
+    del ALIASES[:]
+    if ARTIFACTS:
+        tmp_dir = tempfile.mkdtemp()
+        manifest = os.path.join(tmp_dir,
+                                ARTIFACTS[0]['name'] + '.manifest.json')
+        with open(manifest, 'wb') as fp:
+            json.dump({'artifacts': ARTIFACTS}, fp, indent=1,
+                      sort_keys=True)
+        uploader.upload(manifest, {'name': ntpath.basename(manifest)})
+        errors += uploader.wait()
+        shutil.rmtree(tmp_dir, True)
+    uploader.close()
+    if errors:
+        echo_msg('Cannot publish: %s' %
+                 ', '.join(ntpath.basename(item) for item in errors))
+        sys.exit(1)
+
+
+@staged('check_lan_connection')
 def check_lan_connection():
     for key in ('ftp_pass', 'ftp_user', 'ftp_url', 'ftp_path'):
         if not DATASET[key]:
@@ -285,11 +805,7 @@ def check_lan_connection():
     timeout = int(DATASET['timeout'])
     while counter < 5:
         try:
-            session = ftplib.FTP(
-                DATASET['ftp_url'],
-                DATASET['ftp_user'],
-                DATASET['ftp_pass'])
-            session.quit()
+            get_uploader().check()
             is_connection = True
         except:
             restart_network()
@@ -306,182 +822,467 @@ def check_lan_connection():
 
 
 def publish_file(pth):
+    """
+    Publishes build artifact. Files identical to already published
+    ones are not uploaded again: they are copied on server side if
+    supported and listed in build manifest as aliases.
+    """
+    artifact = {'name': ntpath.basename(pth),
+                'size': os.path.getsize(pth),
+                'sha256': file_hash(pth),
+                'published': False}
+    for item in ARTIFACTS:
+        if item['sha256'] == artifact['sha256'] and 'alias_of' not in item:
+            artifact['alias_of'] = item['name']
+            break
+    ARTIFACTS.append(artifact)
     if DATASET['mode'] == 'build':
         return
+    if 'alias_of' in artifact:
+        ALIASES.append((pth, artifact))
+        return
     echo_msg('PUBLISHING ===> %s' % ntpath.basename(pth))
-    session = ftplib.FTP(
-        DATASET['ftp_url'],
-        DATASET['ftp_user'],
-        DATASET['ftp_pass'])
-    session.cwd(DATASET['ftp_path'])
-    fp = open(pth, 'rb')
-    session.storbinary('STOR %s' % ntpath.basename(pth), fp)
-    fp.close()
-    session.quit()
+    get_uploader().upload(pth, artifact)
 
 
 # ------------ Build script ------------------
 
-# CLI args processing
-fetch_cli_args()
-check_mode()
-
-build_dir = os.path.join('~', 'buildfarm')
-BUILD_DIR = os.path.expanduser(build_dir)
-PROJECT_DIR = os.path.join(BUILD_DIR, DATASET['project'])
-PROJECT2_DIR = os.path.join(BUILD_DIR, DATASET['project2'])
-DIST_DIR = os.path.join(PROJECT_DIR, 'dist')
-PKGBUILD_DIR = os.path.join(PROJECT_DIR, 'pkgbuild')
-ARCH_DIR = os.path.join(PROJECT_DIR, 'archlinux')
-if is_msw():
-    DIST_DIR = os.path.join(PROJECT2_DIR, 'dist')
-url = DATASET['git_url']
-url2 = DATASET['git_url2']
-script = DATASET['script']
-script2 = DATASET['script2']
-proj_name = DATASET['project']
-proj2_name = DATASET['project2']
-timestamp = DATASET['timestamp']
-
-if not is_path(BUILD_DIR):
-    os.mkdir(BUILD_DIR)
-
-# Check LAN connection
-check_lan_connection()
-
-# Package build procedure
-if is_linux():
-    package_name2 = ''
-    old_name = ''
-    new_name = ''
-    if not is_path(PROJECT_DIR):
-        echo_msg('Cloning project %s' % url)
-        command('cd %s;git clone %s %s' % (BUILD_DIR, url, proj_name))
-    else:
-        echo_msg('Updating project %s' % url)
-        command('cd %s;git pull' % PROJECT_DIR)
-    if is_path(DIST_DIR):
-        command('rm -rf %s' % DIST_DIR)
+class BuildThread(threading.Thread):
+    """
+    Runs build function in background keeping result or exception.
+    """
 
-    check_update()
+    def __init__(self, target, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.func = target
+        self.func_args = args
+        self.result = None
+        self.error = None
 
-    if is_deb():
-        echo_msg("Building DEB package")
-        command(
-            'cd %s;python2 %s bdist_deb 1> /dev/null' % (PROJECT_DIR, script))
-
-        old_name = get_package_name(DIST_DIR)
-        prefix, suffix = old_name.split('_')
-        new_name = prefix + get_marker() + suffix
-        if is_ubuntu():
-            ts = ''
-            if timestamp:
-                ts = '_' + timestamp
+    def run(self):
+        try:
+            self.result = self.func(*self.func_args)
+        except Exception as e:
+            self.error = e
+
+
+@staged('source_package')
+def build_source(url, src_dir, script):
+    """
+    Builds source tarball and ArchLinux PKGBUILD zip in src_dir
+    checkout of the same commit. Returns list of packages to publish.
+    """
+    echo_msg("Creating source package")
+    checkout(url, src_dir, COMMITS[DATASET['project']], update=False)
+    dist_dir = os.path.join(src_dir, 'dist')
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir, True)
+    run_setup(src_dir, script, 'sdist')
+    old_name = get_package_name(dist_dir)
+    marker = ''
+    if DATASET['timestamp']:
+        marker = '_%s' % DATASET['timestamp']
+    new_name = old_name.replace('.tar.gz', '%s.tar.gz' % marker)
+    package_name = os.path.join(dist_dir, new_name)
+    link_file(os.path.join(dist_dir, old_name), package_name)
+
+    # ArchLinux PKGBUILD
+    arch_dir = os.path.join(src_dir, 'archlinux')
+    path = os.path.join(arch_dir, 'PKGBUILD-%s' % DATASET['app_name'])
+    pkgbuild = open(path, 'rb').read()
+    pkgbuild = pkgbuild.replace('VERSION', DATASET['app_ver'])
+    pkgbuild = pkgbuild.replace('TARBALL', new_name)
+    readme = os.path.join(arch_dir, 'README-%s' % DATASET['app_name'])
+
+    pkg_name = new_name.replace('.tar.gz', '.archlinux.pkgbuild.zip')
+    pkg_name = os.path.join(dist_dir, pkg_name)
+    ziph = ZipFile(pkg_name, 'w', ZIP_DEFLATED)
+    ziph.write(package_name, new_name)
+    ziph.writestr('PKGBUILD', pkgbuild)
+    ziph.write(readme, 'README')
+    ziph.close()
+    return [package_name, pkg_name]
+
+
+def build():
+
+    build_dir = os.path.join('~', 'buildfarm')
+    BUILD_DIR = os.path.expanduser(build_dir)
+    PROJECT_DIR = os.path.join(BUILD_DIR, DATASET['project'])
+    PROJECT2_DIR = os.path.join(BUILD_DIR, DATASET['project2'])
+    DIST_DIR = os.path.join(PROJECT_DIR, 'dist')
+    SRC_DIR = PROJECT_DIR + '-src'
+    if is_msw():
+        DIST_DIR = os.path.join(PROJECT2_DIR, 'dist')
+    url = DATASET['git_url']
+    url2 = DATASET['git_url2']
+    script = DATASET['script']
+    script2 = DATASET['script2']
+    proj_name = DATASET['project']
+    proj2_name = DATASET['project2']
+    timestamp = DATASET['timestamp']
+
+    if not is_path(BUILD_DIR):
+        os.mkdir(BUILD_DIR)
+
+    # Check LAN connection
+    check_lan_connection()
+
+    # Package build procedure
+    if is_linux():
+        package_name2 = ''
+        old_name = ''
+        new_name = ''
+        checkout_project(proj_name, url, PROJECT_DIR)
+        if is_path(DIST_DIR):
+            shutil.rmtree(DIST_DIR, True)
 
-            ver = platform.dist()[1]
-            if ver == '14.04':
-                package_name2 = prefix + ts + '_mint_17_' + suffix
-            elif ver == '16.04':
-                package_name2 = prefix + ts + '_mint_18_' + suffix
-            elif ver == '18.04':
-                package_name2 = prefix + ts + '_mint_19_' + suffix
+        check_update()
+
+        src_thread = None
+        if is_src():
+            # source package is built in separate work directory
+            # concurrently with binary package
+            src_thread = BuildThread(build_source, url, SRC_DIR, script)
+            src_thread.start()
+
+        if is_deb():
+            echo_msg("Building DEB package")
+            run_setup(PROJECT_DIR, script, 'bdist_deb')
+
+            old_name = get_package_name(DIST_DIR)
+            prefix, suffix = old_name.split('_')
+            new_name = prefix + get_marker() + suffix
+            if is_ubuntu():
+                ts = ''
+                if timestamp:
+                    ts = '_' + timestamp
+
+                ver = platform.dist()[1]
+                if ver == '14.04':
+                    package_name2 = prefix + ts + '_mint_17_' + suffix
+                elif ver == '16.04':
+                    package_name2 = prefix + ts + '_mint_18_' + suffix
+                elif ver == '18.04':
+                    package_name2 = prefix + ts + '_mint_19_' + suffix
+
+        elif is_rpm():
+            echo_msg("Building RPM package")
+            run_setup(PROJECT_DIR, script, 'bdist_rpm')
+
+            old_name = get_package_name(DIST_DIR)
+            items = old_name.split('.')
+            new_name = '.'.join(items[:-2] + [get_marker(), ] + items[-2:])
 
-    elif is_rpm():
-        echo_msg("Building RPM package")
-        command(
-            'cd %s;python2 %s bdist_rpm 1> /dev/null' % (PROJECT_DIR, script))
-
-        old_name = get_package_name(DIST_DIR)
-        items = old_name.split('.')
-        new_name = '.'.join(items[:-2] + [get_marker(), ] + items[-2:])
-
-    old_name = os.path.join(DIST_DIR, old_name)
-    package_name = os.path.join(DIST_DIR, new_name)
-    command('cp %s %s' % (old_name, package_name))
-    publish_file(package_name)
-    if package_name2:
-        package_name2 = os.path.join(DIST_DIR, package_name2)
-        command('cp %s %s' % (old_name, package_name2))
-        publish_file(package_name2)
-
-    if is_src():
-        echo_msg("Creating source package")
-        if os.path.isdir(DIST_DIR):
-            shutil.rmtree(DIST_DIR, True)
-        command('cd %s;python2 %s sdist 1> /dev/null' % (PROJECT_DIR, script))
-        old_name = get_package_name(DIST_DIR)
-        marker = ''
-        if DATASET['timestamp']:
-            marker = '_%s' % DATASET['timestamp']
-        new_name = old_name.replace('.tar.gz', '%s.tar.gz' % marker)
         old_name = os.path.join(DIST_DIR, old_name)
         package_name = os.path.join(DIST_DIR, new_name)
-        command('cp %s %s' % (old_name, package_name))
+        link_file(old_name, package_name)
         publish_file(package_name)
+        if package_name2:
+            package_name2 = os.path.join(DIST_DIR, package_name2)
+            link_file(old_name, package_name2)
+            publish_file(package_name2)
+
+        if src_thread is not None:
+            src_thread.join()
+            if src_thread.error:
+                raise src_thread.error
+            for package_name in src_thread.result:
+                publish_file(package_name)
 
-        # ArchLinux PKGBUILD
-        if os.path.isdir(PKGBUILD_DIR):
-            shutil.rmtree(PKGBUILD_DIR, True)
-        os.mkdir(PKGBUILD_DIR)
-        os.chdir(PKGBUILD_DIR)
-
-        tarball = os.path.join(PKGBUILD_DIR, new_name)
-        command('cp %s %s' % (package_name, tarball))
-
-        dest = 'PKGBUILD'
-        src = os.path.join(ARCH_DIR, '%s-%s' % (dest, DATASET['app_name']))
-        command('cp %s %s' % (src, dest))
-        command("sed -i 's/VERSION/%s/g' %s" % (DATASET['app_ver'], dest))
-        command("sed -i 's/TARBALL/%s/g' %s" % (new_name, dest))
-
-        dest = 'README'
-        src = os.path.join(ARCH_DIR, '%s-%s' % (dest, DATASET['app_name']))
-        command('cp %s %s' % (src, dest))
-
-        pkg_name = new_name.replace('.tar.gz', '.archlinux.pkgbuild.zip')
-        pkg_name = os.path.join(DIST_DIR, pkg_name)
-        ziph = ZipFile(pkg_name, 'w', ZIP_DEFLATED)
-        for item in [new_name, 'PKGBUILD', 'README']:
-            path = os.path.join(PKGBUILD_DIR, item)
-            ziph.write(path, item)
-        ziph.close()
-        shutil.rmtree(PKGBUILD_DIR, True)
-        publish_file(pkg_name)
-
-elif is_msw():
-    if not is_path(PROJECT_DIR):
-        echo_msg('Cloning project %s' % url)
-        os.chdir(BUILD_DIR)
-        command('git clone %s %s' % (url, proj_name))
-    else:
-        echo_msg('Updating projects %s' % url)
-        os.chdir(PROJECT_DIR)
-        command('git pull')
-    if not is_path(PROJECT2_DIR):
-        echo_msg('Cloning project %s' % url2)
-        os.chdir(BUILD_DIR)
-        command('git clone %s %s' % (url, proj2_name))
-    else:
-        echo_msg('Updating projects %s' % url2)
-        os.chdir(PROJECT2_DIR)
-        command('git pull')
-    if is_path(DIST_DIR):
-        shutil.rmtree(DIST_DIR, True)
-
-    check_update()
-
-    for cmd in ('bdist_portable', 'bdist_msi'):
-        os.chdir(PROJECT2_DIR)
-        command('c:\python27\python.exe %s %s' % (script2, cmd))
-        new_name = old_name = get_package_name(DIST_DIR)
-        os.chdir(DIST_DIR)
-        if timestamp:
-            new_name = old_name.replace('-win', '-%s-win' % timestamp)
-            command('ren %s %s' % (old_name, new_name))
-        package_name = os.path.join(DIST_DIR, new_name)
-        publish_file(package_name)
-        os.remove(package_name)
+    elif is_msw():
+        checkout_project(proj_name, url, PROJECT_DIR)
+        checkout_project(proj2_name, url2, PROJECT2_DIR)
+        if is_path(DIST_DIR):
+            shutil.rmtree(DIST_DIR, True)
 
+        check_update()
 
-elif is_macos():
-    pass
+        published = []
+        for cmd in ('bdist_portable', 'bdist_msi'):
+            subprocess.call(['c:\\python27\\python.exe', script2, cmd],
+                            cwd=PROJECT2_DIR)
+            new_name = old_name = get_package_name(DIST_DIR)
+            if timestamp:
+                new_name = old_name.replace('-win', '-%s-win' % timestamp)
+                os.rename(os.path.join(DIST_DIR, old_name),
+                          os.path.join(DIST_DIR, new_name))
+            package_name = os.path.join(DIST_DIR, new_name)
+            publish_file(package_name)
+            published.append(package_name)
+        close_uploader()
+        for package_name in published:
+            os.remove(package_name)
+
+    elif is_macos():
+        pass
+
+    close_uploader()
+
+
+# ------------ Resident agent ------------------
+
+class OutputCapture(object):
+    """
+    Redirects process stdout and stderr (including child processes)
+    into a pipe and passes output lines to callback.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.saved = []
+        self.reader = None
+        self.thread = None
+
+    def read(self):
+        with os.fdopen(self.reader, 'rb') as fileptr:
+            for line in iter(fileptr.readline, ''):
+                self.callback(line.rstrip('\r\n'))
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = [os.dup(1), os.dup(2)]
+        self.reader, writer = os.pipe()
+        os.dup2(writer, 1)
+        os.dup2(writer, 2)
+        os.close(writer)
+        self.thread = threading.Thread(target=self.read)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        for fd in self.saved:
+            os.close(fd)
+        self.thread.join()
+
+
+def run_job(dataset):
+    """
+    Runs build for provided dataset in current process.
+    Returns structured result.
+    """
+    DATASET.clear()
+    DATASET.update(DEFAULTS)
+    DATASET.update(dataset)
+    del ARTIFACTS[:]
+    del ALIASES[:]
+    TIMINGS.clear()
+    COMMITS.clear()
+    del TRACE[:]
+    cwd = os.getcwd()
+    start = time.time()
+    status = 0
+    try:
+        check_mode()
+        build()
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else int(bool(e.code))
+    except Exception as e:
+        echo_msg('BUILD ERROR: %s' % e)
+        status = 1
+    finally:
+        os.chdir(cwd)
+        if UPLOADER:
+            UPLOADER.pop().close()
+    TIMINGS['total'] = time.time() - start
+    return {
+        'type': 'result',
+        'status': status,
+        'artifacts': list(ARTIFACTS),
+        'timings': dict(TIMINGS),
+        'commits': dict(COMMITS),
+        'trace': {'traceEvents': list(TRACE)},
+    }
+
+
+def restart_agent():
+    echo_msg('Agent file is updated, restarting')
+    os.execv(sys.executable, [sys.executable, __file__] + sys.argv[1:])
+
+
+def _send(conn, msg):
+    try:
+        conn.sendall(json.dumps(msg) + '\n')
+    except (socket.error, IOError):
+        pass
+
+
+def _to_str(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def is_loopback(host):
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+
+def serve(host='127.0.0.1', port=AGENT_PORT):
+    """
+    Resident agent mode. Listens on socket for newline separated
+    JSON messages:
+        {"type": "ping"} -> {"type": "pong", "version": ..., "queue": N}
+        {"type": "job", "dataset": {...}} -> stream of
+            {"type": "queued", "position": N}
+            {"type": "log", "line": "..."}
+            {"type": "result", "status": 0, "artifacts": [...],
+             "timings": {...}}
+    Jobs are queued and executed one by one. If agent file is updated
+    by a job, agent restarts itself when the job is finished.
+    Agent refuses to listen on non-loopback address without token.
+    """
+    global RESIDENT
+    if not is_loopback(host) and not DEFAULTS.get('token'):
+        echo_msg('Agent cannot listen on %s without token' % (host or '*'))
+        sys.exit(1)
+    RESIDENT = True
+    jobs = Queue.Queue()
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, int(port)))
+    server.listen(5)
+    agent_mtime = os.path.getmtime(__file__)
+
+    def worker():
+        while True:
+            conn, dataset = jobs.get()
+            with OutputCapture(lambda line: _send(
+                    conn, {'type': 'log', 'line': line})):
+                result = run_job(dataset)
+            _send(conn, result)
+            conn.close()
+            if os.path.getmtime(__file__) != agent_mtime and jobs.empty():
+                server.close()
+                restart_agent()
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    echo_msg('Agent %s is listening on %s:%s' % (VERSION, host, port))
+
+    while True:
+        conn, _addr = server.accept()
+        try:
+            msg = json.loads(conn.makefile('rb').readline() or '{}')
+        except ValueError:
+            msg = {}
+        token = DEFAULTS.get('token')
+        if token and msg.get('token') != token:
+            _send(conn, {'type': 'error', 'message': 'Invalid token'})
+            conn.close()
+        elif msg.get('type') == 'ping':
+            _send(conn, {'type': 'pong', 'version': VERSION,
+                         'queue': jobs.qsize()})
+            conn.close()
+        elif msg.get('type') == 'job':
+            dataset = dict((_to_str(key), _to_str(value)) for key, value
+                           in msg.get('dataset', {}).items())
+            _send(conn, {'type': 'queued', 'position': jobs.qsize()})
+            jobs.put((conn, dataset))
+        else:
+            _send(conn, {'type': 'error', 'message': 'Unknown request'})
+            conn.close()
+
+
+def _post(controller, path, msg):
+    url = 'http://%s%s' % (controller, path)
+    headers = {'Content-Type': 'application/json'}
+    if DEFAULTS.get('token'):
+        headers['X-Farm-Token'] = DEFAULTS['token']
+    request = urllib2.Request(url, json.dumps(msg), headers)
+    return json.loads(urllib2.urlopen(request, timeout=30).read())
+
+
+def pull_jobs(controller, agent=None, targets=None, poll=5.0):
+    """
+    Worker mode. Claims jobs from farm work queue, keeps job lease
+    by heartbeats while building and reports results. Returns when
+    controller has no more jobs. Only jobs of current platform
+    targets are claimed unless other targets are provided.
+    """
+    global RESIDENT
+    RESIDENT = True
+    agent_mtime = os.path.getmtime(__file__)
+    agent = agent or '%s-%d' % (socket.gethostname(), os.getpid())
+    targets = [item.strip() for item in targets.split(',')] \
+        if targets else get_targets()
+    echo_msg('Agent %s pulls %s jobs from %s' %
+             (agent, ', '.join(targets), controller))
+    while True:
+        try:
+            reply = _post(controller, '/claim',
+                          {'agent': agent, 'targets': targets})
+        except (urllib2.URLError, socket.error, ValueError) as e:
+            echo_msg('Controller is not available: %s' % e)
+            time.sleep(poll)
+            continue
+        job = reply.get('job')
+        if not job:
+            if reply.get('finished'):
+                return
+            time.sleep(poll)
+            continue
+
+        echo_msg('===>JOB %s: %s' % (job['id'], job['target']))
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(poll):
+                try:
+                    msg = {'agent': agent, 'job_id': job['id']}
+                    if not _post(controller, '/heartbeat', msg)['ok']:
+                        echo_msg('Lease of job %s is lost' % job['id'])
+                        return
+                except (urllib2.URLError, socket.error, ValueError):
+                    pass
+
+        thread = threading.Thread(target=heartbeat)
+        thread.daemon = True
+        thread.start()
+        dataset = dict((_to_str(key), _to_str(value))
+                       for key, value in job['dataset'].items())
+        result = run_job(dataset)
+        done.set()
+        thread.join()
+        result.update({'agent': agent, 'job_id': job['id']})
+        try:
+            _post(controller, '/report', result)
+        except (urllib2.URLError, socket.error, ValueError) as e:
+            echo_msg('Cannot report job %s: %s' % (job['id'], e))
+        if os.path.getmtime(__file__) != agent_mtime:
+            restart_agent()
+
+
+if __name__ == '__main__':
+    # CLI args processing
+    fetch_cli_args()
+    if DATASET['mode'] == 'daemon':
+        DEFAULTS.update((key, DATASET[key]) for key in DATASET
+                        if key not in ('mode', 'host', 'port'))
+        serve(DATASET.get('host', '127.0.0.1'),
+              DATASET.get('port', AGENT_PORT))
+    elif DATASET['mode'] == 'worker':
+        DEFAULTS.update((key, DATASET[key]) for key in DATASET
+                        if key not in ('mode', 'controller', 'agent',
+                                       'targets', 'poll'))
+        pull_jobs(DATASET['controller'], DATASET.get('agent'),
+                  DATASET.get('targets'), float(DATASET.get('poll', 5)))
+    else:
+        try:
+            check_mode()
+            build()
+        finally:
+            if DATASET.get('trace'):
+                with open(DATASET['trace'], 'wb') as fp:
+                    json.dump({'traceEvents': TRACE}, fp)
+        echo_msg('Build stages:')
+        for name, value in sorted(TIMINGS.items(), key=lambda x: -x[1]):
+            echo_msg('    %-24s %8.1fs' % (name, value))
@@ -15,8 +15,13 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import json
+import multiprocessing
 import os
+import subprocess
 import sys
+import threading
+import time
 
 DEB = [
     'Ubuntu 14.04 32bit',
@@ -87,96 +92,838 @@ def echo_msg(msg, newline=True, flush=True, code=''):
         sys.stdout.flush()
 
 
+FARM_OPTIONS = ('jobs', 'prestart', 'cpus', 'ram', 'force', 'queue',
+                'queue_host', 'lease')
+DEFAULT_VM_RESOURCES = (1, 1024)
+
+HISTORY_FILE = os.path.expanduser('~/.buildfarm-history.json')
+HISTORY_SIZE = 10
+BUILDS_FILE = os.path.expanduser('~/.buildfarm-builds.json')
+TRACE_FILE = os.path.expanduser('~/.buildfarm-trace.json')
+
+# vmname -> Chrome trace shipped back by agent
+AGENT_TRACES = {}
+
+# VMs running resident agent (build-agent.py mode=daemon):
+# vmname -> (host, port) forwarded by VirtualBox NAT rule.
+# NAT forwarding needs agent listening on guest address (host=0.0.0.0),
+# so both sides must share token= value.
+AGENT_ADDRESSES = {
+    # 'Ubuntu 16.04 64bit': ('127.0.0.1', 8890),
+}
+
+ECHO_LOCK = threading.Lock()
+
+QUEUE_PORT = 8891
+LEASE_TIMEOUT = 300
+MAX_ATTEMPTS = 3
+# Dataset values which are not handed out to queue agents,
+# agents use credentials from own config
+PRIVATE_KEYS = ('user_pass', 'ftp_user', 'ftp_pass', 'token')
+
+
+def echo_vm(vmname, msg, code=''):
+    """
+    Writes VM output line by line with VM name prefix.
+    """
+    lines = msg.splitlines() or ['']
+    with ECHO_LOCK:
+        for line in lines:
+            echo_msg('[%s] %s' % (vmname, line), code=code)
+
+
+def vbox(args, vmname=None):
+    """
+    Runs VBoxManage command, output is prefixed with VM name.
+    Returns exit code.
+    """
+    try:
+        proc = subprocess.Popen(['VBoxManage'] + args, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+    except OSError as e:
+        echo_vm(vmname or 'VBoxManage', str(e), STDOUT_FAIL)
+        return 127
+    for line in iter(proc.stdout.readline, ''):
+        if vmname:
+            echo_vm(vmname, line.rstrip('\n'))
+        else:
+            echo_msg(line.rstrip('\n'))
+    return proc.wait()
+
+
+def get_host_resources():
+    """
+    Returns host (cpus, RAM in MB) tuple.
+    """
+    ram = 0
+    try:
+        with open('/proc/meminfo') as fileptr:
+            for line in fileptr:
+                if line.startswith('MemTotal:'):
+                    ram = int(line.split()[1]) // 1024
+                    break
+    except (IOError, OSError, ValueError):
+        pass
+    if not ram:
+        try:
+            ram = os.sysconf('SC_PAGE_SIZE') * \
+                  os.sysconf('SC_PHYS_PAGES') // 1024 ** 2
+        except (ValueError, OSError, AttributeError):
+            ram = 4096
+    return multiprocessing.cpu_count(), ram
+
+
+def get_vm_resources(vmname):
+    """
+    Returns VM (cpus, RAM in MB) tuple from VM settings.
+    """
+    cpus, ram = DEFAULT_VM_RESOURCES
+    try:
+        output = subprocess.check_output(
+            ['VBoxManage', 'showvminfo', vmname, '--machinereadable'],
+            stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return cpus, ram
+    for line in output.splitlines():
+        key, _sep, value = line.partition('=')
+        value = value.strip('"')
+        if key == 'cpus' and value.isdigit():
+            cpus = int(value)
+        elif key == 'memory' and value.isdigit():
+            ram = int(value)
+    return cpus, ram
+
+
 def startvm(vmname):
-    if vmname in MSI:
-        os.system('VBoxManage startvm "%s" --type %s' % (vmname, 'gui'))
-    else:
-        os.system('VBoxManage startvm "%s" --type %s' % (vmname, VMTYPE))
+    vmtype = 'gui' if vmname in MSI else VMTYPE
+    return vbox(['startvm', vmname, '--type', vmtype], vmname)
 
 
 def suspendvm(vmname):
-    echo_msg('\nSUSPENDING "%s"' % vmname)
-    os.system('VBoxManage controlvm "%s" savestate' % vmname)
-
-
-def run_agent_deb(vmname, dataset):
-    echo_msg('\n===>STARTING BUILD ON "%s"' % vmname, code=STDOUT_GREEN)
-    cmd = 'VBoxManage --nologo guestcontrol "%s" run' % vmname
-    cmd += ' --exe "/usr/bin/sudo"'
-    cmd += ' --username "%s"' % dataset['user']
-    cmd += ' --password "%s"' % dataset['user_pass']
-    cmd += ' --wait-stdout --wait-stderr'
-    cmd += ' -- sudo/arg0 "python2"'
-    cmd += ' "/home/%s/build-agent.py"' % dataset['user']
-    for item in dataset.keys():
-        value = dataset[item]
-        if not value:
-            continue
-        if ' ' in value:
-            value = "'%s'" % value
-        cmd += ' "%s=%s"' % (item, value)
-
-    os.system(cmd)
-    echo_msg('===>BUILD FINISHED ON "%s"' % vmname, code=STDOUT_GREEN)
-
-
-def run_agent_rpm(vmname, dataset):
-    echo_msg('\n===>STARTING BUILD ON "%s"' % vmname, code=STDOUT_GREEN)
-    cmd = 'VBoxManage --nologo guestcontrol "%s" run' % vmname
-    cmd += ' --exe "/usr/bin/python2"'
-    cmd += ' --username "%s"' % dataset['user']
-    cmd += ' --password "%s"' % dataset['user_pass']
-    cmd += ' --wait-stdout --wait-stderr'
-    cmd += ' -- python2/arg0'
-    cmd += ' "/home/%s/build-agent.py"' % dataset['user']
-    for item in dataset.keys():
-        value = dataset[item]
-        if not value:
-            continue
-        if ' ' in value:
-            value = "'%s'" % value
-        cmd += ' "%s=%s"' % (item, value)
-
-    os.system(cmd)
-    echo_msg('===>BUILD FINISHED ON "%s"' % vmname, code=STDOUT_GREEN)
-
-
-def run_agent_windows(vmname, dataset):
-    echo_msg('\n===>STARTING BUILD ON "%s"' % vmname, code=STDOUT_GREEN)
-    cmd = 'VBoxManage --nologo guestcontrol "%s" run' % vmname
-    cmd += ' --exe "c:\\python27\\python.exe"'
-    cmd += ' --username "%s"' % dataset['user']
-    cmd += ' --password "%s"' % dataset['user_pass']
-    cmd += ' --wait-stdout --wait-stderr'
-    cmd += ' -- sudo/arg0'
-    cmd += ' "c:\\users\\%s\\build-agent.py"' % dataset['user']
+    echo_vm(vmname, 'SUSPENDING "%s"' % vmname)
+    return vbox(['controlvm', vmname, 'savestate'], vmname)
+
+
+def get_guest_home(vmname, dataset):
+    if vmname in MSI:
+        return 'c:\\users\\%s\\' % dataset['user']
+    return '/home/%s/' % dataset['user']
+
+
+def get_agent_cmd(vmname, dataset):
+    """
+    Returns VBoxManage guestcontrol arguments to run build agent.
+    """
+    agent = get_guest_home(vmname, dataset) + 'build-agent.py'
+    if vmname in MSI:
+        exe = 'c:\\python27\\python.exe'
+        args = ['sudo/arg0', agent]
+    elif vmname in RPM:
+        exe = '/usr/bin/python2'
+        args = ['python2/arg0', agent]
+    else:
+        exe = '/usr/bin/sudo'
+        args = ['sudo/arg0', 'python2', agent]
+    cmd = ['--nologo', 'guestcontrol', vmname, 'run',
+           '--exe', exe,
+           '--username', dataset['user'],
+           '--password', dataset['user_pass'],
+           '--wait-stdout', '--wait-stderr', '--'] + args
     for item in dataset.keys():
-        value = dataset[item]
-        if not value:
+        if dataset[item]:
+            cmd.append('%s=%s' % (item, dataset[item]))
+    return cmd
+
+
+def run_agent_daemon(vmname, dataset, address):
+    """
+    Sends build job to resident agent and echoes streamed output.
+    Returns build status.
+    """
+    import socket
+    job = {'type': 'job', 'dataset': dict(
+        (key, value) for key, value in dataset.items()
+        if value and key != 'user_pass')}
+    if dataset.get('token'):
+        job['token'] = dataset['token']
+    conn = socket.create_connection(address)
+    try:
+        conn.sendall(json.dumps(job) + '\n')
+        for line in conn.makefile('rb'):
+            msg = json.loads(line)
+            if msg['type'] == 'log':
+                echo_vm(vmname, msg['line'])
+            elif msg['type'] == 'queued' and msg['position']:
+                echo_vm(vmname, 'Job queued at position %d'
+                        % msg['position'])
+            elif msg['type'] == 'error':
+                echo_vm(vmname, 'AGENT ERROR: %s' % msg['message'],
+                        STDOUT_FAIL)
+                return 1
+            elif msg['type'] == 'result':
+                if msg.get('trace'):
+                    AGENT_TRACES[vmname] = msg['trace']
+                for artifact in msg['artifacts']:
+                    echo_vm(vmname, 'Artifact %s (%d bytes)'
+                            % (artifact['name'], artifact['size']))
+                return msg['status']
+    finally:
+        conn.close()
+    echo_vm(vmname, 'Agent connection lost', STDOUT_FAIL)
+    return 1
+
+
+def fetch_agent_trace(vmname, dataset, trace):
+    """
+    Copies trace written by agent out of VM into AGENT_TRACES.
+    """
+    import shutil
+    import tempfile
+    tmp_dir = tempfile.mkdtemp()
+    local = os.path.join(tmp_dir, 'agent-trace.json')
+    try:
+        vbox(['--nologo', 'guestcontrol', vmname, 'copyfrom',
+              '--username', dataset['user'],
+              '--password', dataset['user_pass'],
+              trace, local], vmname)
+        if os.path.isfile(local):
+            with open(local) as fileptr:
+                AGENT_TRACES[vmname] = json.load(fileptr)
+    except (IOError, ValueError) as e:
+        echo_vm(vmname, 'Cannot read agent trace: %s' % e, STDOUT_FAIL)
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+
+def run_agent(vmname, dataset):
+    echo_vm(vmname, '===>STARTING BUILD ON "%s"' % vmname, STDOUT_GREEN)
+    if vmname in AGENT_ADDRESSES:
+        ret = run_agent_daemon(vmname, dataset, AGENT_ADDRESSES[vmname])
+    else:
+        # agent writes trace into guest home, it is fetched after build
+        trace = get_guest_home(vmname, dataset) + 'agent-trace.json'
+        ret = vbox(get_agent_cmd(vmname, dict(dataset, trace=trace)), vmname)
+        fetch_agent_trace(vmname, dataset, trace)
+    echo_vm(vmname, '===>BUILD FINISHED ON "%s"' % vmname, STDOUT_GREEN)
+    return ret
+
+
+def trace_event(name, start, end, tid=0, **args):
+    """
+    Returns Chrome trace complete event for time interval.
+    """
+    return {'name': name, 'ph': 'X', 'ts': int(start * 1e6),
+            'dur': int((end - start) * 1e6), 'pid': 0, 'tid': tid,
+            'args': args}
+
+
+def merge_traces(traces):
+    """
+    Merges Chrome traces into single timeline, every
+    (label, trace) pair gets own process row.
+    """
+    events = []
+    for pid, (label, trace) in enumerate(traces, 1):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': label}})
+        for event in trace.get('traceEvents', []):
+            if event.get('ph') != 'M':
+                event = dict(event)
+                event['pid'] = pid
+                events.append(event)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_timeline(path, farm_events, agent_traces):
+    """
+    Writes farm steps and agent traces as one Chrome trace file.
+    """
+    traces = [('farm', {'traceEvents': farm_events})]
+    traces += sorted(agent_traces.items())
+    with open(path, 'w') as fileptr:
+        json.dump(merge_traces(traces), fileptr)
+    echo_msg('Farm timeline: %s' % path)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    return '%dm %02ds' % divmod(int(round(seconds)), 60)
+
+
+class BuildHistory(object):
+    """
+    Small local database of per-VM build durations and outcomes
+    stored as JSON file. Records are grouped by application.
+    """
+
+    def __init__(self, path=HISTORY_FILE, app=''):
+        self.path = path
+        self.app = app or ''
+        self.data = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path) as fileptr:
+                    self.data = json.load(fileptr)
+            except (IOError, ValueError):
+                self.data = {}
+
+    def records(self, vmname):
+        return self.data.get(self.app, {}).get(vmname, [])
+
+    def add(self, vmname, duration, status):
+        records = self.data.setdefault(self.app, {}).setdefault(vmname, [])
+        records.append({'time': int(time.time()),
+                        'duration': round(duration, 1),
+                        'status': status})
+        del records[:-HISTORY_SIZE]
+
+    def expected(self, vmname):
+        """
+        Returns median duration of successful builds or None.
+        """
+        durations = sorted(item['duration'] for item in self.records(vmname)
+                           if item['status'] == 0)
+        if not durations:
+            return None
+        return durations[len(durations) // 2]
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path, 'w') as fileptr:
+            json.dump(self.data, fileptr, indent=1, sort_keys=True)
+
+
+class FarmScheduler(object):
+    """
+    Runs builds on several VMs concurrently. New VM is started
+    when there is free job slot and its CPU and RAM requirements fit
+    into remaining host budget. Up to prestart VMs are booted ahead
+    of time and wait for job slot, so next build does not wait for
+    VM boot. Each VM is suspended as soon as its build is finished,
+    VM which cannot be started is marked failed.
+    Pending VMs are ordered longest-expected-first (LPT) by build
+    history. VMs without history go first.
+    """
+
+    def __init__(self, dataset, os_list, jobs=1, cpus=None, ram=None,
+                 history=None, prestart=1):
+        self.dataset = dataset
+        self.os_list = list(os_list)
+        self.jobs = max(1, int(jobs))
+        self.prestart = max(0, int(prestart))
+        self.building = 0
+        host_cpus, host_ram = get_host_resources()
+        self.cpus = int(cpus or host_cpus)
+        self.ram = int(ram or host_ram)
+        self.history = history
+        self.used = [0, 0]
+        self.running = {}
+        self.results = {}
+        self.timings = {}
+        self.last_finished = None
+        self.condition = threading.Condition()
+        self.expected = dict(
+            (vmname, history.expected(vmname) if history else None)
+            for vmname in self.os_list)
+
+    def get_order(self):
+        expected = self.expected
+        known = [value for value in expected.values() if value is not None]
+        unknown = max(known) + 1 if known else 0
+        return sorted(self.os_list, key=lambda vmname: -(
+            unknown if expected[vmname] is None else expected[vmname]))
+
+    def fits(self, resources):
+        if not self.running:
+            return True
+        return len(self.running) < self.jobs + self.prestart and \
+            self.used[0] + resources[0] <= self.cpus and \
+            self.used[1] + resources[1] <= self.ram
+
+    def worker(self, vmname, resources):
+        ret = -1
+        started = building = False
+        timing = self.timings[vmname]
+        try:
+            if startvm(vmname):
+                echo_vm(vmname, 'Cannot start VM, build skipped',
+                        STDOUT_FAIL)
+                return
+            started = True
+            with self.condition:
+                while self.building >= self.jobs:
+                    self.condition.wait(1.0)
+                self.building += 1
+                building = True
+            timing['build'] = time.time()
+            ret = run_agent(vmname, self.dataset)
+        finally:
+            if started:
+                timing['suspend'] = time.time()
+                suspendvm(vmname)
+            with self.condition:
+                if building:
+                    self.building -= 1
+                timing['end'] = time.time()
+                self.results[vmname] = ret
+                self.last_finished = vmname
+                self.running.pop(vmname, None)
+                self.used[0] -= resources[0]
+                self.used[1] -= resources[1]
+                self.condition.notify_all()
+
+    def start(self, vmname, resources):
+        self.running[vmname] = resources
+        self.used[0] += resources[0]
+        self.used[1] += resources[1]
+        self.timings[vmname] = {'start': time.time(),
+                                'after': self.last_finished}
+        echo_vm(vmname, '-' * 40, STDOUT_BOLD)
+        thread = threading.Thread(target=self.worker,
+                                  args=(vmname, resources))
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        pending = [(vmname, get_vm_resources(vmname))
+                   for vmname in self.get_order()]
+        self.started = time.time()
+        with self.condition:
+            while pending or self.running:
+                for item in list(pending):
+                    if self.fits(item[1]):
+                        pending.remove(item)
+                        self.start(*item)
+                self.condition.wait(1.0)
+        self.finished = time.time()
+        if self.history:
+            for vmname, timing in self.timings.items():
+                self.history.add(vmname, timing['end'] - timing['start'],
+                                 self.results[vmname])
+            self.history.save()
+        return self.results
+
+    def get_critical_path(self):
+        """
+        Returns chain of builds which defined farm makespan: the last
+        finished build and builds which freed job slot for it.
+        """
+        if not self.timings:
+            return []
+        vmname = max(self.timings, key=lambda key: self.timings[key]['end'])
+        path = []
+        while vmname and vmname not in path:
+            path.insert(0, vmname)
+            vmname = self.timings[vmname]['after']
+        return path
+
+    def get_trace_events(self):
+        events = []
+        for tid, vmname in enumerate(sorted(
+                self.timings, key=lambda key: self.timings[key]['start'])):
+            timing = self.timings[vmname]
+            build = timing.get('build', timing['end'])
+            suspend = timing.get('suspend', timing['end'])
+            events.append(trace_event(vmname, timing['start'], timing['end'],
+                                      tid, status=self.results.get(vmname)))
+            events.append(trace_event('boot', timing['start'], build, tid))
+            events.append(trace_event('build', build, suspend, tid))
+            events.append(trace_event('suspend', suspend, timing['end'], tid))
+        return events
+
+    def print_report(self):
+        line = '-' * 79
+        echo_msg(line)
+        echo_msg('%-24s %9s %9s %9s %9s %9s  %s' % (
+            'VM', 'expected', 'total', 'boot', 'build', 'suspend', 'status'))
+        echo_msg(line)
+        for vmname in sorted(self.timings,
+                             key=lambda key: self.timings[key]['start']):
+            timing = self.timings[vmname]
+            build = timing.get('build', timing['end'])
+            suspend = timing.get('suspend', timing['end'])
+            status = self.results.get(vmname)
+            echo_msg('%-24s %9s %9s %9s %9s %9s  %s' % (
+                vmname[:24],
+                format_duration(self.expected.get(vmname)),
+                format_duration(timing['end'] - timing['start']),
+                format_duration(build - timing['start']),
+                format_duration(suspend - build),
+                format_duration(timing['end'] - suspend),
+                'OK' if status == 0 else 'FAILED (%s)' % status),
+                code='' if status == 0 else STDOUT_FAIL)
+        echo_msg(line)
+        path = self.get_critical_path()
+        if path:
+            echo_msg('Critical path: ' + ' -> '.join(
+                '%s (%s)' % (vmname, format_duration(
+                    self.timings[vmname]['end'] -
+                    self.timings[vmname]['start']))
+                for vmname in path))
+        echo_msg('Makespan: %s' % format_duration(
+            self.finished - self.started))
+
+
+def get_remote_commit(url, ref='HEAD'):
+    """
+    Returns commit hash of remote repository ref or None.
+    """
+    if not url:
+        return None
+    try:
+        output = subprocess.check_output(['git', 'ls-remote', url, ref])
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    for line in output.splitlines():
+        if line.strip():
+            return line.split()[0]
+    return None
+
+
+class BuildKeys(object):
+    """
+    Stores keys of last successful builds per application and VM.
+    Key consists of repository commits, agent and application versions
+    and build mode, so unchanged targets can be skipped.
+    """
+
+    def __init__(self, path=BUILDS_FILE, app=''):
+        self.path = path
+        self.app = app or ''
+        self.data = {}
+        if path and os.path.isfile(path):
+            try:
+                with open(path) as fileptr:
+                    self.data = json.load(fileptr)
+            except (IOError, ValueError):
+                self.data = {}
+
+    def is_built(self, vmname, key):
+        return self.data.get(self.app, {}).get(vmname) == key
+
+    def add(self, vmname, key):
+        self.data.setdefault(self.app, {})[vmname] = key
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path, 'w') as fileptr:
+            json.dump(self.data, fileptr, indent=1, sort_keys=True)
+
+
+def get_build_keys(dataset, os_list):
+    """
+    Returns {vmname: build key} for VMs which key can be resolved.
+    """
+    commits = {
+        'git_url': get_remote_commit(dataset.get('git_url')),
+        'git_url2': get_remote_commit(dataset.get('git_url2')),
+    }
+    keys = {}
+    for vmname in os_list:
+        repos = ('git_url', 'git_url2') if vmname in MSI else ('git_url',)
+        if not all(commits[repo] for repo in repos):
             continue
-        if ' ' in value:
-            value = "'%s'" % value
-        cmd += ' "%s=%s"' % (item, value)
+        key = dict((repo, commits[repo]) for repo in repos)
+        key.update((item, dataset.get(item, ''))
+                   for item in ('agent_ver', 'app_ver', 'mode'))
+        keys[vmname] = key
+    return keys
+
+
+# ------------ Pull-based work queue ------------------
+
+class WorkQueue(object):
+    """
+    Thread-safe set of build jobs (one per target) leased to agents.
+    Leases expire if agent stops sending heartbeats, expired jobs
+    are requeued until MAX_ATTEMPTS is reached.
+    """
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+
+    def __init__(self, dataset, targets, lease=LEASE_TIMEOUT,
+                 attempts=MAX_ATTEMPTS):
+        self.lease = lease
+        self.attempts = attempts
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.jobs = []
+        for index, target in enumerate(targets):
+            job_dataset = dict(dataset)
+            job_dataset['target'] = target
+            self.jobs.append({
+                'id': index + 1, 'target': target, 'dataset': job_dataset,
+                'state': self.PENDING, 'agent': None, 'expires': 0,
+                'attempts': 0, 'status': None, 'artifacts': [],
+                'started': None, 'duration': None, 'trace': None,
+            })
+        if not self.jobs:
+            self.finished.set()
+
+    def _get(self, job_id):
+        for job in self.jobs:
+            if job['id'] == job_id:
+                return job
+        return None
+
+    def _expire(self):
+        now = time.time()
+        for job in self.jobs:
+            if job['state'] == self.LEASED and job['expires'] < now:
+                echo_vm(job['target'], 'Lease of %s expired' % job['agent'],
+                        STDOUT_FAIL)
+                if job['attempts'] >= self.attempts:
+                    self._finish(job, 1)
+                else:
+                    job['state'] = self.PENDING
+                    job['agent'] = None
 
-    os.system(cmd)
-    echo_msg('===>BUILD FINISHED ON "%s"' % vmname, code=STDOUT_GREEN)
+    def _finish(self, job, status, artifacts=None):
+        job['state'] = self.DONE
+        job['status'] = status
+        job['artifacts'] = artifacts or []
+        job['duration'] = time.time() - job['started']
+        if all(item['state'] == self.DONE for item in self.jobs):
+            self.finished.set()
 
+    def claim(self, agent, targets):
+        """
+        Leases first pending job matching agent targets.
+        Returns job or None. Agent must name its targets, there is
+        no job for agent without them.
+        """
+        if not targets:
+            return None
+        with self.lock:
+            self._expire()
+            for job in self.jobs:
+                if job['state'] != self.PENDING:
+                    continue
+                if job['target'] not in targets:
+                    continue
+                job['state'] = self.LEASED
+                job['agent'] = agent
+                job['attempts'] += 1
+                job['expires'] = time.time() + self.lease
+                job['started'] = time.time()
+                echo_vm(job['target'], 'Leased to %s' % agent, STDOUT_GREEN)
+                return job
+        return None
 
-def launch_farm(dataset, os_list=None):
+    def heartbeat(self, job_id, agent):
+        """
+        Extends job lease. Returns False if agent has lost the lease.
+        """
+        with self.lock:
+            job = self._get(job_id)
+            if not job or job['state'] != self.LEASED \
+                    or job['agent'] != agent:
+                return False
+            job['expires'] = time.time() + self.lease
+            return True
+
+    def report(self, job_id, agent, status, artifacts=None, trace=None):
+        with self.lock:
+            job = self._get(job_id)
+            if not job or job['state'] != self.LEASED \
+                    or job['agent'] != agent:
+                return False
+            self._finish(job, status, artifacts)
+            job['trace'] = trace
+            echo_vm(job['target'], 'Finished on %s, status %s' %
+                    (agent, status),
+                    code='' if status == 0 else STDOUT_FAIL)
+            return True
+
+    def expire(self):
+        with self.lock:
+            self._expire()
+
+    def get_trace_events(self):
+        with self.lock:
+            return [trace_event(job['target'], job['started'],
+                                job['started'] + job['duration'], index,
+                                agent=job['agent'], status=job['status'])
+                    for index, job in enumerate(self.jobs)
+                    if job['duration'] is not None]
+
+    def status(self):
+        with self.lock:
+            return [dict((key, job[key]) for key in
+                         ('id', 'target', 'state', 'agent', 'attempts',
+                          'status', 'artifacts', 'duration'))
+                    for job in self.jobs]
+
+
+def is_loopback(host):
+    import socket
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+
+def make_queue_server(queue, host='127.0.0.1', port=QUEUE_PORT, token=None):
+    """
+    Returns HTTP server exposing WorkQueue as JSON API:
+        POST /claim {"agent": name, "targets": [...]}
+            -> {"job": {"id", "target", "dataset"}} or {"job": null}
+        POST /heartbeat {"agent", "job_id"} -> {"ok": bool}
+        POST /report {"agent", "job_id", "status", "artifacts"}
+            -> {"ok": bool}
+        GET /status -> {"jobs": [...], "finished": bool}
+    If token is set, requests without matching X-Farm-Token header
+    are rejected.
+    """
+    import BaseHTTPServer
+    import SocketServer
+
+    class QueueHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def reply(self, data, code=200):
+            body = json.dumps(data)
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def authorized(self):
+            if token and self.headers.getheader('X-Farm-Token') != token:
+                self.reply({'error': 'Invalid token'}, 403)
+                return False
+            return True
+
+        def do_GET(self):
+            if not self.authorized():
+                return
+            if self.path == '/status':
+                self.reply({'jobs': queue.status(),
+                            'finished': queue.finished.is_set()})
+            else:
+                self.reply({'error': 'Unknown request'}, 404)
+
+        def do_POST(self):
+            if not self.authorized():
+                return
+            try:
+                size = int(self.headers.getheader('Content-Length') or 0)
+                msg = json.loads(self.rfile.read(size) or '{}')
+            except ValueError:
+                return self.reply({'error': 'Invalid request'}, 400)
+            agent = msg.get('agent', self.client_address[0])
+            if self.path == '/claim':
+                if not msg.get('targets'):
+                    return self.reply({'error': 'No targets'}, 400)
+                job = queue.claim(agent, msg['targets'])
+                if job:
+                    job = dict((key, job[key])
+                               for key in ('id', 'target', 'dataset'))
+                self.reply({'job': job,
+                            'finished': queue.finished.is_set()})
+            elif self.path == '/heartbeat':
+                self.reply({'ok': queue.heartbeat(msg.get('job_id'), agent)})
+            elif self.path == '/report':
+                self.reply({'ok': queue.report(
+                    msg.get('job_id'), agent, msg.get('status', 1),
+                    msg.get('artifacts'), msg.get('trace'))})
+            else:
+                self.reply({'error': 'Unknown request'}, 404)
+
+        def log_message(self, *args):
+            pass
+
+    class QueueServer(SocketServer.ThreadingMixIn,
+                      BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    return QueueServer((host, int(port)), QueueHandler)
+
+
+def serve_queue(dataset, os_list, port=QUEUE_PORT, lease=LEASE_TIMEOUT,
+                host='127.0.0.1'):
+    """
+    Runs work queue controller until all jobs are finished.
+    Controller listens on localhost unless host and shared token
+    (dataset token=) are provided. Returns {target: status} dict.
+    """
+    token = dataset.get('token')
+    if not is_loopback(host) and not token:
+        echo_msg('Work queue cannot listen on %s without token'
+                 % (host or '*'), code=STDOUT_FAIL)
+        sys.exit(1)
+    dataset = dict((key, value) for key, value in dataset.items()
+                   if key not in PRIVATE_KEYS)
+    queue = WorkQueue(dataset, os_list, int(lease))
+    server = make_queue_server(queue, host, port, token)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    echo_msg('Work queue is listening on %s:%s' % (host, port))
+    while not queue.finished.wait(1.0):
+        queue.expire()
+    # let agents see finished flag before shutdown
+    time.sleep(1.0)
+    server.shutdown()
+    server.server_close()
+    traces = dict((job['target'], job['trace']) for job in queue.jobs
+                  if job['trace'])
+    write_timeline(TRACE_FILE, queue.get_trace_events(), traces)
+    return dict((job['target'], job['status']) for job in queue.status())
+
+
+def launch_farm(dataset, os_list=None, jobs=None, cpus=None, ram=None,
+                history_file=HISTORY_FILE, builds_file=BUILDS_FILE,
+                force=False):
     os_list = os_list or OSes
+    dataset = dict(dataset)
+    options = dict((key, dataset.pop(key)) for key in FARM_OPTIONS
+                   if key in dataset)
+    jobs = jobs or options.get('jobs', 1)
+    prestart = options.get('prestart', 1)
+    cpus = cpus or options.get('cpus')
+    ram = ram or options.get('ram')
+    force = force or options.get('force', '').lower() in ('1', 'yes', 'true')
+    history = BuildHistory(history_file, dataset.get('app_name'))
+
     flr_left = '\n' + '|' * 20
     flr_right = '|' * 20 + '\n'
     echo_msg(flr_left + ' FARM STARTED ' + flr_right, code=STDOUT_YELLOW)
 
-    for vmname in os_list:
-        echo_msg(vmname + '-' * 40 + '\n', code=STDOUT_BOLD)
-        startvm(vmname)
-        if vmname in MSI:
-            run_agent_windows(vmname, dataset)
-        elif vmname in RPM:
-            run_agent_rpm(vmname, dataset)
-        else:
-            run_agent_deb(vmname, dataset)
-        suspendvm(vmname)
+    builds = BuildKeys(builds_file, dataset.get('app_name'))
+    keys = {}
+    if dataset.get('mode') != 'test':
+        keys = get_build_keys(dataset, os_list)
+    if not force:
+        skipped = [vmname for vmname in os_list
+                   if vmname in keys and builds.is_built(vmname, keys[vmname])]
+        for vmname in skipped:
+            echo_vm(vmname, 'SKIPPED: no changes since last build',
+                    STDOUT_BLUE)
+        os_list = [vmname for vmname in os_list if vmname not in skipped]
+
+    if options.get('queue'):
+        results = serve_queue(dataset, os_list, options['queue'],
+                              options.get('lease', LEASE_TIMEOUT),
+                              options.get('queue_host', '127.0.0.1'))
+    else:
+        AGENT_TRACES.clear()
+        scheduler = FarmScheduler(dataset, os_list, jobs, cpus, ram, history,
+                                  prestart)
+        results = scheduler.run()
+        scheduler.print_report()
+        write_timeline(TRACE_FILE, scheduler.get_trace_events(),
+                       AGENT_TRACES)
+
+    for vmname, ret in results.items():
+        if not ret and vmname in keys:
+            builds.add(vmname, keys[vmname])
+    builds.save()
 
     echo_msg(flr_left + 'FARM TERMINATED' + flr_right, code=STDOUT_YELLOW)
+    return results
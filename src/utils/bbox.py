@@ -19,9 +19,11 @@
 
 import datetime
 import os
+import shlex
 import sys
 
 from .dist import SYSFACTS
+from .runner import run
 
 
 TIMESTAMP = datetime.datetime.now().strftime("%Y%m%d")
@@ -32,8 +34,21 @@ class Error(Exception):
     pass
 
 
-def command(exec_cmd):
-    return os.system(exec_cmd)
+SHELL_TOKENS = (';', '&&', '||', '|', '>', '>>', '<', '&')
+
+
+def command(exec_cmd, **kwargs):
+    """
+    Runs command argument list by runner without shell. String command
+    is split into arguments, shell syntax (pipes, redirections, command
+    lists) is not supported. Returns exit code.
+    """
+    if isinstance(exec_cmd, basestring):
+        exec_cmd = shlex.split(exec_cmd)
+        tokens = [item for item in exec_cmd if item in SHELL_TOKENS]
+        if tokens:
+            raise Error('Shell syntax is not supported: %s' % tokens[0])
+    return run(exec_cmd, **kwargs).returncode
 
 
 def echo_msg(msg, newline=True, flush=True, code=''):
@@ -50,40 +65,42 @@ def is_path(pth):
     return os.path.lexists(pth)
 
 
-def get_marker(timestamp=True):
-    ver = SYSFACTS.version
-    mrk = SYSFACTS.marker
-    if SYSFACTS.is_deb:
-        if SYSFACTS.is_debian:
+def get_marker(timestamp=True, facts=None):
+    facts = facts or SYSFACTS
+    ver = facts.version
+    mrk = facts.marker
+    if facts.is_deb:
+        if facts.is_debian:
             ver = ver.split('.')[0]
-        mrk = '_%s_%s_' % (SYSFACTS.marker, ver)
+        mrk = '_%s_%s_' % (facts.marker, ver)
         if timestamp:
             mrk = '_%s%s' % (TIMESTAMP, mrk)
-    elif SYSFACTS.is_rpm:
-        if not SYSFACTS.is_opensuse and not ver.startswith('42'):
+    elif facts.is_rpm:
+        if not facts.is_opensuse and not ver.startswith('42'):
             ver = ver.split('.')[0]
-        mrk = SYSFACTS.marker + ver
+        mrk = facts.marker + ver
         if timestamp:
             mrk = '%s.%s' % (TIMESTAMP, mrk)
     return mrk
 
 
-def get_package_name(pth):
+def get_package_name(pth, facts=None):
+    facts = facts or SYSFACTS
     files = []
     file_items = os.listdir(pth)
     for fn in file_items:
         if os.path.isfile(os.path.join(pth, fn)):
             files.append(fn)
-    if SYSFACTS.is_deb:
+    if facts.is_deb:
         if len(files) == 1:
             if files[0].endswith('.deb') or files[0].endswith('.tar.gz'):
                 return files[0]
-    elif SYSFACTS.is_rpm:
+    elif facts.is_rpm:
         for fn in files:
             if fn.endswith('.rpm') and not fn.endswith('src.rpm') \
                     and 'debug' not in fn:
                 return fn
-    elif SYSFACTS.is_msw:
+    elif facts.is_msw:
         if len(files) == 1:
             if files[0].endswith('.zip') or files[0].endswith('.msi'):
                 return files[0]
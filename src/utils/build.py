@@ -18,23 +18,148 @@
 # 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import pickle
 import platform
 import shutil
-import sys
 
 from . import fsutils
+from .trace import traced
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
-def get_resources(pkg_path, path):
-    path = os.path.normpath(path)
-    pkg_path = os.path.normpath(pkg_path)
-    size = len(pkg_path) + 1
-    dirs = fsutils.get_dirs_tree(path)
-    dirs.append(path)
-    res_dirs = []
-    for item in dirs:
-        res_dirs.append(os.path.join(item[size:], '*.*'))
-    return res_dirs
+
+RESOURCE_CACHE_VERSION = 1
+
+
+class ResourceManifest(object):
+    """
+    Concrete resource file list of package directory:
+    files - [(path relative to package directory, size, mtime)]
+    dirs - {directory: mtime} of scanned resource tree
+    Manifest is valid while none of directories and files
+    is changed.
+    """
+
+    def __init__(self, pkg_path, path, files=None, dirs=None):
+        self.pkg_path = os.path.normpath(pkg_path)
+        self.path = os.path.normpath(path)
+        self.files = files or []
+        self.dirs = dirs or {}
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def size(self):
+        return sum(item[1] for item in self.files)
+
+    def scan(self):
+        self.files = []
+        self.dirs = {}
+        start = len(self.pkg_path) + 1
+        pending = [self.path]
+        while pending:
+            folder = pending.pop()
+            try:
+                self.dirs[folder] = os.stat(folder).st_mtime
+            except OSError:
+                continue
+            for name, path, is_dir in _scan(folder):
+                if name.startswith('.'):
+                    continue
+                if is_dir:
+                    pending.append(path)
+                else:
+                    stat = os.stat(path)
+                    self.files.append(
+                        (path[start:], stat.st_size, stat.st_mtime))
+        self.files.sort()
+        return self
+
+    def is_valid(self):
+        try:
+            for folder, mtime in self.dirs.items():
+                if os.stat(folder).st_mtime != mtime:
+                    return False
+            for name, size, mtime in self.files:
+                stat = os.stat(os.path.join(self.pkg_path, name))
+                if stat.st_size != size or stat.st_mtime != mtime:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def package_data(self):
+        """
+        Returns file list for package_data of setup script.
+        """
+        return [item[0] for item in self.files]
+
+    def data_files(self, dst):
+        """
+        Returns [(install dir, [files])] list (data_files of setup
+        script, DebBuilder and RpmBuilder), dst is install path of
+        package directory.
+        """
+        dirs = {}
+        for name, _size, _mtime in self.files:
+            folder = os.path.dirname(name).replace(os.sep, '/')
+            dirs.setdefault(folder, []).append(
+                os.path.join(self.pkg_path, name))
+        return [(dst.rstrip('/') + ('/' + folder if folder else ''), files)
+                for folder, files in sorted(dirs.items())]
+
+
+def load_resource_cache(cache_file):
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as fileptr:
+                cache = pickle.load(fileptr)
+            if cache.get('version') == RESOURCE_CACHE_VERSION:
+                return cache['manifests']
+        except Exception:
+            pass
+    return {}
+
+
+def save_resource_cache(cache_file, manifests):
+    with open(cache_file, 'wb') as fileptr:
+        pickle.dump({'version': RESOURCE_CACHE_VERSION,
+                     'manifests': manifests}, fileptr, 2)
+
+
+def get_resource_manifest(pkg_path, path, cache_file=None):
+    """
+    Returns ResourceManifest of path directory in package pkg_path.
+    With cache_file the manifest is reused while directory and file
+    mtimes are unchanged.
+    """
+    manifest = ResourceManifest(pkg_path, path)
+    key = (manifest.pkg_path, manifest.path)
+    cache = load_resource_cache(cache_file)
+    if key in cache:
+        files, dirs = cache[key]
+        cached = ResourceManifest(pkg_path, path, files, dirs)
+        if cached.is_valid():
+            return cached
+    manifest.scan()
+    if cache_file:
+        cache[key] = (manifest.files, manifest.dirs)
+        save_resource_cache(cache_file, cache)
+    return manifest
+
+
+def get_resources(pkg_path, path, cache_file=None):
+    """
+    Returns package_data file list of resource directory.
+    """
+    return get_resource_manifest(pkg_path, path, cache_file).package_data()
 
 
 def clear_build():
@@ -42,7 +167,7 @@ def clear_build():
     Clears build result.
     """
     if os.path.exists('build'):
-        os.system('rm -rf build')
+        shutil.rmtree('build', True)
 
 
 def clear_msw_build():
@@ -78,71 +203,157 @@ def is_package(path):
     return False
 
 
+MODULE_EXTS = ('.py', '.pyc', '.pyo', '.so', '.pyd')
+
+
+class PrefixTrie(object):
+    """
+    Matches strings against set of prefixes in one pass
+    over the string.
+    """
+
+    def __init__(self, prefixes=None):
+        self.root = {}
+        for prefix in prefixes or []:
+            self.add(prefix)
+
+    def add(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = True
+
+    def match(self, value):
+        """
+        Checks does value start with any of prefixes.
+        """
+        node = self.root
+        for char in value:
+            if None in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return None in node
+
+
+class SourceTree(object):
+    """
+    Result of discover():
+    packages - sorted dotted package names
+    package_dirs - package name -> package directory
+    resources - package name -> non-module files relative to
+                package directory (including files in nested
+                non-package directories)
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.packages = []
+        self.package_dirs = {}
+        self.resources = {}
+
+
+def _scan(path):
+    # Returns sorted (name, path, is_dir) list of directory items
+    try:
+        if scandir is not None:
+            items = [(entry.name, entry.path, entry.is_dir())
+                     for entry in scandir(path)]
+        else:
+            items = []
+            for name in os.listdir(path):
+                item = os.path.join(path, name)
+                items.append((name, item, os.path.isdir(item)))
+    except OSError:
+        return []
+    items.sort()
+    return items
+
+
+def _is_resource(name):
+    return not name.startswith('.') and \
+        os.path.splitext(name)[1] not in MODULE_EXTS
+
+
+def _collect_resources(items, rel, result):
+    for name, path, is_dir in items:
+        if name.startswith('.'):
+            continue
+        if is_dir:
+            _collect_resources(_scan(path), os.path.join(rel, name), result)
+        elif _is_resource(name):
+            result.append(os.path.join(rel, name))
+
+
+def discover(path='src', excludes=None, recursive=True, resources=True):
+    """
+    Collects python packages of source tree in single traversal.
+    Every directory is listed once, package names are built from
+    directory names relative to path.
+
+    excludes - dotted name prefixes, matching packages are skipped
+               with all subpackages
+    recursive - collect subpackages, otherwise root packages only
+    resources - collect package resources (in recursive mode)
+    """
+    tree = SourceTree(path)
+    trie = PrefixTrie(excludes)
+    pending = [(None, _scan(path))]
+    while pending:
+        parent, items = pending.pop()
+        files = tree.resources.get(parent)
+        for name, folder, is_dir in items:
+            if name.startswith('.'):
+                continue
+            if not is_dir:
+                if files is not None and _is_resource(name):
+                    files.append(name)
+                continue
+            children = _scan(folder)
+            if not any(item[0] == INIT_FILE and not item[2]
+                       for item in children):
+                if files is not None:
+                    _collect_resources(children, name, files)
+                continue
+            package = name if parent is None else parent + '.' + name
+            if trie.match(package):
+                continue
+            tree.packages.append(package)
+            tree.package_dirs[package] = folder
+            if recursive:
+                if resources:
+                    tree.resources[package] = []
+                pending.append((package, children))
+    tree.packages.sort()
+    return tree
+
+
 def get_packages(path):
     """
     Collects recursively python packages.
     """
-    packages = []
-    items = []
-    if os.path.isdir(path):
-        try:
-            items = os.listdir(path)
-        except os.error:
-            pass
-        for item in items:
-            if item.startswith('.'):
-                continue
-            folder = os.path.join(path, item)
-            if is_package(folder):
-                packages.append(folder)
-                packages += get_packages(folder)
-    packages.sort()
-    return packages
+    return sorted(discover(path, resources=False).package_dirs.values())
 
 
 def get_package_dirs(path='src', excludes=None):
     """
     Collects root packages.
     """
-    if excludes is None:
-        excludes = []
-    dirs = {}
-    items = []
-    if os.path.isdir(path):
-        try:
-            items = os.listdir(path)
-        except os.error:
-            pass
-        for item in items:
-            if item in excludes:
-                continue
-            if item == '.svn':
-                continue
-            folder = os.path.join(path, item)
-            if is_package(folder):
-                dirs[item] = folder
-    return dirs
+    excludes = excludes or []
+    tree = discover(path, recursive=False, resources=False)
+    return dict((name, folder) for name, folder in tree.package_dirs.items()
+                if name not in excludes)
 
 
 def get_source_structure(path='src', excludes=None):
     """
     Returns recursive list of python packages.
     """
-    if excludes is None:
-        excludes = []
-    pkgs = []
-    for item in get_packages(path):
-        res = item.replace('\\', '.').replace('/', '.').split('src.')[1]
-        check = True
-        for exclude in excludes:
-            if len(res) >= len(exclude) and res[:len(exclude)] == exclude:
-                check = False
-                break
-        if check:
-            pkgs.append(res)
-    return pkgs
+    return discover(path, excludes, resources=False).packages
 
 
+@traced('build:compile_sources')
 def compile_sources(folder='build'):
     """
     Compiles python sources in build/ directory.
@@ -151,36 +362,56 @@ def compile_sources(folder='build'):
     compileall.compile_dir(folder, quiet=1)
 
 
-def copy_modules(modules, src_root='src'):
+def get_build_ext(modules=None, build_base='build'):
+    """
+    Returns finalized distutils build_ext command, its build_lib
+    and get_ext_filename() locate "setup.py build" results.
+    """
+    from distutils.dist import Distribution
+    dist = Distribution({'ext_modules': list(modules or [])})
+    dist.get_command_obj('build').build_base = build_base
+    cmd = dist.get_command_obj('build_ext')
+    cmd.ensure_finalized()
+    return cmd
+
+
+def copy_modules(modules, src_root='src', jobs=None):
     """
     Copies native modules into src/
     The routine implements build_update command
     functionality and executed after "setup.py build" command.
+    Unchanged modules are skipped, others are reflinked, hard linked
+    or copied (see fsutils.place_file). Returns list of
+    (module path, used method) pairs.
     """
-    version = '.'.join(sys.version.split()[0].split('.')[:2])
-    machine = platform.machine()
-    ext = '.so'
-    prefix = 'build/lib.linux-' + machine + '-' + version
-    marker = ''
-
-    if os.name == 'nt' and platform.architecture()[0] == '32bit':
-        prefix = 'build/lib.win32-' + version
-        ext = '.pyd'
-        marker = 'win32'
-    elif os.name == 'nt' and platform.architecture()[0] == '64bit':
-        prefix = 'build/lib.win-amd64-' + version
-        ext = '.pyd'
-        marker = 'win64'
-
-    for item in modules:
-        path = os.path.join(*item.name.split('.')) + ext
-        src = os.path.join(prefix, path)
-        dst = os.path.join(src_root, path)
-        shutil.copy(src, dst)
-        if os.name == 'nt':
-            dst2 = os.path.join('%s-devres' % marker, 'pyd',
-                                os.path.basename(src))
-            if os.path.exists(dst2):
-                os.remove(dst2)
-            shutil.copy(src, dst)
-        print '>>>Module %s has been copied to src/ directory' % path
+    from multiprocessing.pool import ThreadPool
+
+    cmd = get_build_ext(modules)
+    devres = ''
+    if os.name == 'nt':
+        marker = 'win32' if platform.architecture()[0] == '32bit' \
+            else 'win64'
+        devres = os.path.join('%s-devres' % marker, 'pyd')
+
+    def place(item):
+        path = cmd.get_ext_filename(item.name)
+        src = os.path.join(cmd.build_lib, path)
+        method = fsutils.place_file(src, os.path.join(src_root, path))
+        if devres and os.path.isdir(devres):
+            fsutils.place_file(src, os.path.join(devres,
+                                                 os.path.basename(src)))
+        return path, method
+
+    pool = ThreadPool(jobs or min(len(modules), 8) or 1)
+    try:
+        results = pool.map(place, modules)
+    finally:
+        pool.close()
+        pool.join()
+    for path, method in results:
+        if method:
+            print '>>>Module %s has been copied to src/ directory (%s)' % (
+                path, method)
+        else:
+            print '>>>Module %s is up to date' % path
+    return results
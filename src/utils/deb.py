@@ -17,10 +17,17 @@
 # 	You should have received a copy of the GNU General Public License
 # 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import glob
 import os
 import platform
 import sys
 
+from . import staging
+from .bbox import get_marker
+from .dist import SYSFACTS
+from .runner import run
+from .trace import span
+
 
 def get_size(start_path='.'):
     total_size = 0
@@ -57,34 +64,10 @@ def _make_dir(path):
             raise IOError('Error while creating %s directory.' % path)
 
 
-def copy_scripts(folder, scripts):
-    if not scripts:
-        return
-    _make_dir(folder)
-    for item in scripts:
-        info('%s -> %s' % (item, folder), CP_CODE)
-        if os.system('cp %s %s' % (item, folder)):
-            raise IOError('Cannot copying %s -> %s' % (item, folder))
-        filename = os.path.basename(item)
-        path = os.path.join(folder, filename)
-        if os.path.isfile(path):
-            info('%s as executable' % path, MK_CODE)
-            if os.system('chmod +x %s' % path):
-                raise IOError('Cannot set executable flag for %s' % path)
-
-
-def copy_files(path, files):
-    if files and not os.path.isdir(path):
-        _make_dir(path)
-    if not files:
-        return
-    for item in files:
-        msg = '%s -> %s' % (item, path)
-        if len(msg) > 80:
-            msg = '%s -> \n%s%s' % (item, ' ' * 10, path)
-        info(msg, CP_CODE)
-        if os.system('cp %s %s' % (item, path)):
-            raise IOError('Cannot copying %s -> %s' % (item, path))
+def _clean_dist():
+    packages = glob.glob('dist/*.deb')
+    if packages and not run(['rm', '-f'] + packages).ok:
+        raise IOError('Error while cleaning dist/ directory.')
 
 
 class DebBuilder:
@@ -93,6 +76,8 @@ class DebBuilder:
     The object implements "setup.py bdist_deb" command.
     Works after regular "setup.py build" command and
     constructs deb package using build result in build/ directory.
+    Package tree is staged in memory (see staging.py) and written
+    into dist/ directly, no root privileges are required.
     Arguments:
 
     name - package names
@@ -110,6 +95,10 @@ class DebBuilder:
     scripts - list of executable scripts
     data_files - list of data files and appropriate destination directories.
     deb_scripts - list of Debian package scripts.
+    facts - SystemFacts of target platform (build platform by default)
+    build_dir - build tree to package instead of build/lib.linux-*
+    package_name - deb file name, generated if not provided
+    clean_dist - remove previously built deb packages from dist/
     """
 
     name = None
@@ -134,13 +123,16 @@ class DebBuilder:
     package_name = ''
     py_version = ''
     machine = ''
-    build_dir = 'build/deb-root'
-    deb_dir = 'build/deb-root/DEBIAN'
     src = ''
     dst = ''
     bin_dir = ''
     pixmaps_dir = ''
     apps_dir = ''
+    facts = None
+    clean_dist = True
+    manifest = None
+    control = None
+    status = None
 
     def __init__(
             self,
@@ -159,7 +151,11 @@ class DebBuilder:
             scripts=None,
             data_files=None,
             deb_scripts=None,
-            dst=''):
+            dst='',
+            facts=None,
+            build_dir='',
+            package_name='',
+            clean_dist=True):
 
         deb_scripts = deb_scripts or []
         data_files = data_files or []
@@ -187,44 +183,40 @@ class DebBuilder:
         self.deb_scripts = deb_scripts
         if dst:
             self.dst = dst
+        self.facts = facts or SYSFACTS
+        self.clean_dist = clean_dist
 
         self.package = 'python-%s' % self.name
         self.py_version = '.'.join(sys.version.split()[0].split('.')[:2])
 
         if not self.arch:
-            arch = platform.architecture()[0]
-            self.arch = 'amd64' if arch == '64bit' else 'i386'
+            self.arch = 'amd64' if self.facts.is_64bit else 'i386'
 
         self.machine = platform.machine()
 
-        self.src = 'build/lib.linux-%s-%s' % (self.machine, self.py_version)
+        self.src = build_dir or \
+            'build/lib.linux-%s-%s' % (self.machine, self.py_version)
 
         if not self.dst:
-            path = '%s/usr/lib/python%s/dist-packages'
-            self.dst = path % (self.build_dir, self.py_version)
-        else:
-            self.dst = self.build_dir + self.dst
-        self.bin_dir = '%s/usr/bin' % self.build_dir
+            self.dst = '/usr/lib/python%s/dist-packages' % self.py_version
+        self.bin_dir = '/usr/bin'
+        self.manifest = staging.Manifest()
+        self.control = staging.Manifest()
 
-        self.package_name = 'python-%s-%s_%s.deb' % (
+        self.package_name = package_name or 'python-%s-%s_%s.deb' % (
             self.name, self.version, self.arch)
-        self.build()
+        self.status = self.build()
 
     def clear_build(self):
-        if os.path.lexists(self.build_dir):
-            info('%s directory.' % self.build_dir, RM_CODE)
-            if os.system('rm -rf ' + self.build_dir):
-                raise IOError(
-                    'Error while removing %s directory.' % self.build_dir)
         if os.path.lexists('dist'):
+            if not self.clean_dist:
+                return
             info('Cleaning dist/ directory.', RM_CODE)
-            if os.system('rm -rf dist/*.deb'):
-                raise IOError('Error while cleaning dist/ directory.')
+            _clean_dist()
         else:
             _make_dir('dist')
 
     def write_control(self):
-        _make_dir(self.deb_dir)
         control_list = [
             ['Package', self.package],
             ['Version', self.version],
@@ -238,91 +230,120 @@ class DebBuilder:
             ['Description', self.description],
             ['', self.long_description],
         ]
-        path = os.path.join(self.deb_dir, 'control')
         info('Writing Debian control file.', MK_CODE)
-        try:
-            control = open(path, 'w')
-            for item in control_list:
-                name, val = item
-                if val:
-                    if name:
-                        control.write('%s: %s\n' % (name, val))
-                    else:
-                        control.write('%s\n' % val)
-            control.close()
-        except:
-            raise IOError('Error while writing Debian control file.')
-
-    def copy_build(self):
-        for item in os.listdir(self.src):
-            path = os.path.join(self.src, item)
-            if os.path.isdir(path):
-                info('%s -> %s' % (path, self.dst), CP_CODE)
-                if os.system('cp -R %s %s' % (path, self.dst)):
-                    raise IOError(
-                        'Error while copying %s -> %s' % (path, self.dst))
-            elif os.path.isfile(path):
-                info('%s -> %s' % (path, self.dst), CP_CODE)
-                if os.system('cp %s %s' % (path, self.dst)):
-                    raise IOError(
-                        'Error while copying %s -> %s' % (path, self.dst))
-
-    def copy_data_files(self):
-        for item in self.data_files:
-            path, files = item
-            copy_files(self.build_dir + path, files)
-
-    def copy_package_data_files(self):
-        files = []
-        pkgs = self.package_data.keys()
-        for pkg in pkgs:
-            items = self.package_data[pkg]
-            for item in items:
-                path = os.path.join(self.package_dirs[pkg], item)
-                if os.path.basename(path) == '*.*':
-                    flist = []
-                    folder = os.path.join(self.dst, os.path.dirname(item))
-                    fldir = os.path.dirname(path)
-                    fls = os.listdir(fldir)
-                    for fl in fls:
-                        flpath = os.path.join(fldir, fl)
-                        if os.path.isfile(flpath):
-                            flist.append(flpath)
-                    files.append([folder, flist])
-                else:
-                    if os.path.isfile(path):
-                        folder = os.path.join(self.dst, os.path.dirname(item))
-                        files.append([folder, [path, ]])
-        for item in files:
-            path, files = item
-            copy_files(path, files)
+        lines = []
+        for name, val in control_list:
+            if val:
+                lines.append('%s: %s' % (name, val) if name else val)
+        self.control.add_data('control', '\n'.join(lines) + '\n')
+
+    def stage_build(self):
+        info('%s -> %s' % (self.src, self.dst), CP_CODE)
+        self.manifest.add_tree(self.src, self.dst)
+
+    def stage_scripts(self):
+        for path in self.scripts:
+            info('%s -> %s' % (path, self.bin_dir), CP_CODE)
+        self.manifest.add_scripts(self.scripts, self.bin_dir)
+        for path in self.deb_scripts:
+            info('%s -> DEBIAN' % path, CP_CODE)
+        self.control.add_scripts(self.deb_scripts, '')
+
+    def stage_data_files(self):
+        for path, files in self.data_files:
+            for item in files:
+                msg = '%s -> %s' % (item, path)
+                if len(msg) > 80:
+                    msg = '%s -> \n%s%s' % (item, ' ' * 10, path)
+                info(msg, CP_CODE)
+        self.manifest.add_data_files(self.data_files)
+
+    def stage_package_data_files(self):
+        self.manifest.add_package_data(self.package_data, self.package_dirs,
+                                       self.dst)
 
     def make_package(self):
-        os.system('chmod -R 755 %s' % self.build_dir)
         info('%s package.' % self.package_name, MK_CODE)
-        if os.system('sudo dpkg --build %s/ dist/%s' % (
-                self.build_dir, self.package_name)):
-            raise IOError('Cannot create package %s' % self.package_name)
+        try:
+            staging.write_deb(os.path.join('dist', self.package_name),
+                              self.control, self.manifest)
+        except (IOError, OSError) as e:
+            raise IOError('Cannot create package %s: %s' %
+                          (self.package_name, e))
 
     def build(self):
         line = '=' * 30
         info(line + '\n' + 'DEB PACKAGE BUILD' + '\n' + line)
+        with span('deb:build', package=self.package_name):
+            return self._build(line)
+
+    def _build(self, line):
         try:
-            if not os.path.isdir('build'):
-                raise IOError('There is no project build! '
-                              'Run "setup.py build" and try again.')
-            self.clear_build()
-            _make_dir(self.dst)
-            self.copy_build()
-            copy_scripts(self.bin_dir, self.scripts)
-            copy_scripts(self.deb_dir, self.deb_scripts)
-            self.copy_data_files()
-            self.installed_size = str(int(get_size(self.build_dir) / 1024))
+            if not os.path.isdir(self.src):
+                raise IOError('There is no project build in %s! '
+                              'Run "setup.py build" and try again.'
+                              % self.src)
+            with span('deb:clear_build'):
+                self.clear_build()
+            with span('deb:stage_build'):
+                self.stage_build()
+            with span('deb:stage_scripts'):
+                self.stage_scripts()
+            with span('deb:stage_data_files') as stage:
+                self.stage_data_files()
+                stage.add(files=sum(len(files)
+                                    for _path, files in self.data_files))
+            self.installed_size = str(self.manifest.size // 1024)
             self.write_control()
-            self.make_package()
+            with span('deb:make_package') as stage:
+                self.make_package()
+                stage.add(bytes=os.path.getsize('dist/' + self.package_name))
         except IOError as e:
             info(e, ER_CODE)
             info(line + '\n' + 'BUILD FAILED!')
             return 1
         info(line + '\n' + 'BUILD SUCCESSFUL!')
         return 0
+
+
+def build_targets(targets, depends=None, jobs=None, **kwargs):
+    """
+    Builds deb packages for several target platforms in one process.
+    Each target uses own marked package name, so architecture
+    independent payload can be packaged concurrently.
+
+    targets - list of SystemFacts objects
+    depends - callable returning depends string for target facts
+    jobs - number of concurrent builds
+    kwargs - DebBuilder arguments
+
+    Returns {(target sid, target arch): build status} dict.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if os.path.lexists('dist'):
+        info('Cleaning dist/ directory.', RM_CODE)
+        _clean_dist()
+    else:
+        _make_dir('dist')
+
+    def build_target(facts):
+        params = dict(kwargs)
+        arch = params.get('arch') or ('amd64' if facts.is_64bit else 'i386')
+        marker = get_marker(False, facts)
+        if depends is not None:
+            params['depends'] = depends(facts)
+        params.update(
+            facts=facts,
+            arch=arch,
+            package_name='python-%s-%s%s%s.deb' % (
+                params['name'], params['version'], marker, arch),
+            clean_dist=False)
+        return (facts.sid, facts.arch), DebBuilder(**params).status
+
+    pool = ThreadPool(jobs or len(targets) or 1)
+    try:
+        return dict(pool.map(build_target, targets))
+    finally:
+        pool.close()
+        pool.join()
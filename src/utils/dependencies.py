@@ -17,181 +17,397 @@
 # 	You should have received a copy of the GNU General Public License
 # 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
+import multiprocessing
 import os
+import platform
 import shutil
 import sys
+import tempfile
+import zipfile
+from multiprocessing.pool import ThreadPool
 
 from dist import *
+from runner import run
 
-DEB_GENERIC = 'liblcms2-2 (>=2.0), python (>=2.7), python (<<3.0), '
-DEB_GENERIC += 'python-cairo, '
-
-UC2_DEB_DEPENDENCIES = {
-    UBUNTU14: DEB_GENERIC + 'libmagickwand5, python-pil, python-cairo, python-reportlab',
-    UBUNTU15: DEB_GENERIC + 'libmagickwand5, python-pil, python-cairo, python-reportlab',
-    UBUNTU16: DEB_GENERIC + 'libmagickwand-6.q16-2, python-pil, python-cairo, python-reportlab',
-    UBUNTU17: DEB_GENERIC + 'libmagickwand-6.q16-3, python-pil, python-cairo, python-reportlab',
-    UBUNTU18: DEB_GENERIC + 'libmagickwand-6.q16-3, python-pil, python-cairo, python-reportlab'
-        if platform.dist()[1] != '18.10' else
-        DEB_GENERIC + 'libmagickwand-6.q16-6, python-pil, python-cairo, python-reportlab',
-    UBUNTU19: DEB_GENERIC + 'libmagickwand-6.q16-6, python-pil, python-cairo, python-reportlab',
-    UBUNTU20: DEB_GENERIC + 'libmagickwand-6.q16-6, python-pil, python-cairo',
-
-    MINT17: DEB_GENERIC + 'libmagickwand5, python-pil, python-cairo, python-reportlab',
-    MINT18: DEB_GENERIC + 'libmagickwand-6.q16-2, python-pil, python-cairo, python-reportlab',
-    MINT19: DEB_GENERIC + 'libmagickwand-6.q16-3, python-pil, python-cairo, python-reportlab',
-    MINT20: DEB_GENERIC + 'libmagickwand-6.q16-6, python-pil, python-cairo',
-
-    DEBIAN7: DEB_GENERIC + 'libmagickwand5, python-imaging, python-cairo, python-reportlab',
-    DEBIAN8: DEB_GENERIC + 'libmagickwand-6.q16-2, python-pil, python-cairo, python-reportlab',
-    DEBIAN9: DEB_GENERIC + 'libmagickwand-6.q16-3, python-pil, python-cairo, python-reportlab',
-    DEBIAN10: DEB_GENERIC + 'libmagickwand-6.q16-6, python-pil, python-cairo, python-reportlab',
+WHEEL_CACHE = os.environ.get(
+    'BUILD_WHEEL_CACHE', os.path.expanduser('~/.cache/build-utils/wheels'))
+PIP_ARTIFACTS = ('PIL',)
+
+UC2 = 'uc2'
+SK1 = 'sk1'
+APPS = (UC2, SK1)
+
+# Application packages depend on each other this way
+APP_BASES = {
+    UC2: (),
+    SK1: (UC2,),
 }
 
-SK1_DEB_DEPENDENCIES = {
-    UBUNTU14: 'python-wxgtk2.8, python-cups',
-    UBUNTU15: 'python-wxgtk2.8, python-cups',
-    UBUNTU16: 'python-wxgtk3.0, python-cups',
-    UBUNTU17: 'python-wxgtk3.0, python-cups',
-    UBUNTU18: 'python-wxgtk3.0, python-cups',
-    UBUNTU19: 'python-wxgtk3.0, python-cups',
-    UBUNTU20: 'python-wxgtk3.0, libcups2',
-
-    MINT17: 'python-wxgtk2.8, python-cups',
-    MINT18: 'python-wxgtk3.0, python-cups',
-    MINT19: 'python-wxgtk3.0, python-cups',
-    MINT20: 'python-wxgtk3.0, libcups2',
-
-    DEBIAN7: 'python-wxgtk2.8, python-cups',
-    DEBIAN8: 'python-wxgtk3.0, python-cups',
-    DEBIAN9: 'python-wxgtk3.0, python-cups',
-    DEBIAN10: 'python-wxgtk3.0, python-cups',
+DEB = 'deb'
+RPM = 'rpm'
+PIP = 'pip'
+
+SEPARATORS = {
+    DEB: ', ',
+    RPM: ' ',
 }
 
-UC2_RPM_DEPENDENCIES = {
-    FEDORA23: 'lcms2 pango ImageMagick pycairo python-pillow python-reportlab',
-    FEDORA24: 'lcms2 pango ImageMagick pycairo python-pillow python2-reportlab',
-    FEDORA25: 'lcms2 pango ImageMagick pycairo python2-pillow python2-reportlab',
-    FEDORA26: 'lcms2 pango ImageMagick pycairo python2-pillow python2-reportlab',
-    FEDORA27: 'lcms2 pango ImageMagick pycairo python2-pillow python2-reportlab',
-    FEDORA28: 'lcms2 pango ImageMagick python2-cairo python2-pillow python2-reportlab',
-    FEDORA29: 'lcms2 pango ImageMagick python2-cairo python2-pillow python2-reportlab',
-    FEDORA30: 'lcms2 pango ImageMagick python2-cairo python2-pillow python2-reportlab',
-    FEDORA31: 'lcms2 pango ImageMagick python2-cairo python2-pillow python2-reportlab',
-
-    OPENSUSE13: 'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo '
-                'python-Pillow python-reportlab',
-    OPENSUSE42: 'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo '
-                'python-Pillow python-reportlab',
-    OPENSUSE42_2: 'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo '
-                  'python-Pillow python-reportlab',
-    OPENSUSE42_3: 'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo '
-                  'python-Pillow python-reportlab',
-    OPENSUSE15_0: 'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo '
-                  'python-Pillow python-reportlab',
-    OPENSUSE15_1: 'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo '
-                  'python-Pillow python-reportlab',
-
-    CENTOS6: 'lcms2 pango ImageMagick pycairo python-pillow python-reportlab',
-    CENTOS7: 'lcms2 pango ImageMagick pycairo python-pillow python-reportlab',
-    CENTOS8: 'lcms2 pango ImageMagick pycairo python-pillow python-reportlab',
+DEB_GENERIC = ['liblcms2-2 (>=2.0)', 'python (>=2.7)', 'python (<<3.0)',
+               'python-cairo']
+
+# Dependency matrix. Each target entry may refer to 'base' target
+# and provides per application either full dependency list or
+# {old_package: new_package} replacement dict applied to the base list
+# (None as new package removes it).
+
+DEB_MATRIX = {
+    UBUNTU14: {
+        UC2: DEB_GENERIC + ['libmagickwand5', 'python-pil',
+                            'python-reportlab'],
+        SK1: ['python-wxgtk2.8', 'python-cups'],
+    },
+    UBUNTU15: {'base': UBUNTU14},
+    UBUNTU16: {
+        'base': UBUNTU14,
+        UC2: {'libmagickwand5': 'libmagickwand-6.q16-2'},
+        SK1: {'python-wxgtk2.8': 'python-wxgtk3.0'},
+    },
+    UBUNTU17: {
+        'base': UBUNTU16,
+        UC2: {'libmagickwand-6.q16-2': 'libmagickwand-6.q16-3'},
+    },
+    UBUNTU18: {'base': UBUNTU17},
+    UBUNTU18_10: {
+        'base': UBUNTU18,
+        UC2: {'libmagickwand-6.q16-3': 'libmagickwand-6.q16-6'},
+    },
+    UBUNTU19: {'base': UBUNTU18_10},
+    UBUNTU20: {
+        'base': UBUNTU19,
+        UC2: {'python-reportlab': None},
+        SK1: {'python-cups': 'libcups2'},
+    },
+
+    MINT17: {'base': UBUNTU14},
+    MINT18: {'base': UBUNTU16},
+    MINT19: {'base': UBUNTU18},
+    MINT20: {'base': UBUNTU20},
+
+    DEBIAN7: {
+        'base': UBUNTU14,
+        UC2: {'python-pil': 'python-imaging'},
+    },
+    DEBIAN8: {'base': UBUNTU16},
+    DEBIAN9: {'base': UBUNTU17},
+    DEBIAN10: {'base': UBUNTU19},
 }
 
-SK1_RPM_DEPENDENCIES = {
-    FEDORA23: 'wxPython python-cups',
-    FEDORA24: 'wxPython python2-cups',
-    FEDORA25: 'wxPython python2-cups',
-    FEDORA26: 'wxPython python2-cups',
-    FEDORA27: 'wxPython python2-cups',
-    FEDORA28: 'python2-wxpython python2-cups',
-    FEDORA29: 'python2-wxpython python2-cups',
-    FEDORA30: 'python2-wxpython python-cups',
-    FEDORA31: 'python2-wxpython python-cups',
-
-    OPENSUSE13: 'python-wxWidgets python-cups',
-    OPENSUSE42: 'python-wxWidgets python-cups',
-    OPENSUSE42_2: 'python-wxWidgets python-cups',
-    OPENSUSE42_3: 'python-wxWidgets python-cups',
-    OPENSUSE15_0: 'python-wxWidgets python-cups',
-    OPENSUSE15_1: 'python-wxWidgets python2-pycups',
+RPM_MATRIX = {
+    FEDORA23: {
+        UC2: ['lcms2', 'pango', 'ImageMagick', 'pycairo', 'python-pillow',
+              'python-reportlab'],
+        SK1: ['wxPython', 'python-cups'],
+    },
+    FEDORA24: {
+        'base': FEDORA23,
+        UC2: {'python-reportlab': 'python2-reportlab'},
+        SK1: {'python-cups': 'python2-cups'},
+    },
+    FEDORA25: {
+        'base': FEDORA24,
+        UC2: {'python-pillow': 'python2-pillow'},
+    },
+    FEDORA26: {'base': FEDORA25},
+    FEDORA27: {'base': FEDORA25},
+    FEDORA28: {
+        'base': FEDORA25,
+        UC2: {'pycairo': 'python2-cairo'},
+        SK1: {'wxPython': 'python2-wxpython'},
+    },
+    FEDORA29: {'base': FEDORA28},
+    FEDORA30: {
+        'base': FEDORA28,
+        SK1: {'python2-cups': 'python-cups'},
+    },
+    FEDORA31: {'base': FEDORA30},
+
+    OPENSUSE13: {
+        UC2: ['liblcms2-2', 'libpango-1_0-0', 'ImageMagick', 'python-cairo',
+              'python-Pillow', 'python-reportlab'],
+        SK1: ['python-wxWidgets', 'python-cups'],
+    },
+    OPENSUSE42: {'base': OPENSUSE13},
+    OPENSUSE42_2: {'base': OPENSUSE13},
+    OPENSUSE42_3: {'base': OPENSUSE13},
+    OPENSUSE15_0: {'base': OPENSUSE13},
+    OPENSUSE15_1: {
+        'base': OPENSUSE13,
+        SK1: {'python-cups': 'python2-pycups'},
+    },
+
+    CENTOS6: {
+        UC2: ['lcms2', 'pango', 'ImageMagick', 'pycairo', 'python-pillow',
+              'python-reportlab'],
+    },
+    CENTOS7: {'base': CENTOS6},
+    CENTOS8: {'base': CENTOS6},
 }
 
-UC2_PIP_DEPENDENCIES = {
-    UBUNTU20: ['reportlab-3.5.53.tar.gz'],
-    MINT20: ['reportlab-3.5.53.tar.gz']
+PIP_MATRIX = {
+    UBUNTU20: {
+        UC2: ['reportlab-3.5.53.tar.gz'],
+        # libcups2-dev
+        SK1: ['pycups-1.9.74.tar.gz'],
+    },
+    MINT20: {'base': UBUNTU20},
 }
 
-SK1_PIP_DEPENDENCIES = {
-    # libcups2-dev
-    UBUNTU20: ['pycups-1.9.74.tar.gz'],
-    MINT20: ['pycups-1.9.74.tar.gz']
+MATRICES = {
+    DEB: DEB_MATRIX,
+    RPM: RPM_MATRIX,
+    PIP: PIP_MATRIX,
 }
 
 
-def get_uc2_deb_depend():
-    if SYSFACTS.sid in UC2_DEB_DEPENDENCIES:
-        return UC2_DEB_DEPENDENCIES[SYSFACTS.sid]
-    return ''
+def _resolve_entry(matrix, target, app):
+    entry = matrix[target]
+    deps = entry.get(app)
+    if isinstance(deps, list):
+        return list(deps)
+    base = _resolve_entry(matrix, entry['base'], app) \
+        if 'base' in entry else []
+    if deps:
+        base = [deps.get(item, item) for item in base]
+        base = [item for item in base if item is not None]
+    return base
+
+
+def _compile_matrix(matrix):
+    """
+    Resolves inheritance and application dependencies
+    into {(target, app): (package, ...)} dict.
+    """
+    compiled = {}
+    for target in matrix:
+        own = dict((app, _resolve_entry(matrix, target, app)) for app in APPS)
+        for app in APPS:
+            deps = []
+            for item in APP_BASES[app]:
+                deps += own[item]
+            deps += own[app]
+            unique = []
+            for item in deps:
+                if item not in unique:
+                    unique.append(item)
+            compiled[(target, app)] = tuple(unique)
+    return compiled
+
+
+# Compiled once at import, no platform probing is involved
+DEPENDENCIES = dict((kind, _compile_matrix(matrix))
+                    for kind, matrix in MATRICES.items())
+
+
+def _own_table(kind, app):
+    # Backward compatible {target: dependencies} tables
+    table = {}
+    for target in MATRICES[kind]:
+        deps = _resolve_entry(MATRICES[kind], target, app)
+        if deps:
+            table[target] = SEPARATORS[kind].join(deps) \
+                if kind in SEPARATORS else deps
+    return table
+
+
+UC2_DEB_DEPENDENCIES = _own_table(DEB, UC2)
+SK1_DEB_DEPENDENCIES = _own_table(DEB, SK1)
+UC2_RPM_DEPENDENCIES = _own_table(RPM, UC2)
+SK1_RPM_DEPENDENCIES = _own_table(RPM, SK1)
+UC2_PIP_DEPENDENCIES = _own_table(PIP, UC2)
+SK1_PIP_DEPENDENCIES = _own_table(PIP, SK1)
+
+
+def get_target_keys(facts=None):
+    """
+    Returns matrix lookup keys for the system. Only sid is used,
+    as before, so full-version entries (like 'SuSE 15.1') do not
+    change resolution of existing hosts.
+    """
+    facts = facts or SYSFACTS
+    return (facts.sid,)
+
 
+def get_depends(kind, app, facts=None):
+    """
+    Returns tuple of resolved dependencies for the system.
+    """
+    table = DEPENDENCIES[kind]
+    for key in get_target_keys(facts):
+        if (key, app) in table:
+            return table[(key, app)]
+    return ()
 
-def get_sk1_deb_depend():
-    uc2_dep = get_uc2_deb_depend()
-    sk1_dep = ''
-    if SYSFACTS.sid in SK1_DEB_DEPENDENCIES:
-        sk1_dep = SK1_DEB_DEPENDENCIES[SYSFACTS.sid]
-    if uc2_dep and sk1_dep:
-        sk1_dep = '%s, %s' % (uc2_dep, sk1_dep)
-    elif uc2_dep:
-        sk1_dep = uc2_dep
-    return sk1_dep
 
+def get_depend_string(kind, app, facts=None):
+    return SEPARATORS[kind].join(get_depends(kind, app, facts))
 
-def get_uc2_rpm_depend():
-    if SYSFACTS.sid in UC2_RPM_DEPENDENCIES:
-        return UC2_RPM_DEPENDENCIES[SYSFACTS.sid]
-    return ''
 
+def get_all_depends(apps=APPS):
+    """
+    Bulk API for farm controller and multi-target builds.
+    Returns {target: {kind: {app: dependencies}}} dict, where
+    deb and rpm dependencies are strings and pip ones are lists.
+    """
+    result = {}
+    for kind, table in DEPENDENCIES.items():
+        for (target, app), deps in table.items():
+            if app not in apps:
+                continue
+            value = SEPARATORS[kind].join(deps) \
+                if kind in SEPARATORS else list(deps)
+            result.setdefault(target, {}).setdefault(kind, {})[app] = value
+    return result
 
-def get_sk1_rpm_depend():
-    uc2_dep = get_uc2_rpm_depend()
-    sk1_dep = ''
-    if SYSFACTS.sid in SK1_RPM_DEPENDENCIES:
-        sk1_dep = SK1_RPM_DEPENDENCIES[SYSFACTS.sid]
-    if uc2_dep and sk1_dep:
-        sk1_dep = '%s %s' % (uc2_dep, sk1_dep)
-    elif uc2_dep:
-        sk1_dep = uc2_dep
-    return sk1_dep
 
+def get_uc2_deb_depend(facts=None):
+    return get_depend_string(DEB, UC2, facts)
 
-def install_pip_deps(deps):
-    if os.path.exists('setup.cfg'):
-        os.system('mv setup.cfg setup.cfg_')
+
+def get_sk1_deb_depend(facts=None):
+    return get_depend_string(DEB, SK1, facts)
+
+
+def get_uc2_rpm_depend(facts=None):
+    return get_depend_string(RPM, UC2, facts)
+
+
+def get_sk1_rpm_depend(facts=None):
+    return get_depend_string(RPM, SK1, facts)
+
+
+def get_wheel_key(pkg, py_version, machine):
+    """
+    Returns cache key for sdist: (name, sdist hash, python version, machine)
+    """
+    with open(pkg, 'rb') as fileptr:
+        digest = hashlib.sha256(fileptr.read()).hexdigest()
+    name = os.path.basename(pkg).replace('.tar.gz', '')
+    return '%s-%s-py%s-%s' % (name, digest[:16], py_version, machine)
+
+
+def get_cached_wheel(cache_dir, key):
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path):
+        for item in os.listdir(path):
+            if item.endswith('.whl'):
+                return os.path.join(path, item)
+    return None
+
+
+def build_wheel(pkg, cache_dir, key):
+    """
+    Builds wheel for sdist and stores it in wheel cache.
+    pip runs in temporary directory, so project setup.cfg
+    does not affect the build.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        result = run(['pip2', 'wheel', '--no-deps', '--wheel-dir',
+                      tmp_dir, os.path.abspath(pkg)], cwd=tmp_dir,
+                     capture=True)
+        if not result.ok:
+            raise IOError('Error building wheel for %s (exit code %s):\n%s'
+                          % (pkg, result.returncode, result.output.strip()))
+        wheels = [item for item in os.listdir(tmp_dir)
+                  if item.endswith('.whl')]
+        if not wheels:
+            raise IOError('There is no wheel for %s' % pkg)
+        path = os.path.join(cache_dir, key)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        shutil.move(os.path.join(tmp_dir, wheels[0]),
+                    os.path.join(path, wheels[0]))
+        return os.path.join(path, wheels[0])
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+
+def unpack_wheel(wheel, target):
+    """
+    Unpacks wheel content into build directory skipping
+    package metadata and PIP_ARTIFACTS.
+    """
+    with zipfile.ZipFile(wheel) as ziph:
+        for info in ziph.infolist():
+            parts = info.filename.split('/')
+            if parts[0].endswith('.data'):
+                if len(parts) < 3 or parts[1] not in ('purelib', 'platlib'):
+                    continue
+                parts = parts[2:]
+            if parts[0].endswith('-info') or parts[0] in PIP_ARTIFACTS:
+                continue
+            path = os.path.join(target, *parts)
+            if info.filename.endswith('/'):
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+                continue
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with ziph.open(info) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            mode = info.external_attr >> 16
+            if mode & 0o111:
+                os.chmod(path, mode & 0o777)
+
+
+def install_pip_deps(deps, cache_dir=None, jobs=None):
+    """
+    Installs sdist packages from utils/packages into build directory.
+    Wheels are cached by (sdist hash, python version, machine) key,
+    missed wheels are built concurrently.
+    """
+    cache_dir = cache_dir or WHEEL_CACHE
     py_version = '.'.join(sys.version.split()[0].split('.')[:2])
     machine = platform.machine()
     target = './build/lib.linux-%s-%s' % (machine, py_version)
+
+    wheels = {}
+    missed = []
     for item in deps:
         pkg = './utils/packages/%s' % item
-        if os.system('pip2 install --target %s %s' % (target, pkg)):
-            raise Exception('Error installing %s' % item)
-    artifacts = [item for item in os.listdir(target) if item.endswith('-info')]
-    artifacts += ['PIL']
-    for item in artifacts:
-        item = os.path.join(target, item)
-        if os.path.exists(item):
-            shutil.rmtree(item)
-    if os.path.exists('setup.cfg_'):
-        os.system('mv setup.cfg_ setup.cfg')
-
-
-def install_uc2_pip_deps():
-    deps = UC2_PIP_DEPENDENCIES.get(SYSFACTS.sid)
+        key = get_wheel_key(pkg, py_version, machine)
+        wheels[item] = get_cached_wheel(cache_dir, key)
+        if not wheels[item]:
+            missed.append((item, pkg, key))
+
+    if missed:
+        jobs = jobs or min(len(missed), multiprocessing.cpu_count())
+        pool = ThreadPool(jobs)
+        try:
+            results = [(item, pool.apply_async(build_wheel,
+                                               (pkg, cache_dir, key)))
+                       for item, pkg, key in missed]
+            for item, result in results:
+                try:
+                    wheels[item] = result.get()
+                except (IOError, OSError) as e:
+                    raise IOError('Error installing %s: %s' % (item, e))
+        finally:
+            pool.close()
+            pool.join()
+
+    for item in deps:
+        unpack_wheel(wheels[item], target)
+
+
+def install_uc2_pip_deps(facts=None):
+    deps = get_depends(PIP, UC2, facts)
     if deps:
         install_pip_deps(deps)
 
 
-def install_sk1_pip_deps():
-    deps = UC2_PIP_DEPENDENCIES.get(SYSFACTS.sid, []) + \
-           SK1_PIP_DEPENDENCIES.get(SYSFACTS.sid, [])
+def install_sk1_pip_deps(facts=None):
+    deps = get_depends(PIP, SK1, facts)
     if deps:
         install_pip_deps(deps)
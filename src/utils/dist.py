@@ -17,7 +17,10 @@
 # 	You should have received a copy of the GNU General Public License
 # 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import platform
+import os
+import re
+import struct
+import sys
 
 WINDOWS = 'Windows'
 LINUX = 'Linux'
@@ -37,6 +40,7 @@ UBUNTU15 = 'Ubuntu 15'
 UBUNTU16 = 'Ubuntu 16'
 UBUNTU17 = 'Ubuntu 17'
 UBUNTU18 = 'Ubuntu 18'
+UBUNTU18_10 = 'Ubuntu 18.10'
 UBUNTU19 = 'Ubuntu 19'
 UBUNTU20 = 'Ubuntu 20'
 
@@ -82,37 +86,221 @@ MARKERS = {
 }
 
 
+OS_RELEASE = '/etc/os-release'
+# Fallbacks for systems without os-release (CentOS 6, Ubuntu 12.04),
+# looked up next to os-release path
+REDHAT_RELEASE = 'redhat-release'
+LSB_RELEASE = 'lsb-release'
+REDHAT_PATTERN = re.compile(r'^(\S+).*?\srelease\s+([\d.]+)')
+
+# os-release ID -> family name (as platform.dist() used to report it)
+OS_IDS = {
+    'linuxmint': MINT,
+    'ubuntu': UBUNTU,
+    'debian': DEBIAN,
+    'fedora': FEDORA,
+    'opensuse': OPENSUSE,
+    'opensuse-leap': OPENSUSE,
+    'sles': OPENSUSE,
+    'centos': CENTOS,
+}
+
+SYSTEMS = {
+    'win32': WINDOWS,
+    'cygwin': WINDOWS,
+    'darwin': MACOS,
+}
+
+
+def parse_os_release(path=OS_RELEASE):
+    """
+    Parses os-release file into dict. Returns empty dict
+    if file is absent.
+    """
+    result = {}
+    try:
+        with open(path) as fileptr:
+            lines = fileptr.readlines()
+    except (IOError, OSError):
+        return result
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        result[key.strip()] = value
+    return result
+
+
+def parse_release(path=OS_RELEASE):
+    """
+    Returns os-release values. If os-release file is absent, ID and
+    VERSION_ID are taken from redhat-release or lsb-release file
+    in the same directory.
+    """
+    result = parse_os_release(path)
+    if result:
+        return result
+    etc_dir = os.path.dirname(path)
+    try:
+        with open(os.path.join(etc_dir, REDHAT_RELEASE)) as fileptr:
+            # CentOS release 6.10 (Final)
+            match = REDHAT_PATTERN.match(fileptr.readline().strip())
+        if match:
+            return {'ID': match.group(1).lower(),
+                    'VERSION_ID': match.group(2)}
+    except (IOError, OSError):
+        pass
+    lsb = parse_os_release(os.path.join(etc_dir, LSB_RELEASE))
+    if lsb.get('DISTRIB_ID'):
+        return {'ID': lsb['DISTRIB_ID'].lower(),
+                'VERSION_ID': lsb.get('DISTRIB_RELEASE', '')}
+    return result
+
+
+class lazy_property(object):
+    """
+    Computes attribute value on first access and caches it
+    in instance dict.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
+
+
 class SystemFacts(object):
-    def __init__(self):
-        self.family, self.version = platform.dist()[:2]
+    """
+    Describes build platform. Values are read from os-release
+    (or its fallbacks, see parse_release()) on first access,
+    so importing the module costs nothing.
+    Family, version, arch and system can be overridden to describe
+    another target platform (see get_target_facts()).
+    """
+
+    def __init__(self, os_release=OS_RELEASE, family=None, version=None,
+                 arch=None, system=None):
+        self.os_release = os_release
+        if family is not None:
+            self.release = {}
+            system = system or LINUX
+        overrides = {'family': family, 'version': version,
+                     'arch': arch, 'system': system}
+        for name, value in overrides.items():
+            if value is not None:
+                self.__dict__[name] = value
+
+    def __repr__(self):
+        return '<SystemFacts %s %s>' % (self.sid, self.arch)
+
+    @lazy_property
+    def release(self):
+        return parse_release(self.os_release)
+
+    @lazy_property
+    def family(self):
+        os_id = self.release.get('ID', '')
+        if os_id not in OS_IDS:
+            for item in self.release.get('ID_LIKE', '').split():
+                if item == 'suse':
+                    return OPENSUSE
+        return OS_IDS.get(os_id, os_id)
 
-        # Workaround for Leap 15.0
-        if not self.family and not self.version:
-            self.family, self.version = OPENSUSE, '15.0'
+    @lazy_property
+    def version(self):
+        return self.release.get('VERSION_ID', '')
 
+    @lazy_property
+    def sid(self):
         # Workaround for Suse 42.x
         if self.family == OPENSUSE and self.version.startswith('42'):
-            self.sid = '%s %s' % (self.family, self.version)
-        else:
-            self.sid = '%s %s' % (self.family, self.version.split('.')[0])
-
-        self.arch = platform.architecture()[0]
-        self.is_64bit = self.arch == '64bit'
-
-        self.system = platform.system()
-        self.is_msw = self.system == WINDOWS
-        self.is_linux = self.system == LINUX
-        self.is_macos = self.system == MACOS
-        self.is_deb = self.family in [MINT, UBUNTU, DEBIAN]
-        self.is_debian = self.family == DEBIAN
-        self.is_ubuntu = self.family == UBUNTU
-        self.is_rpm = self.family in [FEDORA, OPENSUSE, CENTOS]
-        self.is_fedora = self.family == FEDORA
-        self.is_opensuse = self.family == OPENSUSE
-        self.is_centos = self.family == CENTOS
-        self.is_src = all([self.is_64bit, self.is_deb, self.version == '16.04'])
-        self.marker = MARKERS.get(self.family, ('', 'unknown'))[0]
-        self.hmarker = MARKERS.get(self.family, ('Unknown', ''))[1]
+            return '%s %s' % (self.family, self.version)
+        return '%s %s' % (self.family, self.version.split('.')[0])
+
+    @lazy_property
+    def arch(self):
+        return '%dbit' % (struct.calcsize('P') * 8)
+
+    @lazy_property
+    def is_64bit(self):
+        return self.arch == '64bit'
+
+    @lazy_property
+    def system(self):
+        if sys.platform.startswith('linux'):
+            return LINUX
+        return SYSTEMS.get(sys.platform, sys.platform)
+
+    @lazy_property
+    def is_msw(self):
+        return self.system == WINDOWS
+
+    @lazy_property
+    def is_linux(self):
+        return self.system == LINUX
+
+    @lazy_property
+    def is_macos(self):
+        return self.system == MACOS
+
+    @lazy_property
+    def is_deb(self):
+        return self.family in [MINT, UBUNTU, DEBIAN]
+
+    @lazy_property
+    def is_debian(self):
+        return self.family == DEBIAN
+
+    @lazy_property
+    def is_ubuntu(self):
+        return self.family == UBUNTU
+
+    @lazy_property
+    def is_rpm(self):
+        return self.family in [FEDORA, OPENSUSE, CENTOS]
+
+    @lazy_property
+    def is_fedora(self):
+        return self.family == FEDORA
+
+    @lazy_property
+    def is_opensuse(self):
+        return self.family == OPENSUSE
+
+    @lazy_property
+    def is_centos(self):
+        return self.family == CENTOS
+
+    @lazy_property
+    def is_src(self):
+        return all([self.is_64bit, self.is_deb, self.version == '16.04'])
+
+    @lazy_property
+    def marker(self):
+        return MARKERS.get(self.family, ('', 'unknown'))[0]
+
+    @lazy_property
+    def hmarker(self):
+        return MARKERS.get(self.family, ('Unknown', ''))[1]
+
+
+def get_target_facts(target, arch='64bit'):
+    """
+    Returns SystemFacts for target platform described as
+    'family version' string (like 'Ubuntu 16.04' or sid 'debian 9').
+    """
+    family, version = target.rsplit(' ', 1)
+    return SystemFacts(family=family, version=version, arch=arch)
 
 
 SYSFACTS = SystemFacts()
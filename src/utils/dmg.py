@@ -23,10 +23,27 @@
 import math
 import os
 import shutil
+import tempfile
 
-from . import fsutils
+from . import fsutils, staging
+from .runner import run
+from .trace import traced
 
 
+def get_manifest(targets):
+    """
+    Stages target files and directories in image root.
+    """
+    manifest = staging.Manifest()
+    for item in targets:
+        if os.path.isdir(item):
+            manifest.add_tree(item, os.path.basename(item.rstrip('/')))
+        else:
+            manifest.add_tree(item)
+    return manifest
+
+
+@traced('dmg:build')
 def dmg_build(targets=None,
               dmg_filename='test.dmg',
               volume_name='Install',
@@ -45,26 +62,25 @@ def dmg_build(targets=None,
     if not targets:
         raise Exception('DMG payload is not provided!')
 
-    if os.path.exists('tmp_dmg'):
-        os.system('rm -rf tmp_dmg')
-
-    os.system('mkdir -p tmp_dmg')
     if not os.path.exists(dist_dir):
         os.makedirs(dist_dir)
 
-    # Copying
-    for item in targets:
-        if os.path.isfile(item):
-            shutil.copy(item, 'tmp_dmg')
-        else:
-            dst = os.path.join('tmp_dmg', os.path.basename(item))
-            shutil.copytree(item, dst)
-
-    dmg_file = os.path.join(dist_dir, dmg_filename)
-    os.system('genisoimage -V "%s" -D -R -apple -no-pad -o %s tmp_dmg' % (volume_name, dmg_file))
-    os.system('rm -rf tmp_dmg')
-
-
+    # Targets are grafted into image instead of copying
+    manifest = get_manifest(targets)
+    tmp_dir = tempfile.mkdtemp(prefix='dmg-')
+    try:
+        path_list = os.path.join(tmp_dir, 'graft-points')
+        with open(path_list, 'wb') as fileptr:
+            staging.write_graft_points(manifest, fileptr, tmp_dir)
+        dmg_file = os.path.join(dist_dir, dmg_filename)
+        run(['genisoimage', '-V', volume_name, '-D', '-R', '-apple',
+             '-no-pad', '-o', dmg_file, '-graft-points',
+             '-path-list', path_list])
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+
+@traced('dmg:build2')
 def dmg_build2(targets=None,
               dmg_filename='test.dmg',
               volume_name='Install',
@@ -86,30 +102,29 @@ def dmg_build2(targets=None,
     sz = float(sum(fsutils.getsize(item) for item in targets))
     size = int(math.ceil(sz/10**6)) or 1
 
-    if os.path.exists('/tmp/%s' % dmg_filename):
-        os.remove('/tmp/%s' % dmg_filename)
+    image = os.path.join('/tmp', dmg_filename)
+    mount_dir = '/mnt/tmp_dmg'
+    if os.path.exists(image):
+        os.remove(image)
 
-    if os.path.exists('/mnt/tmp_dmg'):
-        os.system('rm -rf /mnt/tmp_dmg')
+    if os.path.exists(mount_dir):
+        shutil.rmtree(mount_dir, True)
 
     # File allocation
-    os.system('dd if=/dev/zero of=/tmp/%s bs=1M '
-              'count=%d status=progress' % (dmg_filename, size))
+    run(['dd', 'if=/dev/zero', 'of=%s' % image, 'bs=1M',
+         'count=%d' % size, 'status=progress'], check=True)
     # Formatting for HFS+
-    os.system('mkfs.hfsplus -v "%s" /tmp/%s' % (volume_name, dmg_filename))
+    run(['mkfs.hfsplus', '-v', volume_name, image], check=True)
 
     # Mounting
-    os.system('mkdir -pv /mnt/tmp_dmg && '
-              'mount -o loop /tmp/%s /mnt/tmp_dmg' % dmg_filename)
-    # Copying
-    for item in targets:
-        if os.path.isfile(item):
-            shutil.copy(item, '/mnt/tmp_dmg')
-        else:
-            dst = os.path.join('/mnt/tmp_dmg', os.path.basename(item))
-            shutil.copytree(item, dst)
-
-    # Unmounting
-    os.system('umount /mnt/tmp_dmg && rm -rf /mnt/tmp_dmg')
+    os.makedirs(mount_dir)
+    run(['mount', '-o', 'loop', image, mount_dir], check=True)
+    try:
+        # Copying
+        get_manifest(targets).extract(mount_dir)
+    finally:
+        # Unmounting
+        run(['umount', mount_dir])
+        shutil.rmtree(mount_dir, True)
     dst = os.path.join(dist_dir, dmg_filename)
-    shutil.move('/tmp/%s' % dmg_filename, dst)
+    shutil.move(image, dst)
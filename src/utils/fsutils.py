@@ -116,3 +116,70 @@ def getsize(path='.', count=False):
         else [os.path.getsize(f) for f in get_files_tree(path)]
     sz = sum(sizes)
     return (sz, len(sizes)) if count else sz
+
+
+# FICLONE ioctl request (linux/fs.h)
+FICLONE = 0x40049409
+
+
+def get_file_hash(path):
+    """
+    Returns sha1 hex digest of file content
+    """
+    import hashlib
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fileptr:
+        for chunk in iter(lambda: fileptr.read(1 << 20), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_same_file(path1, path2):
+    """
+    Checks do files have the same content
+    """
+    if not os.path.isfile(path2):
+        return False
+    if os.path.samefile(path1, path2):
+        return True
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    return get_file_hash(path1) == get_file_hash(path2)
+
+
+def reflink(src, dst):
+    """
+    Creates copy-on-write clone of src file (Linux only)
+    """
+    import fcntl
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+
+
+def place_file(src, dst):
+    """
+    Places src file at dst path by reflink, hard link or copy,
+    whatever filesystem allows first. Returns used method
+    ('reflink', 'hardlink', 'copy') or None if dst has the same
+    content already.
+    """
+    import shutil
+    if is_same_file(src, dst):
+        return None
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        reflink(src, dst)
+        shutil.copymode(src, dst)
+        return 'reflink'
+    except (ImportError, IOError, OSError):
+        if os.path.lexists(dst):
+            os.remove(dst)
+    if hasattr(os, 'link'):
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return 'copy'
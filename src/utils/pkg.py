@@ -27,9 +27,11 @@ import os
 import shutil
 import sys
 
-from . import fsutils
+from . import fsutils, staging
 from .bbox import echo_msg
 from .dmg import dmg_build
+from .runner import run
+from .trace import span
 from .xmlutils import XmlElement
 
 # KW_SAMPLE = {
@@ -87,53 +89,64 @@ class PkgBuilder:
     def __init__(self, kwargs):
         self.kwargs = kwargs
         self.payload_sz = (0, 0)
+        self.manifest = None
         self.build_dir = fsutils.normalize_path(self.kwargs['build_dir'])
         self.flat_dir = os.path.join(self.build_dir, 'flat')
-        self.scripts_dir = os.path.join(self.build_dir, 'scripts')
         self.proj_dir = os.path.join(self.flat_dir, 'Resources', 'en.lproj')
         self.pkg_dir = os.path.join(self.flat_dir, 'base.pkg')
-        self.root_dir = os.path.join(self.build_dir, 'root')
-        self.clear_build()
+        with span('pkg:build', package=self.kwargs.get('pkg_name', '')):
+            self.build()
+
+    def build(self):
+        with span('pkg:clear_build'):
+            self.clear_build()
 
         for item in (self.proj_dir, self.pkg_dir):
             os.makedirs(item)
-        self.create_payload()
-        self.create_pkg_info()
-        self.create_bom()
-        self.create_distribution()
-        self.make_pkg()
-        self.make_dmg()
+        with span('pkg:create_payload') as stage:
+            self.create_payload()
+            stage.add(bytes=self.payload_sz[0], files=self.payload_sz[1])
+        with span('pkg:create_pkg_info'):
+            self.create_pkg_info()
+        with span('pkg:create_bom'):
+            self.create_bom()
+        with span('pkg:create_distribution'):
+            self.create_distribution()
+        with span('pkg:make_pkg'):
+            self.make_pkg()
+        with span('pkg:make_dmg'):
+            self.make_dmg()
         if self.kwargs.get('remove_build', False):
             self.clear_build()
 
     def clear_build(self):
         if os.path.exists(self.build_dir):
-            os.system('rm -rf %s' % self.build_dir)
+            run(['rm', '-rf', self.build_dir])
 
     def create_payload(self):
         echo_msg('Creating payload...  ', False)
         src = fsutils.normalize_path(self.kwargs['src_dir'])
-        shutil.copytree(src, self.root_dir)
-        if os.system('( cd %s && find . | '
-                     'cpio -o --format odc --owner 0:80 | '
-                     'gzip -c ) > %s/Payload' % (self.root_dir, self.pkg_dir)):
+        self.manifest = staging.Manifest(uid=0, gid=80)
+        try:
+            self.manifest.add_tree(src)
+            with open(os.path.join(self.pkg_dir, 'Payload'), 'wb') as fileptr:
+                staging.write_cpio(self.manifest, fileptr)
+        except (IOError, OSError):
             echo_msg('Error in payload')
             sys.exit(1)
-        self.payload_sz = fsutils.getsize(self.root_dir, True)
+        self.payload_sz = (self.manifest.size, self.manifest.count)
         echo_msg('Payload created!')
 
     def add_scripts(self):
         echo_msg('Adding scripts...', False)
         scripts = None
-        os.makedirs(self.scripts_dir)
+        manifest = staging.Manifest(uid=0, gid=80)
         if 'preinstall' in self.kwargs:
             scripts = XmlElement('scripts')
 
             scr = self.kwargs['preinstall']
             name = os.path.basename(scr)
-            path = os.path.join(self.scripts_dir, name)
-            shutil.copy(fsutils.normalize_path(scr), path)
-            os.system('chmod +x %s' % path)
+            manifest.add_file(name, fsutils.normalize_path(scr), mode=0o755)
             scripts.add(XmlElement('preinstall', {'file': './%s' % name}))
 
         if 'postinstall' in self.kwargs:
@@ -141,17 +154,13 @@ class PkgBuilder:
 
             scr = self.kwargs['postinstall']
             name = os.path.basename(scr)
-            path = os.path.join(self.scripts_dir, name)
-            shutil.copy(fsutils.normalize_path(scr), path)
-            os.system('chmod +x %s' % path)
+            manifest.add_file(name, fsutils.normalize_path(scr), mode=0o755)
             scripts.add(XmlElement('postinstall', {'file': './%s' % name}))
 
         if scripts:
-            os.system('( cd %s && find . | '
-                      'cpio -o --format odc --owner 0:80 | gzip -c ) > '
-                      '%s/Scripts' % (self.scripts_dir, self.pkg_dir))
+            with open(os.path.join(self.pkg_dir, 'Scripts'), 'wb') as fileptr:
+                staging.write_cpio(manifest, fileptr)
 
-        os.system('rm -rf %s' % self.scripts_dir)
         echo_msg('   OK')
         return scripts
 
@@ -181,8 +190,12 @@ class PkgBuilder:
 
     def create_bom(self):
         echo_msg('Creating Bom...', False)
-        os.system('mkbom -u 0 -g 80 %s %s/Bom' % (self.root_dir, self.pkg_dir))
-        os.system('rm -rf %s' % self.root_dir)
+        # mkbom reads lsbom formatted list instead of payload tree
+        bom_list = os.path.join(self.build_dir, 'bom.txt')
+        with open(bom_list, 'wb') as fileptr:
+            staging.write_bom_list(self.manifest, fileptr)
+        run(['mkbom', '-i', bom_list, os.path.join(self.pkg_dir, 'Bom')])
+        os.remove(bom_list)
         echo_msg('   OK')
 
     def add_rescource(self, tag_name):
@@ -249,8 +262,11 @@ class PkgBuilder:
 
     def make_pkg(self):
         echo_msg('Creating package...', False)
-        os.system('( cd %s && xar --compression none '
-                  '-cf "../%s" * )' % (self.flat_dir, self.kwargs['pkg_name']))
+        items = sorted(item for item in os.listdir(self.flat_dir)
+                       if not item.startswith('.'))
+        run(['xar', '--compression', 'none',
+             '-cf', '../%s' % self.kwargs['pkg_name']] + items,
+            cwd=self.flat_dir)
         echo_msg('   OK')
 
     def make_dmg(self):
@@ -17,17 +17,24 @@
 # 	You should have received a copy of the GNU General Public License
 # 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import commands
+from .runner import run
+
+
+def pkg_config(*args):
+    """
+    Returns pkg-config output (with error messages as getoutput did).
+    """
+    return run(['pkg-config'] + list(args), capture=True).output.strip()
 
 
 def get_pkg_version(pkg_name):
-    return commands.getoutput("pkg-config --modversion %s" % pkg_name).strip()
+    return pkg_config('--modversion', pkg_name)
 
 
 def get_pkg_includes(pkg_names):
     includes = []
     for item in pkg_names:
-        output = commands.getoutput("pkg-config --cflags-only-I %s" % item)
+        output = pkg_config('--cflags-only-I', item)
         names = output.replace('-I', '').strip().split(' ')
         for name in names:
             if name not in includes:
@@ -38,7 +45,7 @@ def get_pkg_includes(pkg_names):
 def get_pkg_libs(pkg_names):
     libs = []
     for item in pkg_names:
-        output = commands.getoutput("pkg-config --libs-only-l %s" % item)
+        output = pkg_config('--libs-only-l', item)
         names = output.replace('-l', '').strip().split(' ')
         for name in names:
             if name not in libs:
@@ -49,7 +56,7 @@ def get_pkg_libs(pkg_names):
 def get_pkg_cflags(pkg_names):
     flags = []
     for item in pkg_names:
-        output = commands.getoutput("pkg-config --cflags-only-other %s" % item)
+        output = pkg_config('--cflags-only-other', item)
         names = output.strip().split(' ')
         for name in names:
             if name not in flags:
@@ -17,27 +17,307 @@
 # 	You should have received a copy of the GNU General Public License
 # 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import ast
+import datetime
+import hashlib
+import multiprocessing
 import os
+import pickle
+import re
+import struct
+import tokenize
+
 from . import fsutils
+from .trace import span, traced
+
+MO_MAGIC = 0x950412de
+MO_HEADER_SIZE = 28
+MSGCTXT_SEPARATOR = '\x04'
+
+CACHE_VERSION = 1
+EXTRACT_CACHE = os.environ.get(
+    'BUILD_PO_CACHE', os.path.expanduser('~/.cache/build-utils/po'))
+
+# Keyword -> indexes of msgid and msgid_plural arguments
+PY_KEYWORDS = {
+    '_': (0,), 'gettext': (0,), 'ugettext': (0,),
+    'ngettext': (0, 1), 'ungettext': (0, 1),
+    'dgettext': (1,), 'dngettext': (1, 2),
+}
+PY_FORMAT = re.compile(
+    r'%(\([^)]*\))?[#0 +-]*(\*|\d+)?(\.(\*|\d+))?[diouxXeEfFgGcrs]')
+
+POT_HEADER = '''# SOME DESCRIPTIVE TITLE.
+# Copyright (C) YEAR THE PACKAGE'S COPYRIGHT HOLDER
+# This file is distributed under the same license as the PACKAGE package.
+# FIRST AUTHOR <EMAIL@ADDRESS>, YEAR.
+#
+#, fuzzy
+msgid ""
+msgstr ""
+"Project-Id-Version: PACKAGE VERSION\\n"
+"Report-Msgid-Bugs-To: \\n"
+"POT-Creation-Date: %s\\n"
+"PO-Revision-Date: YEAR-MO-DA HO:MI+ZONE\\n"
+"Last-Translator: FULL NAME <EMAIL@ADDRESS>\\n"
+"Language-Team: LANGUAGE <LL@li.org>\\n"
+"Language: \\n"
+"MIME-Version: 1.0\\n"
+"Content-Type: text/plain; charset=UTF-8\\n"
+"Content-Transfer-Encoding: 8bit\\n"
+"Plural-Forms: nplurals=INTEGER; plural=EXPRESSION;\\n"
+'''
+
+PO_ESCAPES = {
+    'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b',
+    'f': '\f', 'v': '\v', '\\': '\\', '"': '"', "'": "'", '?': '?',
+}
+
+
+def _extract_file(path):
+    """
+    Extracts gettext messages from python source using tokenizer.
+    Returns (messages, error) where messages is a list of
+    (msgid, msgid_plural, lineno, is_python_format) tuples.
+    """
+    messages = []
+    keyword = None
+    args = []
+    depth = 0
+    try:
+        with open(path, 'rb') as fileptr:
+            tokens = list(tokenize.generate_tokens(fileptr.readline))
+    except (tokenize.TokenError, IndentationError, SyntaxError) as e:
+        return messages, '%s: %s' % (path, e)
+    for toktype, tokval, start, _end, _line in tokens:
+        if keyword is None:
+            if toktype == tokenize.NAME and tokval in PY_KEYWORDS:
+                keyword = (tokval, start[0])
+                args = []
+                depth = 0
+            continue
+        if not depth:
+            if toktype == tokenize.OP and tokval == '(':
+                depth = 1
+                args = [[]]
+            elif toktype == tokenize.NAME and tokval in PY_KEYWORDS:
+                keyword = (tokval, start[0])
+            else:
+                keyword = None
+            continue
+        if toktype in (tokenize.COMMENT, tokenize.NL):
+            continue
+        if toktype == tokenize.OP and tokval in '([{':
+            depth += 1
+            args[-1].append(None)
+        elif toktype == tokenize.OP and tokval in ')]}':
+            depth -= 1
+            if not depth:
+                _add_message(messages, keyword, args)
+                keyword = None
+            else:
+                args[-1].append(None)
+        elif toktype == tokenize.OP and tokval == ',' and depth == 1:
+            args.append([])
+        elif toktype == tokenize.STRING:
+            try:
+                value = ast.literal_eval(tokval.decode('utf-8'))
+            except (ValueError, SyntaxError, UnicodeDecodeError):
+                value = None
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            args[-1].append(value)
+        else:
+            args[-1].append(None)
+    return messages, None
+
+
+def _add_message(messages, keyword, args):
+    name, lineno = keyword
+    strs = []
+    for index in PY_KEYWORDS[name]:
+        if index >= len(args) or not args[index] or None in args[index]:
+            return
+        strs.append(''.join(args[index]))
+    if not strs[0]:
+        return
+    plural = strs[1] if len(strs) > 1 else None
+    is_format = any(PY_FORMAT.search(item) for item in strs)
+    messages.append((strs[0], plural, lineno, is_format))
+
+
+def _escape(value):
+    for char, escaped in (('\\', '\\\\'), ('"', '\\"'), ('\t', '\\t'),
+                          ('\r', '\\r'), ('\n', '\\n')):
+        value = value.replace(char, escaped)
+    return value
+
+
+def _po_string(keyword, value):
+    lines = value.split('\n')
+    lines = [item + '\n' for item in lines[:-1]] + [lines[-1]]
+    lines = [item for item in lines if item]
+    if len(lines) < 2:
+        return '%s "%s"\n' % (keyword, _escape(value))
+    return '%s ""\n' % keyword + \
+           ''.join('"%s"\n' % _escape(item) for item in lines)
+
+
+def load_extract_cache(cache_file):
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as fileptr:
+                cache = pickle.load(fileptr)
+            if cache.get('version') == CACHE_VERSION:
+                return cache['files']
+        except Exception:
+            pass
+    return {}
+
+
+def save_extract_cache(cache_file, files):
+    if cache_file:
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(cache_file, 'wb') as fileptr:
+            pickle.dump({'version': CACHE_VERSION, 'files': files},
+                        fileptr, 2)
+
+
+def _file_hash(path):
+    with open(path, 'rb') as fileptr:
+        return hashlib.md5(fileptr.read()).hexdigest()
+
+
+@traced('po:extract_messages')
+def extract_messages(files, cache_file=None, jobs=1, errors=None):
+    """
+    Extracts messages from provided python files. Per-file results
+    are cached by path, mtime, size and content hash, so only changed
+    files are tokenized again. Returns {path: messages} dict.
+    """
+    cache = load_extract_cache(cache_file)
+    result = {}
+    changed = []
+    dirty = len(files) != len(cache)
+    for path in files:
+        stat = os.stat(path)
+        entry = cache.get(path)
+        if entry and entry['mtime'] == stat.st_mtime and \
+                entry['size'] == stat.st_size:
+            result[path] = entry
+            continue
+        digest = _file_hash(path)
+        if entry and entry['md5'] == digest:
+            entry.update(mtime=stat.st_mtime, size=stat.st_size)
+            result[path] = entry
+            dirty = True
+            continue
+        result[path] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                        'md5': digest, 'messages': []}
+        changed.append(path)
+
+    if jobs > 1 and len(changed) > jobs:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            extracted = pool.map(_extract_file, changed)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        extracted = [_extract_file(path) for path in changed]
+
+    for path, (messages, error) in zip(changed, extracted):
+        result[path]['messages'] = messages
+        if error:
+            result[path]['mtime'] = None
+            if errors is not None:
+                errors.append(error)
+
+    if changed or dirty or set(result) != set(cache):
+        save_extract_cache(cache_file, result)
+    return dict((path, entry['messages']) for path, entry in result.items())
 
 
-def build_pot(paths, po_file='messages.po', error_logs=False):
-    ret = 0
+@traced('po:write_pot')
+def write_pot(files, extracted, po_file='messages.po'):
+    """
+    Merges extracted messages into POT file. Messages are ordered
+    by first occurrence along provided file list.
+    """
+    order = []
+    catalog = {}
+    for path in files:
+        for msgid, plural, lineno, is_format in extracted.get(path, []):
+            if msgid not in catalog:
+                order.append(msgid)
+                catalog[msgid] = [plural, [], is_format]
+            entry = catalog[msgid]
+            entry[0] = entry[0] or plural
+            entry[1].append('%s:%d' % (path, lineno))
+            entry[2] = entry[2] or is_format
+
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M%z')
+    with open(po_file, 'wb') as fileptr:
+        fileptr.write(POT_HEADER % timestamp)
+        for msgid in order:
+            plural, refs, is_format = catalog[msgid]
+            fileptr.write('\n')
+            line = '#:'
+            for ref in refs:
+                if len(line) + len(ref) + 1 > 79 and line != '#:':
+                    fileptr.write(line + '\n')
+                    line = '#:'
+                line += ' ' + ref
+            fileptr.write(line + '\n')
+            if is_format:
+                fileptr.write('#, python-format\n')
+            fileptr.write(_po_string('msgid', msgid))
+            if plural is None:
+                fileptr.write('msgstr ""\n')
+            else:
+                fileptr.write(_po_string('msgid_plural', plural))
+                fileptr.write('msgstr[0] ""\nmsgstr[1] ""\n')
+
+
+def get_extract_cache(po_file):
+    """
+    Returns extraction cache file of POT file in per-user cache
+    directory, so source tree is not polluted.
+    """
+    key = hashlib.md5(os.path.abspath(po_file)).hexdigest()
+    return os.path.join(EXTRACT_CACHE, key + '.cache')
+
+
+@traced('po:build_pot')
+def build_pot(paths, po_file='messages.po', error_logs=False,
+              cache_file=None, jobs=1):
+    """
+    Updates POT file from python files under provided paths.
+    Extraction cache is kept in cache_file (per-user cache by default,
+    empty value disables the cache).
+    """
+    if cache_file is None:
+        cache_file = get_extract_cache(po_file)
     files = []
-    error_logs = 'warnings.log' if error_logs else '/dev/null'
-    file_list = 'locale.in'
+    errors = []
     for path in paths:
         files += fsutils.get_files_tree(path, 'py')
-    open(file_list, 'w').write('\n'.join(files))
-    ret += os.system('xgettext -f %s -L Python -o %s 2>%s' %
-                     (file_list, po_file, error_logs))
-    if ret:
+    try:
+        extracted = extract_messages(files, cache_file, jobs, errors)
+        write_pot(files, extracted, po_file)
+    except (IOError, OSError) as e:
+        errors.append(str(e))
         print 'Error while POT file update'
-    ret += os.system('rm -f %s' % file_list)
-    if not ret:
-        print 'POT file updated'
+        return
+    finally:
+        if error_logs:
+            open('warnings.log', 'w').write('\n'.join(errors))
+    print 'POT file updated'
 
 
+@traced('po:build_locales')
 def build_locales(src_path, dest_path, textdomain):
     print 'Building locales'
     for item in fsutils.get_filenames(src_path, 'po'):
@@ -48,4 +328,242 @@ def build_locales(src_path, dest_path, textdomain):
         if not os.path.lexists(mo_dir):
             os.makedirs(mo_dir)
         print po_file, '==>', mo_file
-        os.system('msgfmt -o %s %s' % (mo_file, po_file))
+        compile_po(po_file, mo_file)
+
+
+def _unescape(line, filename, lineno):
+    if len(line) < 2 or not line.startswith('"') or not line.endswith('"'):
+        raise ValueError('%s:%d: invalid string %s' % (filename, lineno, line))
+    line = line[1:-1]
+    if '\\' not in line:
+        return line
+    ret = []
+    pos = 0
+    size = len(line)
+    while pos < size:
+        char = line[pos]
+        pos += 1
+        if char != '\\':
+            ret.append(char)
+            continue
+        char = line[pos:pos + 1]
+        pos += 1
+        if char in PO_ESCAPES:
+            ret.append(PO_ESCAPES[char])
+        elif char in '01234567':
+            end = pos - 1
+            while end < min(pos + 2, size) and line[end] in '01234567':
+                end += 1
+            ret.append(chr(int(line[pos - 1:end], 8) & 0xff))
+            pos = end
+        elif char == 'x':
+            end = pos
+            while end < size and line[end] in '0123456789abcdefABCDEF':
+                end += 1
+            if end == pos:
+                raise ValueError('%s:%d: invalid escape sequence' %
+                                 (filename, lineno))
+            ret.append(chr(int(line[pos:end], 16) & 0xff))
+            pos = end
+        else:
+            raise ValueError('%s:%d: invalid escape sequence' %
+                             (filename, lineno))
+    return ''.join(ret)
+
+
+def parse_po(po_file, use_fuzzy=False):
+    """
+    Parses PO file and returns list of catalog messages.
+    Each message is (msgctxt, msgid, msgid_plural, msgstr_list) tuple,
+    msgctxt and msgid_plural are None if absent. Obsolete, untranslated
+    and fuzzy (except header) entries are dropped as msgfmt does.
+    """
+    messages = []
+    keys = set()
+    state = {}
+
+    def flush():
+        if 'msgid' not in state:
+            state.clear()
+            return
+        ctxt = state.get('msgctxt')
+        msgid = state['msgid']
+        plural = state.get('msgid_plural')
+        msgstr = state.get('msgstr', {})
+        strs = [msgstr.get(i, '') for i in range(max(msgstr) + 1)] \
+            if msgstr else ['']
+        is_header = ctxt is None and not msgid
+        if strs[0] and (use_fuzzy or is_header or not state.get('fuzzy')):
+            key = msgid if ctxt is None else ctxt + MSGCTXT_SEPARATOR + msgid
+            if key in keys:
+                raise ValueError('%s:%d: duplicate message definition' %
+                                 (po_file, state['lineno']))
+            keys.add(key)
+            messages.append((ctxt, msgid, plural, strs))
+        state.clear()
+
+    section = None
+    fuzzy = False
+    lineno = 0
+    with open(po_file, 'rb') as fileptr:
+        for line in fileptr:
+            lineno += 1
+            line = line.strip()
+            if lineno == 1 and line.startswith('\xef\xbb\xbf'):
+                line = line[3:]
+            if not line:
+                if state:
+                    # blank line ends entry, its flags are consumed
+                    fuzzy = False
+                continue
+            if line.startswith('#~'):
+                # flags of obsolete entry are not carried to the next one
+                fuzzy = False
+                continue
+            if line.startswith('#'):
+                if line.startswith('#,') and 'fuzzy' in \
+                        [flag.strip() for flag in line[2:].split(',')]:
+                    fuzzy = True
+                continue
+            if line.startswith('"'):
+                if section is None:
+                    raise ValueError('%s:%d: unexpected string' %
+                                     (po_file, lineno))
+                value = _unescape(line, po_file, lineno)
+                if isinstance(section, tuple):
+                    state['msgstr'][section[1]] += value
+                else:
+                    state[section] += value
+                continue
+            keyword, _sep, value = line.partition(' ')
+            value = _unescape(value.strip(), po_file, lineno)
+            if keyword in ('msgctxt', 'msgid'):
+                if 'msgstr' in state or \
+                        (keyword == 'msgid' and 'msgid' in state):
+                    flush()
+                if keyword in state:
+                    raise ValueError('%s:%d: duplicate %s' %
+                                     (po_file, lineno, keyword))
+                if not state:
+                    state['lineno'] = lineno
+                    state['fuzzy'] = fuzzy
+                    fuzzy = False
+                state[keyword] = value
+                section = keyword
+            elif keyword == 'msgid_plural':
+                state['msgid_plural'] = value
+                section = keyword
+            elif keyword.startswith('msgstr'):
+                if 'msgid' not in state:
+                    raise ValueError('%s:%d: msgstr without msgid' %
+                                     (po_file, lineno))
+                index = 0
+                if keyword != 'msgstr':
+                    if not (keyword.startswith('msgstr[') and
+                            keyword.endswith(']') and keyword[7:-1].isdigit()):
+                        raise ValueError('%s:%d: invalid keyword %s' %
+                                         (po_file, lineno, keyword))
+                    index = int(keyword[7:-1])
+                state.setdefault('msgstr', {})[index] = value
+                section = ('msgstr', index)
+            else:
+                raise ValueError('%s:%d: invalid keyword %s' %
+                                 (po_file, lineno, keyword))
+    flush()
+    return messages
+
+
+def hash_string(value):
+    """
+    Returns hashpjw value used by GNU gettext for MO hash table.
+    """
+    hval = 0
+    for char in value:
+        hval = ((hval << 4) + ord(char)) & 0xffffffff
+        high = hval & 0xf0000000
+        if high:
+            hval ^= high >> 24
+            hval ^= high
+    return hval
+
+
+def _is_prime(candidate):
+    # Mirrors gettext's is_prime() quirks to get identical table sizes
+    divn = 3
+    square = divn * divn
+    while square < candidate and candidate % divn:
+        divn += 1
+        square += 4 * divn
+        divn += 1
+    return candidate % divn != 0
+
+
+def _hash_size(count):
+    size = (count * 4) // 3 | 1
+    while not _is_prime(size):
+        size += 2
+    return 3 if size <= 2 else size
+
+
+def write_mo(messages, mo_file):
+    """
+    Writes GNU MO file with hash table for provided messages
+    in the same layout msgfmt produces.
+    """
+    entries = []
+    for ctxt, msgid, plural, strs in messages:
+        key = msgid if ctxt is None else ctxt + MSGCTXT_SEPARATOR + msgid
+        orig = key if plural is None else key + '\0' + plural
+        entries.append((key, orig, '\0'.join(strs)))
+    entries.sort()
+
+    count = len(entries)
+    hash_size = _hash_size(count)
+    orig_offset = MO_HEADER_SIZE
+    trans_offset = orig_offset + 8 * count
+    hash_offset = trans_offset + 8 * count
+    offset = hash_offset + 4 * hash_size
+
+    orig_table = []
+    for _key, orig, _trans in entries:
+        orig_table += [len(orig), offset]
+        offset += len(orig) + 1
+    trans_table = []
+    for _key, _orig, trans in entries:
+        trans_table += [len(trans), offset]
+        offset += len(trans) + 1
+
+    hash_table = [0] * hash_size
+    for index, (key, _orig, _trans) in enumerate(entries):
+        hash_val = hash_string(key)
+        idx = hash_val % hash_size
+        if hash_table[idx]:
+            incr = 1 + (hash_val % (hash_size - 2))
+            while hash_table[idx]:
+                if idx >= hash_size - incr:
+                    idx -= hash_size - incr
+                else:
+                    idx += incr
+        hash_table[idx] = index + 1
+
+    with open(mo_file, 'wb') as fileptr:
+        fileptr.write(struct.pack('<7I', MO_MAGIC, 0, count, orig_offset,
+                                  trans_offset, hash_size, hash_offset))
+        fileptr.write(struct.pack('<%dI' % (2 * count), *orig_table))
+        fileptr.write(struct.pack('<%dI' % (2 * count), *trans_table))
+        fileptr.write(struct.pack('<%dI' % hash_size, *hash_table))
+        for _key, orig, _trans in entries:
+            fileptr.write(orig + '\0')
+        for _key, _orig, trans in entries:
+            fileptr.write(trans + '\0')
+
+
+def compile_po(po_file, mo_file, use_fuzzy=False):
+    """
+    Compiles PO file into MO file without msgfmt call.
+    """
+    with span('po:compile_po', file=os.path.basename(po_file)) as stage:
+        messages = parse_po(po_file, use_fuzzy)
+        write_mo(messages, mo_file)
+        stage.add(files=1, bytes=os.path.getsize(mo_file),
+                  messages=len(messages))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+#   Opt-in stage profiling
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#   Profiles traced stages (see trace.py) when enabled by environment:
+#       BUILD_PROFILE=<dir> - write <stage>.pstats files into dir
+#       BUILD_PROFILE_MEMORY=1 - also write <stage>.alloc.txt reports
+#       BUILD_PROFILE_STAGES=deb:*,po:* - profile matching stages only
+#   or by command line flags of setup scripts:
+#       --profile=<dir> --profile-memory --profile-stages=deb:*
+#   Nested stages of already profiled stage are included into
+#   outer profile. Allocation reports use tracemalloc where
+#   available, otherwise growth of live objects by type.
+
+import cProfile
+import fnmatch
+import gc
+import os
+import re
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PROFILE_ENV = 'BUILD_PROFILE'
+MEMORY_ENV = 'BUILD_PROFILE_MEMORY'
+STAGES_ENV = 'BUILD_PROFILE_STAGES'
+TOP_ALLOCATIONS = 25
+
+
+def _max_rss():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _count_objects():
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+class Profiler(object):
+    """
+    Wraps stages into cProfile and memory snapshots.
+    """
+
+    def __init__(self, path, memory=False, stages=None,
+                 top=TOP_ALLOCATIONS):
+        self.path = os.path.abspath(path)
+        self.memory = memory
+        self.stages = stages or []
+        self.top = top
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counter = 0
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def match(self, name):
+        if not self.stages:
+            return True
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.stages)
+
+    def get_filename(self, name):
+        with self.lock:
+            self.counter += 1
+            counter = self.counter
+        name = re.sub(r'[^\w.-]+', '_', name)
+        return os.path.join(self.path, '%s-%d-%03d' % (
+            name, os.getpid(), counter))
+
+    def start(self, name):
+        """
+        Starts profiling of stage. Returns state for stop()
+        or None if stage is not profiled.
+        """
+        if getattr(self.local, 'active', False) or not self.match(name):
+            return None
+        self.local.active = True
+        snapshot = None
+        if self.memory:
+            if tracemalloc is not None:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                snapshot = tracemalloc.take_snapshot()
+            else:
+                snapshot = (_count_objects(), _max_rss())
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile, snapshot
+
+    def stop(self, name, state):
+        profile, snapshot = state
+        profile.disable()
+        self.local.active = False
+        filename = self.get_filename(name)
+        profile.dump_stats(filename + '.pstats')
+        if self.memory:
+            with open(filename + '.alloc.txt', 'w') as fileptr:
+                fileptr.write(self.memory_report(name, snapshot))
+
+    def memory_report(self, name, snapshot):
+        lines = ['Stage: %s' % name]
+        if tracemalloc is not None:
+            stats = tracemalloc.take_snapshot().compare_to(snapshot,
+                                                           'lineno')
+            lines.append('Top %d allocations:' % self.top)
+            lines += [str(stat) for stat in stats[:self.top]]
+            return '\n'.join(lines) + '\n'
+        counts, max_rss = snapshot
+        growth = []
+        for type_name, count in _count_objects().items():
+            diff = count - counts.get(type_name, 0)
+            if diff:
+                growth.append((diff, type_name, count))
+        growth.sort(reverse=True)
+        lines.append('Peak RSS: %d KB (%+d KB)' % (_max_rss(),
+                                                 _max_rss() - max_rss))
+        lines.append('Top %d live object types growth:' % self.top)
+        lines += ['%+10d %10d  %s' % (diff, count, type_name)
+                  for diff, type_name, count in growth[:self.top]]
+        return '\n'.join(lines) + '\n'
+
+
+def enable(path, memory=False, stages=None):
+    """
+    Enables profiling of traced stages.
+    """
+    from . import trace
+    trace.PROFILER = Profiler(path, memory, stages)
+    return trace.PROFILER
+
+
+def disable():
+    from . import trace
+    trace.PROFILER = None
+
+
+def _split(value):
+    return [item.strip() for item in (value or '').split(',')
+            if item.strip()]
+
+
+def get_env_profiler(environ=os.environ):
+    """
+    Returns Profiler configured by environment or None.
+    """
+    if not environ.get(PROFILE_ENV):
+        return None
+    return Profiler(environ[PROFILE_ENV],
+                    environ.get(MEMORY_ENV, '') not in ('', '0'),
+                    _split(environ.get(STAGES_ENV)))
+
+
+def enable_from_argv(argv):
+    """
+    Removes --profile* flags from argv (e.g. sys.argv of setup
+    script) and enables profiling if requested.
+    """
+    path = None
+    memory = False
+    stages = []
+    for arg in list(argv[1:]):
+        if arg.startswith('--profile='):
+            path = arg.split('=', 1)[1]
+        elif arg == '--profile-memory':
+            memory = True
+        elif arg.startswith('--profile-stages='):
+            stages = _split(arg.split('=', 1)[1])
+        else:
+            continue
+        argv.remove(arg)
+    if path:
+        return enable(path, memory, stages)
+    return None
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#
+#   Repository metadata index and dependency checker
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#   Checks declared dependencies against local copies of distro
+#   repository metadata:
+#       apt - dists/<suite>/<component>/binary-<arch>/Packages(.gz)
+#       rpm - repodata/*-primary.xml(.gz)
+#   Metadata is stream-parsed, only package names, versions and
+#   provides are kept in memory.
+
+import bz2
+import gzip
+import re
+import xml.etree.cElementTree as ET
+
+from . import dependencies
+from .bbox import echo_msg
+
+DEB = dependencies.DEB
+RPM = dependencies.RPM
+
+RPM_NS = '{http://linux.duke.edu/metadata/common}'
+RPM_NS_RPM = '{http://linux.duke.edu/metadata/rpm}'
+
+DEB_DEPEND = re.compile(
+    r'^\s*([^\s(:]+)(?::\S+)?\s*(?:\(\s*(<<|<=|=|>=|>>|<|>)\s*([^)\s]+)\s*\))?'
+    r'\s*$')
+RPM_DEPEND = re.compile(r'(\S+)(?:\s+(<=|>=|=|<|>)\s+(\S+))?')
+
+
+def open_metadata(path):
+    """
+    Opens plain, gzip or bzip2 compressed metadata file for streaming.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    return open(path, 'rb')
+
+
+class PackageIndex(object):
+    """
+    Compact name -> versions index of a repository.
+    Provides map stores provided name -> versions (None for
+    unversioned provides).
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.packages = {}
+        self.provides = {}
+
+    def __len__(self):
+        return len(self.packages)
+
+    def add(self, name, version, provides=None):
+        name = intern(name)
+        versions = self.packages.get(name, ())
+        if version not in versions:
+            self.packages[name] = versions + (version,)
+        for item, ver in provides or []:
+            item = intern(item)
+            versions = self.provides.get(item, ())
+            if ver not in versions:
+                self.provides[item] = versions + (ver,)
+
+    def compare(self, ver1, ver2):
+        if self.kind == DEB:
+            return compare_deb_versions(ver1, ver2)
+        return compare_rpm_versions(ver1, ver2)
+
+    def match(self, version, op, required):
+        if version is None:
+            return False
+        res = self.compare(version, required)
+        return {
+            '<<': res < 0, '<': res < 0, '<=': res <= 0, '=': res == 0,
+            '>=': res >= 0, '>>': res > 0, '>': res > 0,
+        }[op]
+
+    def satisfies(self, name, op=None, version=None):
+        """
+        Checks is there a package or provide satisfying the constraint.
+        """
+        for versions in (self.packages.get(name), self.provides.get(name)):
+            if not versions:
+                continue
+            if op is None:
+                return True
+            if any(self.match(ver, op, version) for ver in versions):
+                return True
+        return False
+
+
+def parse_deb_index(path, index=None):
+    """
+    Stream-parses apt Packages file into PackageIndex.
+    """
+    index = PackageIndex(DEB) if index is None else index
+    fields = {}
+    with open_metadata(path) as fileptr:
+        for line in fileptr:
+            if not line.strip():
+                _add_deb_stanza(index, fields)
+                fields = {}
+                continue
+            if line[0] in ' \t':
+                continue
+            key, _sep, value = line.partition(':')
+            if key in ('Package', 'Version', 'Provides'):
+                fields[key] = value.strip()
+    _add_deb_stanza(index, fields)
+    return index
+
+
+def _add_deb_stanza(index, fields):
+    if 'Package' not in fields:
+        return
+    provides = []
+    for item in fields.get('Provides', '').split(','):
+        match = DEB_DEPEND.match(item)
+        if match and item.strip():
+            provides.append((match.group(1), match.group(3)))
+    index.add(fields['Package'], fields.get('Version'), provides)
+
+
+def _rpm_evr(elem):
+    if elem is None or elem.get('ver') is None:
+        return None
+    evr = elem.get('ver')
+    if elem.get('rel'):
+        evr = '%s-%s' % (evr, elem.get('rel'))
+    if elem.get('epoch') and elem.get('epoch') != '0':
+        evr = '%s:%s' % (elem.get('epoch'), evr)
+    return evr
+
+
+def parse_rpm_index(path, index=None):
+    """
+    Stream-parses rpm-md primary.xml file into PackageIndex.
+    Processed package elements are dropped immediately.
+    """
+    index = PackageIndex(RPM) if index is None else index
+    with open_metadata(path) as fileptr:
+        context = ET.iterparse(fileptr, events=('start', 'end'))
+        root = None
+        for event, elem in context:
+            if root is None:
+                root = elem
+            if event != 'end' or elem.tag != RPM_NS + 'package':
+                continue
+            provides = []
+            entries = elem.find('%sformat/%sprovides' % (RPM_NS, RPM_NS_RPM))
+            for entry in entries if entries is not None else []:
+                provides.append((entry.get('name'), _rpm_evr(entry)))
+            index.add(elem.findtext(RPM_NS + 'name'),
+                      _rpm_evr(elem.find(RPM_NS + 'version')), provides)
+            elem.clear()
+            root.clear()
+    return index
+
+
+def load_index(kind, paths):
+    """
+    Builds single index for several metadata files
+    (e.g. main and updates repositories).
+    """
+    index = PackageIndex(kind)
+    parser = parse_deb_index if kind == DEB else parse_rpm_index
+    for path in paths:
+        parser(path, index)
+    return index
+
+
+# --- Version comparison
+
+def _order(char):
+    if char == '~':
+        return -1
+    if char.isdigit():
+        return 0
+    if not char:
+        return 0
+    if char.isalpha():
+        return ord(char)
+    return ord(char) + 256
+
+
+def _compare_deb_part(val1, val2):
+    while val1 or val2:
+        while (val1 and not val1[0].isdigit()) or \
+                (val2 and not val2[0].isdigit()):
+            ac = _order(val1[0] if val1 else '')
+            bc = _order(val2[0] if val2 else '')
+            if ac != bc:
+                return ac - bc
+            val1, val2 = val1[1:], val2[1:]
+        num1 = re.match(r'\d*', val1).group()
+        num2 = re.match(r'\d*', val2).group()
+        val1, val2 = val1[len(num1):], val2[len(num2):]
+        first_diff = int(num1 or 0) - int(num2 or 0)
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def _split_deb_version(version):
+    epoch = 0
+    if ':' in version:
+        epoch, version = version.split(':', 1)
+        epoch = int(epoch)
+    upstream, _sep, revision = version.rpartition('-')
+    if not upstream:
+        upstream, revision = revision, ''
+    return epoch, upstream, revision
+
+
+def compare_deb_versions(ver1, ver2):
+    """
+    Compares versions as dpkg does. Returns negative, zero
+    or positive number.
+    """
+    epoch1, upstream1, revision1 = _split_deb_version(ver1)
+    epoch2, upstream2, revision2 = _split_deb_version(ver2)
+    if epoch1 != epoch2:
+        return epoch1 - epoch2
+    return _compare_deb_part(upstream1, upstream2) or \
+        _compare_deb_part(revision1, revision2)
+
+
+def _rpmvercmp(ver1, ver2):
+    # Port of rpmvercmp() from rpm library
+    if ver1 == ver2:
+        return 0
+    one = two = 0
+    size1, size2 = len(ver1), len(ver2)
+
+    def skip(val, pos, size):
+        while pos < size and not val[pos].isalnum() and val[pos] not in '~^':
+            pos += 1
+        return pos
+
+    while one < size1 or two < size2:
+        one = skip(ver1, one, size1)
+        two = skip(ver2, two, size2)
+        ch1 = ver1[one] if one < size1 else ''
+        ch2 = ver2[two] if two < size2 else ''
+        if ch1 == '~' or ch2 == '~':
+            if ch1 != '~':
+                return 1
+            if ch2 != '~':
+                return -1
+            one += 1
+            two += 1
+            continue
+        if ch1 == '^' or ch2 == '^':
+            if not ch1:
+                return -1
+            if not ch2:
+                return 1
+            if ch1 != '^':
+                return 1
+            if ch2 != '^':
+                return -1
+            one += 1
+            two += 1
+            continue
+        if not (ch1 and ch2):
+            break
+        is_num = ch1.isdigit()
+        test = str.isdigit if is_num else str.isalpha
+        end1, end2 = one, two
+        while end1 < size1 and test(ver1[end1]):
+            end1 += 1
+        while end2 < size2 and test(ver2[end2]):
+            end2 += 1
+        seg1, seg2 = ver1[one:end1], ver2[two:end2]
+        if not seg1:
+            return -1
+        if not seg2:
+            return 1 if is_num else -1
+        if is_num:
+            seg1, seg2 = int(seg1), int(seg2)
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+        one, two = end1, end2
+    if one >= size1 and two >= size2:
+        return 0
+    return 1 if one < size1 else -1
+
+
+def compare_rpm_versions(ver1, ver2):
+    """
+    Compares [epoch:]version[-release] strings as rpm does.
+    Release is compared only if both versions have it.
+    """
+    epoch1, version1, release1 = _split_deb_version(ver1)
+    epoch2, version2, release2 = _split_deb_version(ver2)
+    if epoch1 != epoch2:
+        return epoch1 - epoch2
+    res = _rpmvercmp(version1, version2)
+    if res or not release1 or not release2:
+        return res
+    return _rpmvercmp(release1, release2)
+
+
+# --- Dependency checking
+
+def parse_depends(kind, depends):
+    """
+    Returns list of alternatives lists with (name, op, version) items.
+    """
+    if kind == DEB:
+        result = []
+        for group in depends.split(','):
+            if not group.strip():
+                continue
+            alternatives = []
+            for item in group.split('|'):
+                match = DEB_DEPEND.match(item)
+                if not match:
+                    raise ValueError('Invalid dependency "%s"' % item.strip())
+                alternatives.append(match.groups())
+            result.append(alternatives)
+        return result
+    return [[match.groups()] for match in RPM_DEPEND.finditer(depends)]
+
+
+def check_depends(kind, depends, index):
+    """
+    Returns list of unsatisfied dependencies.
+    """
+    if not isinstance(depends, basestring):
+        depends = dependencies.SEPARATORS[kind].join(depends)
+    missing = []
+    for alternatives in parse_depends(kind, depends):
+        if not any(index.satisfies(*item) for item in alternatives):
+            missing.append(' | '.join(
+                '%s (%s %s)' % item if item[1] else item[0]
+                for item in alternatives))
+    return missing
+
+
+def check_target(target, paths, apps=dependencies.APPS):
+    """
+    Checks declared dependencies of target against repository
+    metadata files. Returns {app: [missing dependencies]} dict.
+    """
+    kind = DEB if target in dependencies.DEB_MATRIX else RPM
+    index = load_index(kind, paths)
+    table = dependencies.DEPENDENCIES[kind]
+    result = {}
+    for app in apps:
+        missing = check_depends(kind, table.get((target, app), ()), index)
+        if missing:
+            echo_msg('%s (%s): unresolved %s' %
+                     (target, app, ', '.join(missing)))
+        result[app] = missing
+    return result
@@ -19,6 +19,9 @@
 
 import os
 
+from .runner import run
+from .trace import span
+
 
 class RpmBuilder(object):
     """
@@ -90,13 +93,20 @@ class RpmBuilder(object):
         self.dist_dir = os.path.join(self.current_path, 'dist')
         self.tarball = ''
 
-        self.clear_rpmbuild()
-        self.create_rpmbuild()
-        self.copy_sources(*self.find_tarball())
-        self.write_spec()
-        os.chdir(self.rpmbuild_path + '/SPECS')
-        self.build_rpm()
-        self.clear_rpmbuild()
+        with span('rpm:build', package=self.name):
+            with span('rpm:prepare'):
+                self.clear_rpmbuild()
+                self.create_rpmbuild()
+            with span('rpm:sources') as stage:
+                self.tarball = self.find_tarball()[0]
+                stage.add(files=1, bytes=os.path.getsize(self.tarball))
+            with span('rpm:write_spec'):
+                self.write_spec()
+            os.chdir(self.rpmbuild_path + '/SPECS')
+            with span('rpm:rpmbuild'):
+                self.build_rpm()
+            with span('rpm:clear'):
+                self.clear_rpmbuild()
 
     def find_tarball(self):
         if not os.path.exists(self.dist_dir):
@@ -113,11 +123,6 @@ class RpmBuilder(object):
                      'SPECS', 'RPMS', 'SRPMS'):
             os.mkdir('%s/%s' % (self.rpmbuild_path, item))
 
-    def copy_sources(self, file_path, file_name):
-        self.tarball = self.rpmbuild_path + '/SOURCES/' + file_name
-        os.system('cp %s %s' % (file_path, self.tarball))
-        #os.remove(file_path)
-
     def write_spec(self):
         content = [
             'Name: %s' % self.name,
@@ -156,11 +161,17 @@ class RpmBuilder(object):
         open(self.spec_path, 'w').write('\n'.join(content))
 
     def build_rpm(self):
-        os.system('rpmbuild -bb %s --define "_topdir %s"' % (self.spec_path,
-                                                             self.rpmbuild_path))
-        os.system('cp `find %s -name "*.rpm"` %s/' % (self.rpmbuild_path,
-                                                      self.dist_dir))
+        # tarball is read from dist/ instead of copy in SOURCES
+        run(['rpmbuild', '-bb', self.spec_path,
+             '--define', '_topdir %s' % self.rpmbuild_path,
+             '--define', '_sourcedir %s' % self.dist_dir])
+        rpms = []
+        for root, _dirs, files in os.walk(self.rpmbuild_path):
+            rpms += [os.path.join(root, item) for item in files
+                     if item.endswith('.rpm')]
+        if rpms:
+            run(['cp'] + rpms + [self.dist_dir + '/'])
 
     def clear_rpmbuild(self):
         if os.path.exists(self.rpmbuild_path):
-            os.system('rm -rf %s' % self.rpmbuild_path)
+            run(['rm', '-rf', self.rpmbuild_path])
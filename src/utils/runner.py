@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+#
+#   Subprocess runner
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#   Runs commands without shell and reports wall time, CPU time
+#   and peak RSS (from wait4 rusage where available):
+#       result = run(['rpmbuild', '-bb', spec], timeout=3600)
+#       run(['cp', src, dst], check=True)
+#       pipeline([['find', '.'], ['cpio', '-o'], ['gzip', '-c']],
+#                cwd=root, stdout=fileptr)
+#   Plain strings are executed by shell for legacy callers.
+
+import errno
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+HAS_WAIT4 = hasattr(os, 'wait4')
+
+
+class RunError(IOError):
+    """
+    Raised by checked runs. Keeps Result of failed command.
+    """
+
+    def __init__(self, result):
+        IOError.__init__(self, 'Command %s %s' % (
+            result.cmdline,
+            'timed out' if result.timed_out
+            else 'returned %s' % result.returncode))
+        self.result = result
+
+
+class Result(object):
+    """
+    Command execution result. max_rss is peak resident set size
+    of the process in KB (None if not available), it includes
+    forked interpreter memory before exec.
+    """
+
+    def __init__(self, argv):
+        self.argv = argv
+        self.returncode = None
+        self.output = None
+        self.wall = 0.0
+        self.user = None
+        self.sys = None
+        self.max_rss = None
+        self.timed_out = False
+
+    @property
+    def cmdline(self):
+        if isinstance(self.argv, basestring):
+            return self.argv
+        return ' '.join(self.argv)
+
+    @property
+    def cpu(self):
+        if self.user is None:
+            return None
+        return self.user + self.sys
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return '<Result %r code=%s wall=%.2fs cpu=%s rss=%s>' % (
+            self.cmdline, self.returncode, self.wall,
+            '%.2fs' % self.cpu if self.cpu is not None else '-',
+            '%dK' % self.max_rss if self.max_rss is not None else '-')
+
+
+def _wait(proc, result):
+    # Reaps process with wait4 to get its rusage
+    if not HAS_WAIT4:
+        result.returncode = proc.wait()
+        return
+    while True:
+        try:
+            _pid, status, usage = os.wait4(proc.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    result.returncode = proc.returncode
+    result.user = usage.ru_utime
+    result.sys = usage.ru_stime
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    result.max_rss = usage.ru_maxrss // 1024 \
+        if sys.platform == 'darwin' else usage.ru_maxrss
+
+
+def _kill(proc, result):
+    result.timed_out = True
+    try:
+        if os.name == 'posix':
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+                return
+            except OSError:
+                # not a process group leader
+                pass
+        proc.kill()
+    except OSError:
+        pass
+
+
+def _read(fileptr, chunks, tee):
+    for line in iter(fileptr.readline, ''):
+        if chunks is not None:
+            chunks.append(line)
+        if tee:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+    fileptr.close()
+
+
+def _popen_kwargs(timeout):
+    if os.name != 'posix':
+        return {}
+
+    def preexec():
+        # python ignores SIGPIPE, commands expect default handler
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+        if timeout:
+            # own process group to kill whole process tree on timeout
+            os.setsid()
+
+    # close_fds: concurrent children must not inherit capture pipes
+    # of each other, otherwise reader waits for unrelated child
+    return {'preexec_fn': preexec, 'close_fds': True}
+
+
+def run(argv, cwd=None, env=None, capture=False, tee=False, timeout=None,
+        check=False, stdin=None, stdout=None):
+    """
+    Runs command and returns Result.
+    capture - keep stdout and stderr in Result.output
+    tee - echo output while capturing (or instead of default output)
+    timeout - kill command after timeout seconds
+    check - raise RunError if command fails
+    stdin, stdout - optional file objects for command streams
+    """
+    result = Result(argv)
+    pipe = capture or tee
+    start = time.time()
+    try:
+        proc = subprocess.Popen(
+            argv, cwd=cwd, env=env, stdin=stdin,
+            stdout=subprocess.PIPE if pipe else stdout,
+            stderr=subprocess.STDOUT if pipe else None,
+            shell=isinstance(argv, basestring), **_popen_kwargs(timeout))
+    except OSError as e:
+        result.returncode = 127
+        result.output = str(e) if capture else None
+        if check:
+            raise RunError(result)
+        return result
+
+    chunks = [] if capture else None
+    reader = None
+    if pipe:
+        reader = threading.Thread(target=_read,
+                                  args=(proc.stdout, chunks, tee))
+        reader.daemon = True
+        reader.start()
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, _kill, (proc, result))
+        timer.daemon = True
+        timer.start()
+
+    _wait(proc, result)
+    if timer:
+        timer.cancel()
+        timer.join()
+    if reader:
+        reader.join()
+    result.wall = time.time() - start
+    if capture:
+        result.output = ''.join(chunks)
+    if check and not result.ok:
+        raise RunError(result)
+    return result
+
+
+def pipeline(argvs, cwd=None, env=None, stdout=None, timeout=None,
+             check=False):
+    """
+    Runs commands connected by pipes (like shell "a | b | c").
+    Returns list of Results.
+    """
+    results = [Result(argv) for argv in argvs]
+    procs = []
+    start = time.time()
+    kwargs = _popen_kwargs(timeout)
+    prev = None
+    try:
+        for index, argv in enumerate(argvs):
+            last = index == len(argvs) - 1
+            proc = subprocess.Popen(
+                argv, cwd=cwd, env=env,
+                stdin=prev.stdout if prev else None,
+                stdout=stdout if last else subprocess.PIPE, **kwargs)
+            if prev:
+                # let upstream command get SIGPIPE
+                prev.stdout.close()
+            procs.append(proc)
+            prev = proc
+    except OSError:
+        for proc in procs:
+            _kill(proc, Result(None))
+            proc.wait()
+        for result in results:
+            result.returncode = 127
+        if check:
+            raise RunError(results[len(procs)])
+        return results
+
+    timers = []
+    if timeout:
+        for proc, result in zip(procs, results):
+            timer = threading.Timer(timeout, _kill, (proc, result))
+            timer.daemon = True
+            timer.start()
+            timers.append(timer)
+    for proc, result in zip(procs, results):
+        _wait(proc, result)
+        result.wall = time.time() - start
+    for timer in timers:
+        timer.cancel()
+        timer.join()
+    if check:
+        for result in results:
+            if not result.ok:
+                raise RunError(result)
+    return results
+
+
+class Executor(object):
+    """
+    Runs many commands at once with at most jobs running
+    simultaneously:
+        executor = Executor(4)
+        for src in files:
+            executor.submit(['cp', src, dst])
+        results = executor.wait()
+    """
+
+    def __init__(self, jobs=None):
+        if not jobs:
+            import multiprocessing
+            jobs = multiprocessing.cpu_count()
+        self.jobs = jobs
+        self.semaphore = threading.BoundedSemaphore(jobs)
+        self.threads = []
+        self.results = []
+        self.errors = []
+
+    def _run(self, index, argv, kwargs):
+        try:
+            self.results[index] = run(argv, **kwargs)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.semaphore.release()
+
+    def submit(self, argv, **kwargs):
+        """
+        Schedules command, blocks while all job slots are busy.
+        Accepts run() keyword arguments.
+        """
+        self.semaphore.acquire()
+        self.results.append(None)
+        thread = threading.Thread(
+            target=self._run, args=(len(self.results) - 1, argv, kwargs))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def wait(self):
+        """
+        Waits for all submitted commands, returns Results in
+        submission order. Re-raises first error of checked runs.
+        """
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        results, self.results = self.results, []
+        errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+        return results
+
+
+def run_many(argvs, jobs=None, **kwargs):
+    """
+    Runs list of commands by Executor. Returns Results in order.
+    """
+    executor = Executor(jobs)
+    for argv in argvs:
+        executor.submit(argv, **kwargs)
+    return executor.wait()
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+#
+#   Virtual install tree staging
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#   Describes package install tree in memory instead of copying
+#   it into staging directory:
+#       manifest = Manifest()
+#       manifest.add_tree('build/lib.linux-x86_64-2.7',
+#                         '/usr/lib/python2.7/dist-packages')
+#       manifest.add_scripts(['src/script/sk1'])
+#       manifest.add_data('/usr/share/doc/sk1/copyright', text)
+#       write_tar(manifest, fileptr)
+#   Entries keep source path (or content), mode, owner and mtime,
+#   archive writers read sources directly. Default mtime is taken
+#   from SOURCE_DATE_EPOCH when set.
+
+import glob
+import gzip
+import io
+import os
+import posixpath
+import shutil
+import stat
+import tarfile
+import tempfile
+import time
+from cStringIO import StringIO
+
+from .runner import run
+
+FILE = 'file'
+DIR = 'dir'
+LINK = 'link'
+
+TYPE_BITS = {FILE: stat.S_IFREG, DIR: stat.S_IFDIR, LINK: stat.S_IFLNK}
+
+
+def get_epoch():
+    if os.environ.get('SOURCE_DATE_EPOCH'):
+        return int(os.environ['SOURCE_DATE_EPOCH'])
+    return int(time.time())
+
+
+def normalize(path):
+    """
+    Returns install path without leading and trailing slashes.
+    """
+    path = posixpath.normpath('/' + path.replace(os.sep, '/'))
+    return path.strip('/')
+
+
+class Entry(object):
+    """
+    Install tree item. Regular files have either source path
+    or data (file content), links have target.
+    """
+
+    __slots__ = ('path', 'kind', 'source', 'data', 'target',
+                 'mode', 'uid', 'gid', 'mtime', 'size')
+
+    def __init__(self, path, kind, mode, uid, gid, mtime,
+                 source=None, data=None, target=None, size=0):
+        self.path = path
+        self.kind = kind
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.source = source
+        self.data = data
+        self.target = target
+        self.size = size
+
+    @property
+    def st_mode(self):
+        return TYPE_BITS[self.kind] | self.mode
+
+    def __repr__(self):
+        return '<Entry %s %s %o>' % (self.kind, self.path, self.mode)
+
+
+class Manifest(object):
+    """
+    Install path -> Entry map. Parent directories are added
+    implicitly, later entries replace earlier ones. File modes
+    are normalized to 0644/0755 unless provided explicitly.
+    """
+
+    def __init__(self, uid=0, gid=0, mtime=None):
+        self.uid = uid
+        self.gid = gid
+        self.mtime = get_epoch() if mtime is None else mtime
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return normalize(path) in self.entries
+
+    def __iter__(self):
+        for path in sorted(self.entries):
+            yield self.entries[path]
+
+    def get(self, path):
+        return self.entries.get(normalize(path))
+
+    def files(self):
+        return [entry for entry in self if entry.kind != DIR]
+
+    @property
+    def size(self):
+        return sum(entry.size for entry in self.entries.values())
+
+    @property
+    def count(self):
+        return sum(1 for entry in self.entries.values()
+                   if entry.kind != DIR)
+
+    def _add(self, path, kind, mode, mtime, **kwargs):
+        path = normalize(path)
+        if not path:
+            raise IOError('Cannot stage install tree root')
+        parent = posixpath.dirname(path)
+        if parent and parent not in self.entries:
+            self.add_dir(parent)
+        entry = Entry(path, kind, mode, self.uid, self.gid,
+                      self.mtime if mtime is None else int(mtime), **kwargs)
+        self.entries[path] = entry
+        return entry
+
+    def add_dir(self, path, mode=0o755, mtime=None):
+        entry = self.entries.get(normalize(path))
+        if entry is not None and entry.kind == DIR:
+            return entry
+        return self._add(path, DIR, mode, mtime)
+
+    def add_file(self, path, source, mode=None, mtime=None):
+        """
+        Stages existing file at install path.
+        """
+        try:
+            st = os.stat(source)
+        except OSError:
+            raise IOError('Cannot stage %s: file not found' % source)
+        if mode is None:
+            mode = 0o755 if st.st_mode & 0o111 else 0o644
+        return self._add(path, FILE, mode, mtime, source=source,
+                         size=st.st_size)
+
+    def add_data(self, path, data, mode=0o644, mtime=None):
+        """
+        Stages file with provided content.
+        """
+        return self._add(path, FILE, mode, mtime, data=data, size=len(data))
+
+    def add_symlink(self, path, target, source=None, mtime=None):
+        return self._add(path, LINK, 0o777, mtime, target=target,
+                         source=source, size=len(target))
+
+    def add_tree(self, src, dst=''):
+        """
+        Stages content of src directory (or src file) under dst.
+        Symbolic links are kept as links.
+        """
+        if not os.path.isdir(src) or os.path.islink(src):
+            return self._add_item(src, posixpath.join(
+                dst, os.path.basename(src)))
+        if normalize(dst):
+            self.add_dir(dst)
+        for root, dirs, files in os.walk(src):
+            dirs.sort()
+            rel = os.path.relpath(root, src)
+            base = dst if rel == '.' else posixpath.join(
+                dst, rel.replace(os.sep, '/'))
+            for name in list(dirs):
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    dirs.remove(name)
+                    self._add_item(path, posixpath.join(base, name))
+                else:
+                    self.add_dir(posixpath.join(base, name))
+            for name in sorted(files):
+                self._add_item(os.path.join(root, name),
+                               posixpath.join(base, name))
+
+    def _add_item(self, source, path):
+        if os.path.islink(source):
+            return self.add_symlink(path, os.readlink(source), source)
+        return self.add_file(path, source)
+
+    def add_package_dirs(self, package_dirs, dst):
+        """
+        Stages python packages ({package: source dir}) under dst
+        (e.g. site-packages path).
+        """
+        for package, path in package_dirs.items():
+            self.add_tree(path, posixpath.join(dst, *package.split('.')))
+
+    def add_package_data(self, package_data, package_dirs, dst):
+        """
+        Stages package_data globs of setup script under dst.
+        """
+        for package, patterns in package_data.items():
+            pkg_dir = package_dirs[package]
+            target = posixpath.join(dst, *package.split('.'))
+            for pattern in patterns:
+                for path in sorted(glob.glob(os.path.join(pkg_dir, pattern))):
+                    if os.path.isfile(path):
+                        rel = os.path.relpath(path, pkg_dir)
+                        self.add_file(posixpath.join(
+                            target, rel.replace(os.sep, '/')), path)
+
+    def add_scripts(self, scripts, dst='/usr/bin'):
+        for path in scripts:
+            self.add_file(posixpath.join(dst, os.path.basename(path)),
+                          path, mode=0o755)
+
+    def add_data_files(self, data_files):
+        """
+        Stages data_files list ([(install dir, [files])]) of setup script.
+        """
+        for path, files in data_files:
+            self.add_dir(path)
+            for item in files:
+                self.add_file(posixpath.join(path, os.path.basename(item)),
+                              item)
+
+    def open(self, entry):
+        if entry.data is not None:
+            return io.BytesIO(entry.data)
+        return open(entry.source, 'rb')
+
+    def extract(self, dest):
+        """
+        Materializes install tree in dest directory, for consumers
+        requiring real filesystem.
+        """
+        for entry in self:
+            path = os.path.join(dest, *entry.path.split('/'))
+            if entry.kind == DIR:
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            elif entry.kind == LINK:
+                os.symlink(entry.target, path)
+            else:
+                with self.open(entry) as src, open(path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                os.chmod(path, entry.mode)
+
+
+# --- Archive writers
+
+def _gzip(fileptr, mtime):
+    return gzip.GzipFile(filename='', mode='wb', fileobj=fileptr,
+                         mtime=mtime)
+
+
+def write_tar(manifest, fileptr, compress=True):
+    """
+    Writes manifest as (gzipped) tar with ./ relative names.
+    """
+    stream = _gzip(fileptr, manifest.mtime) if compress else fileptr
+    tar = tarfile.open(fileobj=stream, mode='w', format=tarfile.GNU_FORMAT)
+    root = Entry('', DIR, 0o755, manifest.uid, manifest.gid, manifest.mtime)
+    for entry in [root] + list(manifest):
+        info = tarfile.TarInfo('./' + entry.path)
+        info.mode = entry.mode
+        info.mtime = entry.mtime
+        info.uid, info.gid = entry.uid, entry.gid
+        info.uname = 'root' if entry.uid == 0 else ''
+        info.gname = 'root' if entry.gid == 0 else ''
+        if entry.kind == DIR:
+            info.type = tarfile.DIRTYPE
+            info.name = info.name.rstrip('/') + '/'
+            tar.addfile(info)
+        elif entry.kind == LINK:
+            info.type = tarfile.SYMTYPE
+            info.linkname = entry.target
+            tar.addfile(info)
+        else:
+            info.size = entry.size
+            with manifest.open(entry) as src:
+                tar.addfile(info, src)
+    tar.close()
+    if compress:
+        stream.close()
+
+
+def _cpio_header(name, mode, uid, gid, nlink, mtime, size, ino):
+    return '070707%06o%06o%06o%06o%06o%06o%06o%011o%06o%011o%s\0' % (
+        0, ino & 0o777777, mode, uid, gid, nlink, 0, mtime,
+        len(name) + 1, size, name)
+
+
+def write_cpio(manifest, fileptr, compress=True):
+    """
+    Writes manifest as (gzipped) odc cpio archive, the same as
+    "find . | cpio -o --format odc" does in tree root.
+    """
+    stream = _gzip(fileptr, manifest.mtime) if compress else fileptr
+    stream.write(_cpio_header('.', stat.S_IFDIR | 0o755, manifest.uid,
+                              manifest.gid, 2, manifest.mtime, 0, 1))
+    for ino, entry in enumerate(manifest, 2):
+        name = './' + entry.path
+        nlink = 2 if entry.kind == DIR else 1
+        size = 0 if entry.kind == DIR else entry.size
+        stream.write(_cpio_header(name, entry.st_mode, entry.uid, entry.gid,
+                                  nlink, entry.mtime, size, ino))
+        if entry.kind == LINK:
+            stream.write(entry.target)
+        elif entry.kind == FILE:
+            with manifest.open(entry) as src:
+                shutil.copyfileobj(src, stream, 1 << 20)
+    stream.write(_cpio_header('TRAILER!!!', 0, 0, 0, 1, 0, 0, 0))
+    if compress:
+        stream.close()
+
+
+def _ar_member(fileptr, name, src, size, mtime):
+    fileptr.write('%-16s%-12d%-6d%-6d%-8o%-10d`\n' % (
+        name, mtime, 0, 0, 0o100644, size))
+    shutil.copyfileobj(src, fileptr, 1 << 20)
+    if size % 2:
+        fileptr.write('\n')
+
+
+def write_deb(filename, control, data):
+    """
+    Writes deb package (ar archive of debian-binary, control.tar.gz
+    and data.tar.gz) from control and data manifests.
+    """
+    control_tar = StringIO()
+    write_tar(control, control_tar)
+    with tempfile.TemporaryFile() as data_tar:
+        write_tar(data, data_tar)
+        size = data_tar.tell()
+        data_tar.seek(0)
+        with open(filename, 'wb') as fileptr:
+            fileptr.write('!<arch>\n')
+            _ar_member(fileptr, 'debian-binary', StringIO('2.0\n'), 4,
+                       data.mtime)
+            _ar_member(fileptr, 'control.tar.gz',
+                       StringIO(control_tar.getvalue()),
+                       len(control_tar.getvalue()), data.mtime)
+            _ar_member(fileptr, 'data.tar.gz', data_tar, size, data.mtime)
+
+
+def _crc_table():
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for _i in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xffffffff)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def cksum(data):
+    """
+    Returns POSIX cksum CRC of string.
+    """
+    crc = 0
+    for char in data:
+        crc = ((crc << 8) & 0xffffffff) ^ CRC_TABLE[(crc >> 24) ^ ord(char)]
+    length = len(data)
+    while length:
+        crc = ((crc << 8) & 0xffffffff) ^ \
+              CRC_TABLE[(crc >> 24) ^ (length & 0xff)]
+        length >>= 8
+    return ~crc & 0xffffffff
+
+
+def _file_cksums(paths, chunk=256):
+    # cksum tool is much faster than pure python CRC on large files
+    result = {}
+    for index in range(0, len(paths), chunk):
+        items = paths[index:index + chunk]
+        output = run(['cksum'] + items, capture=True, check=True).output
+        for item, line in zip(items, output.splitlines()):
+            result[item] = int(line.split()[0])
+    return result
+
+
+def write_bom_list(manifest, fileptr):
+    """
+    Writes manifest in lsbom format for "mkbom -i".
+    """
+    sources = sorted(set(entry.source for entry in manifest
+                         if entry.kind == FILE and entry.data is None))
+    sums = _file_cksums(sources) if sources else {}
+    fileptr.write('.\t%o\t%d/%d\n' % (stat.S_IFDIR | 0o755,
+                                      manifest.uid, manifest.gid))
+    for entry in manifest:
+        line = './%s\t%o\t%d/%d' % (entry.path, entry.st_mode,
+                                    entry.uid, entry.gid)
+        if entry.kind == FILE:
+            crc = cksum(entry.data) if entry.data is not None \
+                else sums[entry.source]
+            line += '\t%d\t%d' % (entry.size, crc)
+        elif entry.kind == LINK:
+            line += '\t%d\t%d\t%s' % (entry.size, cksum(entry.target),
+                                      entry.target)
+        fileptr.write(line + '\n')
+
+
+def _graft_escape(path):
+    return path.replace('\\', '\\\\').replace('=', '\\=')
+
+
+def write_graft_points(manifest, fileptr, tmp_dir):
+    """
+    Writes graft points list for "genisoimage -graft-points -path-list".
+    Directories are grafted from empty tmp_dir, staged content
+    is saved into tmp_dir.
+    """
+    empty = os.path.join(tmp_dir, 'empty')
+    if not os.path.isdir(empty):
+        os.makedirs(empty)
+    for index, entry in enumerate(manifest):
+        if entry.kind == DIR:
+            source = empty
+        elif entry.source is not None:
+            source = entry.source
+        else:
+            source = os.path.join(tmp_dir, 'data%d' % index)
+            with open(source, 'wb') as data_file:
+                data_file.write(entry.data)
+            os.chmod(source, entry.mode)
+        fileptr.write('%s%s=%s\n' % (_graft_escape(entry.path),
+                                     '/' if entry.kind == DIR else '',
+                                     _graft_escape(source)))
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+#   Build stage tracing
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#   Records nested build stages:
+#       with span('deb:stage_build') as stage:
+#           ...
+#           stage.add(files=10, bytes=4096)
+#
+#       @traced('dmg:build')
+#       def dmg_build(...):
+#
+#   Spans are exported as Chrome trace-event JSON (chrome://tracing,
+#   Perfetto) and as plain summary table. If BUILD_TRACE environment
+#   variable is set, trace is written to that file on exit.
+#   Stages can be profiled as well, see profiling.py.
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+TRACE_ENV = 'BUILD_TRACE'
+
+# profiling.Profiler instance if stage profiling is enabled
+PROFILER = None
+
+
+class Span(object):
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+        self.duration = 0.0
+        self.depth = 0
+        self.profiler = None
+        self.profile = None
+
+    def add(self, **counters):
+        """
+        Accumulates span counters like bytes=, files=.
+        """
+        for key, value in counters.items():
+            self.args[key] = self.args.get(key, 0) + value
+
+    def __enter__(self):
+        stack = self.tracer.get_stack()
+        self.depth = len(stack)
+        stack.append(self)
+        if PROFILER is not None:
+            self.profiler = PROFILER
+            self.profile = PROFILER.start(self.name)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.duration = time.time() - self.start
+        if self.profile is not None:
+            self.profiler.stop(self.name, self.profile)
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.get_stack().pop()
+        self.tracer.record(self)
+
+
+class Tracer(object):
+    """
+    Collects finished spans as Chrome trace complete ('X') events.
+    Timestamps are wall clock microseconds, so traces of different
+    hosts can be merged into one timeline.
+    """
+
+    def __init__(self, process_name=''):
+        self.process_name = process_name
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def record(self, span):
+        event = {
+            'name': span.name,
+            'ph': 'X',
+            'ts': int(span.start * 1e6),
+            'dur': int(span.duration * 1e6),
+            'pid': self.pid,
+            'tid': threading.current_thread().ident % 100000,
+            'args': dict(span.args, depth=span.depth),
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def clear(self):
+        with self.lock:
+            self.events = []
+
+    def to_chrome(self):
+        events = list(self.events)
+        if self.process_name:
+            events.insert(0, {'name': 'process_name', 'ph': 'M',
+                              'pid': self.pid,
+                              'args': {'name': self.process_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome(self, path):
+        with open(path, 'wb') as fileptr:
+            json.dump(self.to_chrome(), fileptr)
+
+    def summary(self):
+        return format_summary(self.events)
+
+
+TRACER = Tracer()
+
+
+def span(name, **args):
+    """
+    Context manager recording build stage in global tracer.
+    """
+    return TRACER.span(name, **args)
+
+
+def traced(name=None):
+    """
+    Decorator recording function call as build stage.
+    """
+
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def load_trace(path):
+    with open(path, 'rb') as fileptr:
+        return json.load(fileptr)
+
+
+def merge_traces(traces):
+    """
+    Merges Chrome traces into single timeline.
+    traces - list of (process label, trace dict) pairs, every
+    trace gets own process row labeled accordingly.
+    """
+    events = []
+    for pid, (label, trace) in enumerate(traces, 1):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': label}})
+        for event in trace.get('traceEvents', []):
+            if event.get('ph') == 'M':
+                continue
+            event = dict(event)
+            event['pid'] = pid
+            events.append(event)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def format_summary(events):
+    """
+    Returns plain table of stages: calls, total and max duration,
+    processed bytes and files.
+    """
+    stats = {}
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        item = stats.setdefault(event['name'], [0, 0, 0, 0, 0])
+        args = event.get('args', {})
+        item[0] += 1
+        item[1] += event['dur']
+        item[2] = max(item[2], event['dur'])
+        item[3] += args.get('bytes', 0)
+        item[4] += args.get('files', 0)
+    width = max([len(name) for name in stats] + [5])
+    lines = ['%-*s %6s %10s %10s %12s %8s' % (
+        width, 'Stage', 'Calls', 'Total, s', 'Max, s', 'Bytes', 'Files')]
+    lines.append('-' * len(lines[0]))
+    for name, item in sorted(stats.items(), key=lambda x: -x[1][1]):
+        lines.append('%-*s %6d %10.2f %10.2f %12d %8d' % (
+            width, name, item[0], item[1] / 1e6, item[2] / 1e6,
+            item[3], item[4]))
+    return '\n'.join(lines)
+
+
+def _write_on_exit():
+    path = os.environ.get(TRACE_ENV)
+    if path and TRACER.events:
+        TRACER.write_chrome(path)
+
+
+atexit.register(_write_on_exit)
+
+if os.environ.get('BUILD_PROFILE'):
+    from .profiling import get_env_profiler
+
+    PROFILER = get_env_profiler()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+#   Source tree discovery tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import build
+
+TREE = (
+    'a/__init__.py', 'a/mod.py', 'a/data.txt', 'a/res/icons/x.png',
+    'a/b/__init__.py', 'a/b/c/__init__.py', 'a/b/c/ui.xml',
+    'aa/__init__.py', 'z/__init__.py', 'z/y/__init__.py',
+    'notpkg/x.py', 'notpkg/inner/__init__.py',
+    '.hidden/__init__.py', 'a/.svn/__init__.py', 'setup.py',
+)
+
+
+# Directory walking implementations replaced by discover()
+
+def old_get_packages(path):
+    packages = []
+    items = []
+    if os.path.isdir(path):
+        try:
+            items = os.listdir(path)
+        except os.error:
+            pass
+        for item in items:
+            if item.startswith('.'):
+                continue
+            folder = os.path.join(path, item)
+            if build.is_package(folder):
+                packages.append(folder)
+                packages += old_get_packages(folder)
+    packages.sort()
+    return packages
+
+
+def old_get_package_dirs(path='src', excludes=None):
+    if excludes is None:
+        excludes = []
+    dirs = {}
+    items = []
+    if os.path.isdir(path):
+        try:
+            items = os.listdir(path)
+        except os.error:
+            pass
+        for item in items:
+            if item in excludes:
+                continue
+            if item == '.svn':
+                continue
+            folder = os.path.join(path, item)
+            if build.is_package(folder):
+                dirs[item] = folder
+    return dirs
+
+
+def old_get_source_structure(path='src', excludes=None):
+    if excludes is None:
+        excludes = []
+    pkgs = []
+    for item in old_get_packages(path):
+        res = item.replace('\\', '.').replace('/', '.').split('src.')[1]
+        check = True
+        for exclude in excludes:
+            if len(res) >= len(exclude) and res[:len(exclude)] == exclude:
+                check = False
+                break
+        if check:
+            pkgs.append(res)
+    return pkgs
+
+
+class DiscoverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_dir, 'src')
+        for item in TREE:
+            path = os.path.join(self.src, *item.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+
+    def test_get_packages(self):
+        self.assertEqual(build.get_packages(self.src),
+                         old_get_packages(self.src))
+
+    def test_get_package_dirs(self):
+        for excludes in (None, ['z'], ['a', 'aa']):
+            expected = old_get_package_dirs(self.src, excludes)
+            # old walker took hidden packages except .svn
+            expected.pop('.hidden')
+            self.assertEqual(build.get_package_dirs(self.src, excludes),
+                             expected, excludes)
+
+    def test_get_source_structure(self):
+        for excludes in (None, ['a.b'], ['a', 'z.y'], ['a.b.c', 'aa']):
+            self.assertEqual(build.get_source_structure(self.src, excludes),
+                             old_get_source_structure(self.src, excludes),
+                             excludes)
+
+    def test_resources(self):
+        tree = build.discover(self.src)
+        self.assertEqual(tree.packages,
+                         ['a', 'a.b', 'a.b.c', 'aa', 'z', 'z.y'])
+        self.assertEqual(sorted(tree.resources['a']),
+                         ['data.txt', os.path.join('res', 'icons', 'x.png')])
+        self.assertEqual(tree.resources['a.b.c'], ['ui.xml'])
+        self.assertEqual(tree.resources['z'], [])
+
+    def test_prefix_trie(self):
+        trie = build.PrefixTrie(['a.b', 'z'])
+        self.assertTrue(trie.match('a.b'))
+        self.assertTrue(trie.match('a.bc'))
+        self.assertTrue(trie.match('z.y'))
+        self.assertFalse(trie.match('a'))
+        self.assertFalse(trie.match('aa'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+#   Debian package builder tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.deb import DebBuilder
+
+
+@unittest.skipUnless(find_executable('dpkg-deb'), 'dpkg-deb is not installed')
+class DebBuilderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        os.makedirs('custom/app')
+        with open('custom/app/__init__.py', 'wb') as fileptr:
+            fileptr.write('VERSION = 1\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tmp_dir, True)
+
+    def build(self, **kwargs):
+        return DebBuilder(name='app', version='1.0', arch='all',
+                          maintainer='Test <test@localhost>',
+                          description='test package',
+                          dst='/usr/lib/python2.7/dist-packages',
+                          package_name='app.deb', **kwargs)
+
+    def test_build_dir(self):
+        self.assertFalse(self.build(build_dir='custom').status)
+        listing = subprocess.check_output(['dpkg-deb', '-c', 'dist/app.deb'])
+        self.assertIn('./usr/lib/python2.7/dist-packages/app/__init__.py',
+                      listing)
+        field = subprocess.check_output(
+            ['dpkg-deb', '-f', 'dist/app.deb', 'Package'])
+        self.assertEqual(field.strip(), 'python-app')
+
+    def test_missing_build_dir(self):
+        self.assertTrue(self.build(build_dir='missing').status)
+        self.assertFalse(os.path.exists('dist/app.deb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
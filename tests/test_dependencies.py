@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+#   Dependency matrix tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import dependencies as deps
+from utils.dist import SystemFacts
+
+DEB_BASE = 'liblcms2-2 (>=2.0), python (>=2.7), python (<<3.0), ' \
+           'python-cairo, '
+
+# (family, version) -> (uc2 deps, sk1 deps, sk1 pip deps)
+RESOLVED = {
+    ('debian', '9.13'): (
+        DEB_BASE + 'libmagickwand-6.q16-3, python-pil, python-reportlab',
+        DEB_BASE + 'libmagickwand-6.q16-3, python-pil, python-reportlab, '
+                   'python-wxgtk3.0, python-cups',
+        ()),
+    ('Ubuntu', '20.04'): (
+        DEB_BASE + 'libmagickwand-6.q16-6, python-pil',
+        DEB_BASE + 'libmagickwand-6.q16-6, python-pil, python-wxgtk3.0, '
+                   'libcups2',
+        ('reportlab-3.5.53.tar.gz', 'pycups-1.9.74.tar.gz')),
+    ('fedora', '30'): (
+        'lcms2 pango ImageMagick python2-cairo python2-pillow '
+        'python2-reportlab',
+        'lcms2 pango ImageMagick python2-cairo python2-pillow '
+        'python2-reportlab python2-wxpython python-cups',
+        ()),
+    ('SuSE', '15.1'): (
+        'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo python-Pillow '
+        'python-reportlab',
+        'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo python-Pillow '
+        'python-reportlab python-wxWidgets python-cups',
+        ()),
+    ('SuSE', '42.3'): (
+        'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo python-Pillow '
+        'python-reportlab',
+        'liblcms2-2 libpango-1_0-0 ImageMagick python-cairo python-Pillow '
+        'python-reportlab python-wxWidgets python-cups',
+        ()),
+    ('centos', '6.10'): (
+        'lcms2 pango ImageMagick pycairo python-pillow python-reportlab',
+        'lcms2 pango ImageMagick pycairo python-pillow python-reportlab',
+        ()),
+}
+
+
+class DependenciesTestCase(unittest.TestCase):
+
+    def test_resolved(self):
+        for (family, version), expected in RESOLVED.items():
+            facts = SystemFacts(family=family, version=version, arch='64bit')
+            kind = deps.DEB if facts.is_deb else deps.RPM
+            resolved = (deps.get_depend_string(kind, deps.UC2, facts),
+                        deps.get_depend_string(kind, deps.SK1, facts),
+                        deps.get_depends(deps.PIP, deps.SK1, facts))
+            self.assertEqual(resolved, expected, facts.sid)
+
+    def test_unknown_target(self):
+        facts = SystemFacts(family='fedora', version='99', arch='64bit')
+        self.assertEqual(deps.get_depends(deps.RPM, deps.UC2, facts), ())
+
+    def test_all_targets_resolved(self):
+        for kind in (deps.DEB, deps.RPM):
+            for target in deps.MATRICES[kind]:
+                self.assertTrue(deps.DEPENDENCIES[kind][(target, deps.UC2)],
+                                target)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+#   System facts tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import dist
+
+
+class SystemFactsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.etc_dir = tempfile.mkdtemp()
+        self.os_release = os.path.join(self.etc_dir, 'os-release')
+
+    def tearDown(self):
+        shutil.rmtree(self.etc_dir, True)
+
+    def write(self, name, content):
+        with open(os.path.join(self.etc_dir, name), 'wb') as fileptr:
+            fileptr.write(content)
+
+    def test_os_release(self):
+        self.write('os-release', 'NAME="openSUSE Leap"\nID="opensuse-leap"\n'
+                                 'ID_LIKE="suse opensuse"\n'
+                                 'VERSION_ID="15.1"\n')
+        self.write('redhat-release', 'CentOS release 6.10 (Final)\n')
+        facts = dist.SystemFacts(self.os_release)
+        self.assertEqual(facts.family, dist.OPENSUSE)
+        self.assertEqual(facts.sid, 'SuSE 15')
+
+    def test_redhat_release(self):
+        self.write('redhat-release', 'CentOS release 6.10 (Final)\n')
+        facts = dist.SystemFacts(self.os_release)
+        self.assertEqual(facts.sid, dist.CENTOS6)
+        self.assertTrue(facts.is_rpm)
+        self.assertEqual(facts.marker, 'el')
+
+    def test_lsb_release(self):
+        self.write('lsb-release', 'DISTRIB_ID=Ubuntu\nDISTRIB_RELEASE=12.04\n'
+                                  'DISTRIB_CODENAME=precise\n')
+        facts = dist.SystemFacts(self.os_release)
+        self.assertEqual(facts.sid, dist.UBUNTU12)
+        self.assertTrue(facts.is_deb)
+
+    def test_unknown(self):
+        facts = dist.SystemFacts(self.os_release)
+        self.assertEqual(facts.family, '')
+        self.assertEqual(facts.marker, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+#   Build farm work queue tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'infra',
+                                'build-farm'))
+
+import farmutils
+from farmutils import WorkQueue
+
+TARGETS = ['Debian_9_64bit', 'Fedora_30_64bit']
+
+
+class WorkQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+    def expire(self, queue, job):
+        # lease time is over
+        job['expires'] = 0
+        queue.expire()
+
+    def test_claim(self):
+        queue = WorkQueue({'project': 'sk1'}, TARGETS)
+        self.assertIsNone(queue.claim('agent1', []))
+        self.assertIsNone(queue.claim('agent1', ['Ubuntu_20.04_64bit']))
+        job = queue.claim('agent1', TARGETS[1:])
+        self.assertEqual(job['target'], TARGETS[1])
+        self.assertEqual(job['dataset'],
+                         {'project': 'sk1', 'target': TARGETS[1]})
+        self.assertIsNone(queue.claim('agent2', TARGETS[1:]))
+        self.assertEqual(queue.claim('agent2', TARGETS)['target'], TARGETS[0])
+
+    def test_report(self):
+        queue = WorkQueue({}, TARGETS[:1])
+        job = queue.claim('agent1', TARGETS)
+        self.assertFalse(queue.report(job['id'], 'agent2', 0))
+        self.assertTrue(queue.heartbeat(job['id'], 'agent1'))
+        self.assertTrue(queue.report(job['id'], 'agent1', 0, ['a.deb']))
+        self.assertTrue(queue.finished.is_set())
+        self.assertEqual(queue.status()[0]['artifacts'], ['a.deb'])
+        self.assertFalse(queue.heartbeat(job['id'], 'agent1'))
+
+    def test_lease_expiry(self):
+        queue = WorkQueue({}, TARGETS[:1])
+        job = queue.claim('agent1', TARGETS)
+        self.expire(queue, job)
+        self.assertEqual(job['state'], WorkQueue.PENDING)
+        self.assertFalse(queue.heartbeat(job['id'], 'agent1'))
+        self.assertFalse(queue.report(job['id'], 'agent1', 0))
+        self.assertIs(queue.claim('agent2', TARGETS), job)
+        self.assertEqual(job['agent'], 'agent2')
+        self.assertEqual(job['attempts'], 2)
+        self.assertFalse(queue.finished.is_set())
+
+    def test_heartbeat_extends_lease(self):
+        queue = WorkQueue({}, TARGETS[:1], lease=60)
+        job = queue.claim('agent1', TARGETS)
+        job['expires'] = 0
+        self.assertTrue(queue.heartbeat(job['id'], 'agent1'))
+        queue.expire()
+        self.assertEqual(job['state'], WorkQueue.LEASED)
+
+    def test_max_attempts(self):
+        self.assertEqual(WorkQueue({}, []).attempts, farmutils.MAX_ATTEMPTS)
+        queue = WorkQueue({}, TARGETS[:1], attempts=2)
+        for agent in ('agent1', 'agent2'):
+            job = queue.claim(agent, TARGETS)
+            self.assertIsNotNone(job)
+            self.expire(queue, job)
+        self.assertEqual(job['state'], WorkQueue.DONE)
+        self.assertEqual(job['status'], 1)
+        self.assertEqual(job['attempts'], 2)
+        self.assertIsNone(queue.claim('agent3', TARGETS))
+        self.assertTrue(queue.finished.is_set())
+
+    def test_no_targets(self):
+        self.assertTrue(WorkQueue({}, []).finished.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
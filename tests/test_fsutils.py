@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+#   File placement tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import errno
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import fsutils
+
+
+def no_reflink(src, dst):
+    # filesystem without copy-on-write support, dst is already created
+    open(dst, 'wb').close()
+    raise IOError(errno.EOPNOTSUPP, 'Operation not supported')
+
+
+def no_link(src, dst):
+    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+
+class PlaceFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = self.path('src.sh')
+        self.dst = self.path('dst.sh')
+        self.write(self.src, '#!/bin/sh\necho src\n')
+        os.chmod(self.src, 0o755)
+        self.patched = []
+
+    def tearDown(self):
+        for module, name, value in self.patched:
+            setattr(module, name, value)
+        shutil.rmtree(self.tmp_dir, True)
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def write(self, path, data):
+        with open(path, 'wb') as fileptr:
+            fileptr.write(data)
+
+    def read(self, path):
+        with open(path, 'rb') as fileptr:
+            return fileptr.read()
+
+    def patch(self, module, name, value):
+        self.patched.append((module, name, getattr(module, name)))
+        setattr(module, name, value)
+
+    def test_unchanged(self):
+        shutil.copy2(self.src, self.dst)
+        before = os.stat(self.dst)
+        self.assertIsNone(fsutils.place_file(self.src, self.dst))
+        after = os.stat(self.dst)
+        self.assertEqual((before.st_ino, before.st_mtime),
+                         (after.st_ino, after.st_mtime))
+        os.link(self.src, self.path('linked.sh'))
+        self.assertIsNone(fsutils.place_file(self.src, self.path('linked.sh')))
+
+    def test_changed(self):
+        self.write(self.dst, '#!/bin/sh\necho dst\n')
+        self.assertIn(fsutils.place_file(self.src, self.dst),
+                      ('reflink', 'hardlink', 'copy'))
+        self.assertEqual(self.read(self.dst), self.read(self.src))
+        self.assertFalse(fsutils.is_same_file(self.src, self.path('missing')))
+
+    def test_hardlink_fallback(self):
+        self.patch(fsutils, 'reflink', no_reflink)
+        self.write(self.dst, 'old')
+        self.assertEqual(fsutils.place_file(self.src, self.dst), 'hardlink')
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+
+    def test_copy_fallback(self):
+        self.patch(fsutils, 'reflink', no_reflink)
+        self.patch(os, 'link', no_link)
+        self.assertEqual(fsutils.place_file(self.src, self.dst), 'copy')
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+        self.assertEqual(self.read(self.dst), self.read(self.src))
+        self.assertEqual(stat.S_IMODE(os.stat(self.dst).st_mode), 0o755)
+
+
+if __name__ == '__main__':
+    unittest.main()
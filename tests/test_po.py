@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+#   PO compiler tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gettext
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import po
+
+CATALOG = r'''# Test catalog
+msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\n"
+"Plural-Forms: nplurals=2; plural=(n != 1);\n"
+
+#: app.py:1
+msgid "Open"
+msgstr "Открыть"
+
+#, fuzzy
+msgid "Close"
+msgstr "Закрыть"
+
+#, fuzzy
+#~ msgid "Obsolete"
+#~ msgstr "Устаревшее"
+
+msgid "Save"
+msgstr "Сохранить"
+
+msgid "Untranslated"
+msgstr ""
+
+msgctxt "menu"
+msgid "Open"
+msgstr "Открыть файл"
+
+msgid "%d file"
+msgid_plural "%d files"
+msgstr[0] "%d файл"
+msgstr[1] "%d файлов"
+
+#, python-format
+msgid ""
+"Multi\n"
+"line \"quoted\"\t"
+msgstr ""
+"Много\n"
+"строк \"в кавычках\"\t"
+'''
+
+
+class CompilePoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.po_file = os.path.join(self.tmp_dir, 'ru.po')
+        with open(self.po_file, 'wb') as fileptr:
+            fileptr.write(CATALOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+
+    def compile(self, use_fuzzy=False):
+        mo_file = os.path.join(self.tmp_dir, 'ru.mo')
+        po.compile_po(self.po_file, mo_file, use_fuzzy)
+        return mo_file
+
+    def test_messages(self):
+        with open(self.compile(), 'rb') as fileptr:
+            trans = gettext.GNUTranslations(fileptr)
+        self.assertEqual(trans.gettext('Open'), 'Открыть')
+        self.assertEqual(trans.gettext('Save'), 'Сохранить')
+        self.assertEqual(trans.gettext('Close'), 'Close')
+        self.assertEqual(trans.gettext('Obsolete'), 'Obsolete')
+        self.assertEqual(trans.gettext('Untranslated'), 'Untranslated')
+        self.assertEqual(trans.ngettext('%d file', '%d files', 5),
+                         '%d файлов')
+        self.assertEqual(trans.gettext('Multi\nline "quoted"\t'),
+                         'Много\nстрок "в кавычках"\t')
+
+    def test_fuzzy_of_obsolete_entry(self):
+        keys = [(ctxt, msgid) for ctxt, msgid, _plural, _strs
+                in po.parse_po(self.po_file)]
+        self.assertIn((None, 'Save'), keys)
+        self.assertNotIn((None, 'Close'), keys)
+        self.assertNotIn((None, 'Obsolete'), keys)
+        self.assertIn(('menu', 'Open'), keys)
+
+    def test_use_fuzzy(self):
+        keys = [msgid for _ctxt, msgid, _plural, _strs
+                in po.parse_po(self.po_file, use_fuzzy=True)]
+        self.assertIn('Close', keys)
+        self.assertNotIn('Obsolete', keys)
+
+    @unittest.skipUnless(find_executable('msgfmt'),
+                         'msgfmt is not installed')
+    def test_same_as_msgfmt(self):
+        expected = os.path.join(self.tmp_dir, 'msgfmt.mo')
+        subprocess.check_call(['msgfmt', '-o', expected, self.po_file])
+        with open(expected, 'rb') as fileptr:
+            expected = fileptr.read()
+        with open(self.compile(), 'rb') as fileptr:
+            self.assertEqual(fileptr.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+#   Repository index tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import subprocess
+import sys
+import unittest
+from distutils.spawn import find_executable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import repoindex
+
+# (ver1, ver2, sign of comparison)
+DEB_CASES = (
+    ('1.0', '1.0', 0),
+    ('0:1.0', '1.0', 0),
+    ('1.0~rc1', '1.0', -1),
+    ('1.0~~', '1.0~', -1),
+    ('1.0~rc1', '1.0~rc2', -1),
+    ('1.0', '1.0+b1', -1),
+    ('1.0', '1.0.', -1),
+    ('1.0a', '1.0', 1),
+    ('1.0a', '1.0+', -1),
+    ('1.2.3a', '1.2.3b', -1),
+    ('2.10', '2.9', 1),
+    ('1:0.9', '2.0', 1),
+    ('1.0-2', '1.0-10', -1),
+    ('1.0-1', '1.0-1~bpo9+1', 1),
+    ('2.0-1ubuntu1', '2.0-1', 1),
+)
+
+RPM_CASES = (
+    ('1.0', '1.0', 0),
+    ('001', '1', 0),
+    ('1.0~rc1', '1.0', -1),
+    ('1.0~rc1', '1.0~rc2', -1),
+    ('1.0^git1', '1.0', 1),
+    ('1.0^git1', '1.0.1', -1),
+    ('1.0a', '1.0', 1),
+    ('1.0', '1.0.a', -1),
+    ('1a', '1.1', -1),
+    ('1.0_1', '1.0.1', 0),
+    ('10', '9', 1),
+    ('2:1.0', '3.0', 1),
+    ('1.0', '1.0-5', 0),
+    ('1.0-1.el6', '1.0-1.el7', -1),
+    ('1.0-10', '1.0-9', 1),
+)
+
+
+def sign(value):
+    return (value > 0) - (value < 0)
+
+
+class VersionCompareTestCase(unittest.TestCase):
+
+    def check(self, compare, cases):
+        for ver1, ver2, expected in cases:
+            self.assertEqual(sign(compare(ver1, ver2)), expected,
+                             '%s vs %s' % (ver1, ver2))
+            self.assertEqual(sign(compare(ver2, ver1)), -expected,
+                             '%s vs %s' % (ver2, ver1))
+
+    def test_deb(self):
+        self.check(repoindex.compare_deb_versions, DEB_CASES)
+
+    def test_rpm(self):
+        self.check(repoindex.compare_rpm_versions, RPM_CASES)
+
+    @unittest.skipUnless(find_executable('dpkg'), 'dpkg is not installed')
+    def test_same_as_dpkg(self):
+        for ver1, ver2, _expected in DEB_CASES:
+            for op, res in (('lt', -1), ('eq', 0), ('gt', 1)):
+                status = subprocess.call(
+                    ['dpkg', '--compare-versions', ver1, op, ver2])
+                if not status:
+                    break
+            self.assertEqual(
+                sign(repoindex.compare_deb_versions(ver1, ver2)), res,
+                '%s vs %s' % (ver1, ver2))
+
+
+class PackageIndexTestCase(unittest.TestCase):
+
+    def test_satisfies(self):
+        index = repoindex.PackageIndex(repoindex.DEB)
+        index.add('python', '2.7.16-1', [('python-any', '2.7.16-1')])
+        index.add('python-cairo', '1.16.2-1+b1')
+        self.assertTrue(index.satisfies('python', '>=', '2.7'))
+        self.assertFalse(index.satisfies('python', '<<', '2.7~'))
+        self.assertTrue(index.satisfies('python-any', '=', '2.7.16-1'))
+        self.assertTrue(index.satisfies('python-cairo'))
+        self.assertFalse(index.satisfies('python-gtk2'))
+        self.assertEqual(
+            repoindex.check_depends(
+                repoindex.DEB, 'python (>=2.7), python-gtk2 | python-cairo, '
+                               'python (<<2.7)', index),
+            ['python (<< 2.7)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+#   Subprocess runner tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import runner
+
+
+@unittest.skipUnless(os.name == 'posix', 'posix only')
+class RunnerTestCase(unittest.TestCase):
+
+    def test_capture(self):
+        result = runner.run(['sh', '-c', 'echo out; echo err >&2; exit 3'],
+                            capture=True)
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(sorted(result.output.split()), ['err', 'out'])
+        self.assertRaises(runner.RunError, runner.run, ['false'],
+                          check=True)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs procfs')
+    def test_no_inherited_fds(self):
+        # pipe of concurrently started command must not leak into child,
+        # otherwise its reader waits for unrelated child to exit
+        reader, writer = os.pipe()
+        os.dup2(writer, 99)
+        try:
+            result = runner.run(['ls', '/proc/self/fd'], capture=True)
+        finally:
+            for fd in (reader, writer, 99):
+                os.close(fd)
+        fds = set(int(item) for item in result.output.split())
+        self.assertNotIn(99, fds)
+
+    def test_pipeline(self):
+        with tempfile.TemporaryFile() as fileptr:
+            results = runner.pipeline([['printf', 'b\\na\\n'], ['sort']],
+                                      stdout=fileptr, check=True)
+            fileptr.seek(0)
+            self.assertEqual(fileptr.read(), 'a\nb\n')
+        self.assertTrue(all(result.ok for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+#   Install tree staging tests
+#
+# 	Copyright (C) 2026 by sK1 Project contributors
+#
+# 	This program is free software: you can redistribute it and/or modify
+# 	it under the terms of the GNU General Public License as published by
+# 	the Free Software Foundation, either version 3 of the License, or
+# 	(at your option) any later version.
+#
+# 	This program is distributed in the hope that it will be useful,
+# 	but WITHOUT ANY WARRANTY; without even the implied warranty of
+# 	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# 	GNU General Public License for more details.
+#
+# 	You should have received a copy of the GNU General Public License
+# 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import gzip
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+import tempfile
+import unittest
+from cStringIO import StringIO
+from distutils.spawn import find_executable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils import staging
+
+MTIME = 1577836800
+
+
+def read_cpio(data):
+    """
+    Returns list of (name, mode, mtime, content) items of odc archive.
+    """
+    items = []
+    pos = 0
+    while True:
+        header = data[pos:pos + 76]
+        assert header[:6] == '070707', header
+        mode = int(header[18:24], 8)
+        mtime = int(header[48:59], 8)
+        name_size = int(header[59:65], 8)
+        size = int(header[65:76], 8)
+        pos += 76
+        name = data[pos:pos + name_size - 1]
+        pos += name_size
+        if name == 'TRAILER!!!':
+            return items
+        items.append((name, mode, mtime, data[pos:pos + size]))
+        pos += size
+
+
+class StagingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        src = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(os.path.join(src, 'pkg', 'sub'))
+        self.write(os.path.join(src, 'pkg', '__init__.py'), 'VERSION = 1\n')
+        self.write(os.path.join(src, 'pkg', 'sub', 'odd.txt'), 'odd')
+        os.symlink('__init__.py', os.path.join(src, 'pkg', 'alias.py'))
+        script = os.path.join(self.tmp_dir, 'app')
+        self.write(script, '#!/bin/sh\necho app\n')
+        os.chmod(script, 0o700)
+
+        self.manifest = staging.Manifest(mtime=MTIME)
+        self.manifest.add_tree(src, '/usr/lib/python2.7/dist-packages')
+        self.manifest.add_scripts([script])
+        self.manifest.add_data('usr/share/doc/app/copyright', 'GPLv3\n')
+        self.control = staging.Manifest(mtime=MTIME)
+        self.control.add_data('control', 'Package: app\nVersion: 1.0\n'
+                                         'Architecture: all\n'
+                                         'Maintainer: Test <test@localhost>\n'
+                                         'Description: test package\n')
+        self.files = {
+            'usr/lib/python2.7/dist-packages/pkg/__init__.py':
+                (0o644, 'VERSION = 1\n'),
+            'usr/lib/python2.7/dist-packages/pkg/sub/odd.txt': (0o644, 'odd'),
+            'usr/bin/app': (0o755, '#!/bin/sh\necho app\n'),
+            'usr/share/doc/app/copyright': (0o644, 'GPLv3\n'),
+        }
+        self.link = 'usr/lib/python2.7/dist-packages/pkg/alias.py'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, True)
+
+    def write(self, path, data):
+        with open(path, 'wb') as fileptr:
+            fileptr.write(data)
+
+    def test_manifest(self):
+        self.assertIn('/usr/bin/app', self.manifest)
+        self.assertEqual(self.manifest.get(self.link).kind, staging.LINK)
+        self.assertEqual(self.manifest.get('usr/lib').kind, staging.DIR)
+        self.assertEqual(self.manifest.count, 5)
+        self.assertRaises(IOError, self.manifest.add_file, 'x', '/missing')
+
+    def test_write_tar(self):
+        fileptr = StringIO()
+        staging.write_tar(self.manifest, fileptr)
+        fileptr.seek(0)
+        tar = tarfile.open(fileobj=fileptr, mode='r:gz')
+        members = dict((item.name, item) for item in tar.getmembers())
+        self.assertTrue(members['.'].isdir())
+        self.assertTrue(members['./usr/lib'].isdir())
+        for path, (mode, data) in self.files.items():
+            member = members['./' + path]
+            self.assertEqual(member.mode, mode, path)
+            self.assertEqual((member.uid, member.gid), (0, 0))
+            self.assertEqual(member.uname, 'root')
+            self.assertEqual(member.mtime, MTIME)
+            self.assertEqual(tar.extractfile(member).read(), data)
+        self.assertTrue(members['./' + self.link].issym())
+        self.assertEqual(members['./' + self.link].linkname, '__init__.py')
+
+    def test_write_tar_reproducible(self):
+        first, second = StringIO(), StringIO()
+        staging.write_tar(self.manifest, first)
+        staging.write_tar(self.manifest, second)
+        self.assertEqual(first.getvalue(), second.getvalue())
+
+    def test_write_cpio(self):
+        fileptr = StringIO()
+        staging.write_cpio(self.manifest, fileptr)
+        data = gzip.GzipFile(fileobj=StringIO(fileptr.getvalue())).read()
+        items = dict((name, (mode, mtime, content))
+                     for name, mode, mtime, content in read_cpio(data))
+        self.assertTrue(stat.S_ISDIR(items['.'][0]))
+        for path, (mode, content) in self.files.items():
+            self.assertEqual(items['./' + path],
+                             (stat.S_IFREG | mode, MTIME, content), path)
+        self.assertEqual(items['./' + self.link],
+                         (stat.S_IFLNK | 0o777, MTIME, '__init__.py'))
+        self.assertEqual(len(items), len(self.manifest) + 1)
+
+    @unittest.skipUnless(find_executable('cpio'), 'cpio is not installed')
+    def test_cpio_extract(self):
+        archive = os.path.join(self.tmp_dir, 'payload.cpio')
+        with open(archive, 'wb') as fileptr:
+            staging.write_cpio(self.manifest, fileptr, compress=False)
+        dest = os.path.join(self.tmp_dir, 'dest')
+        os.makedirs(dest)
+        with open(archive, 'rb') as fileptr:
+            subprocess.check_call(['cpio', '-idm', '--quiet'],
+                                  stdin=fileptr, cwd=dest)
+        self.check_tree(dest)
+
+    def check_tree(self, dest):
+        for path, (mode, data) in self.files.items():
+            path = os.path.join(dest, path)
+            self.assertEqual(stat.S_IMODE(os.lstat(path).st_mode), mode)
+            with open(path, 'rb') as fileptr:
+                self.assertEqual(fileptr.read(), data)
+        self.assertEqual(os.readlink(os.path.join(dest, self.link)),
+                         '__init__.py')
+
+    def test_extract(self):
+        dest = os.path.join(self.tmp_dir, 'dest')
+        self.manifest.extract(dest)
+        self.check_tree(dest)
+
+    @unittest.skipUnless(find_executable('dpkg-deb'),
+                         'dpkg-deb is not installed')
+    def test_write_deb(self):
+        deb = os.path.join(self.tmp_dir, 'app_1.0_all.deb')
+        staging.write_deb(deb, self.control, self.manifest)
+        info = subprocess.check_output(['dpkg-deb', '-f', deb, 'Package',
+                                        'Version'])
+        self.assertEqual(info.split(), ['Package:', 'app', 'Version:', '1.0'])
+        dest = os.path.join(self.tmp_dir, 'dest')
+        subprocess.check_call(['dpkg-deb', '-x', deb, dest])
+        self.check_tree(dest)
+
+
+if __name__ == '__main__':
+    unittest.main()